@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PageView, ContentInteraction, UserActivity, AnalyticsDashboardPage
+from .models import PageView, ContentInteraction, UserActivity, AnalyticsDashboardPage, RollupWatermark
 
 
 @admin.register(PageView)
@@ -75,4 +75,10 @@ class AnalyticsDashboardPageAdmin(admin.ModelAdmin):
         ('Content', {
             'fields': ('intro', 'content')
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(RollupWatermark)
+class RollupWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('source', 'last_id', 'updated_at')
+    readonly_fields = ('source', 'last_id', 'updated_at')
@@ -2,7 +2,7 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView
-from .views import get_analytics_data
+from .dashboard_cache import dashboard_cache
 
 
 @method_decorator(login_required, name='dispatch')
@@ -11,5 +11,5 @@ class AnalyticsDashboardView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['analytics_data'] = get_analytics_data()
+        context['analytics_data'] = dashboard_cache.get()
         return context
\ No newline at end of file
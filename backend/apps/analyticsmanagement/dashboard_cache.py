@@ -0,0 +1,167 @@
+"""
+Stale-while-revalidate cache for the analytics dashboard payload
+
+The dashboard payload is kept in the shared Django cache together with the
+time it was computed. Within ANALYTICS_DASHBOARD_CACHE_TTL seconds it is
+served as is. After that it is still served straight away for up to
+ANALYTICS_DASHBOARD_STALE_TTL more seconds, while a background thread
+recomputes it. A lock taken with ``cache.add`` makes this single-flight:
+however many admins refresh the dashboard at once, only one worker
+recomputes it, and everyone else gets the stale copy. The only requests that
+wait for a recomputation are the ones that find no copy at all.
+
+Hits, stale hits, misses and refreshes are counted in the shared cache and
+returned by ``stats()``. Setting ANALYTICS_DASHBOARD_CACHE_ASYNC to False
+refreshes inline, which is what the tests use.
+
+Other payloads read the same four settings under their own prefix (e.g.
+SYSTEM_STATS_CACHE_TTL), falling back to the dashboard's defaults.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+STATS = ('hit', 'stale', 'miss', 'refresh', 'error')
+
+
+class CachedPayload:
+    """
+    A cached value recomputed by ``compute`` once it goes stale
+    """
+
+    def __init__(self, key, compute, ttl=None, stale_ttl=None, lock_timeout=None, setting_prefix='ANALYTICS_DASHBOARD'):
+        self.key = key
+        self.compute = compute
+        self.setting_prefix = setting_prefix
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._lock_timeout = lock_timeout
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else self._setting('CACHE_TTL', 300)
+
+    @property
+    def stale_ttl(self):
+        if self._stale_ttl is not None:
+            return self._stale_ttl
+        return self._setting('STALE_TTL', 3600)
+
+    @property
+    def lock_timeout(self):
+        if self._lock_timeout is not None:
+            return self._lock_timeout
+        return self._setting('LOCK_TIMEOUT', 60)
+
+    @property
+    def lock_key(self):
+        return f'{self.key}:lock'
+
+    def get(self):
+        """Return the cached payload, recomputing it if it is missing or stale"""
+        entry = cache.get(self.key)
+        if entry is not None:
+            if time.time() - entry['computed_at'] < self.ttl:
+                self._count('hit')
+            else:
+                self._count('stale')
+                self._revalidate()
+            return entry['data']
+
+        self._count('miss')
+        if cache.add(self.lock_key, True, self.lock_timeout):
+            return self._refresh()
+        # Another worker is computing the first copy; wait for it rather
+        # than computing the same thing in parallel
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(self.key)
+            if entry is not None:
+                return entry['data']
+            if cache.add(self.lock_key, True, self.lock_timeout):
+                return self._refresh()
+        return self.compute()
+
+    def invalidate(self):
+        """Drop the cached payload so the next request recomputes it"""
+        cache.delete(self.key)
+
+    def expire(self):
+        """
+        Mark the cached payload stale: it is still served, for up to
+        stale_ttl seconds, while the next request recomputes it
+        """
+        entry = cache.get(self.key)
+        if entry is not None:
+            entry['computed_at'] = 0
+            cache.set(self.key, entry, self.stale_ttl)
+
+    def stats(self):
+        """Return {counter: value} for the hit/stale/miss/refresh/error counters"""
+        values = cache.get_many([self._stat_key(name) for name in STATS])
+        return {name: values.get(self._stat_key(name), 0) for name in STATS}
+
+    def reset_stats(self):
+        cache.delete_many([self._stat_key(name) for name in STATS])
+
+    def _revalidate(self):
+        if not cache.add(self.lock_key, True, self.lock_timeout):
+            # Somebody is already recomputing it
+            return
+        if self._setting('CACHE_ASYNC', True):
+            threading.Thread(target=self._background_refresh, name=f'refresh-{self.key}', daemon=True).start()
+        else:
+            self._refresh()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception:
+            logger.exception('Failed to refresh %s', self.key)
+        finally:
+            close_old_connections()
+
+    def _refresh(self):
+        # Must be called holding the lock
+        try:
+            data = self.compute()
+        except Exception:
+            self._count('error')
+            raise
+        else:
+            cache.set(self.key, {'data': data, 'computed_at': time.time()}, self.ttl + self.stale_ttl)
+            self._count('refresh')
+            return data
+        finally:
+            cache.delete(self.lock_key)
+
+    def _setting(self, name, default):
+        return getattr(settings, f'{self.setting_prefix}_{name}', default)
+
+    def _stat_key(self, name):
+        return f'{self.key}:stats:{name}'
+
+    def _count(self, name):
+        key = self._stat_key(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.add(key, 1, None)
+
+
+def _compute_dashboard():
+    from .views import get_analytics_data
+
+    return get_analytics_data()
+
+
+dashboard_cache = CachedPayload('analytics_dashboard_payload', _compute_dashboard)
@@ -0,0 +1,256 @@
+"""
+Append-only segment files for analytics events
+
+With ANALYTICS_EVENT_SINK set to ``file``, page views, content interactions
+and user activities are appended as JSON lines to a segment file in
+ANALYTICS_EVENT_LOG_DIR instead of being written to the database, so request
+latency does not depend on database write throughput. Each process writes its
+own segment (``events-<opened at>-<pid>-<n>.ndjson.open``), which is closed by
+renaming it without the ``.open`` suffix once it reaches
+ANALYTICS_SEGMENT_MAX_BYTES or is ANALYTICS_SEGMENT_MAX_AGE seconds old, and
+when the process exits.
+
+Closed segments are bulk-loaded by the ``load_analytics_events`` command and
+kept on disk afterwards (renamed to ``.loaded``), so the raw events can be
+replayed. With the default ``database`` sink events go to the database as
+before.
+"""
+import atexit
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import JSONField
+from django.utils import timezone
+
+from .models import ContentInteraction, LoadedSegment, PageView, UserActivity
+from .page_view_buffer import page_view_buffer
+
+logger = logging.getLogger(__name__)
+
+OPEN_SUFFIX = '.open'
+SEGMENT_SUFFIX = '.ndjson'
+LOADED_SUFFIX = '.loaded'
+
+EVENT_MODELS = {
+    'pageview': PageView,
+    'contentinteraction': ContentInteraction,
+    'useractivity': UserActivity,
+}
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class SegmentLog:
+    """
+    Rotating append-only NDJSON segment file
+    """
+
+    def __init__(self, directory=None, max_bytes=None, max_age=None):
+        self._directory = directory
+        self.max_bytes = max_bytes or getattr(settings, 'ANALYTICS_SEGMENT_MAX_BYTES', 64 * 1024 * 1024)
+        self.max_age = max_age or getattr(settings, 'ANALYTICS_SEGMENT_MAX_AGE', 300)
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = None
+        self._pid = None
+        self._sequence = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def directory(self):
+        return Path(self._directory or settings.ANALYTICS_EVENT_LOG_DIR)
+
+    def write(self, kind, fields):
+        """Append one event to the current segment"""
+        line = json.dumps(
+            {'kind': kind, 'fields': {name: encode_value(value) for name, value in fields.items()}},
+            separators=(',', ':'), default=str,
+        ) + '\n'
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self._open()
+            self._file.write(line)
+            # Hand the line to the OS so a crashed worker loses at most a partial line
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._close()
+        self._ensure_started()
+
+    def rotate(self, force=True):
+        """Close the current segment (if ``force`` or it is due) so it can be loaded"""
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                return None
+            if force or time.monotonic() - self._opened_at >= self.max_age:
+                return self._close()
+        return None
+
+    def closed_segments(self):
+        """Return the paths of closed segments that have not been loaded, oldest first"""
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob(f'events-*{SEGMENT_SUFFIX}'))
+
+    def _open(self):
+        # A forked worker must not keep appending to its parent's segment
+        self._file = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._pid = os.getpid()
+        self._sequence += 1
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S')
+        self._path = self.directory / f'events-{stamp}-{self._pid}-{self._sequence:04d}{SEGMENT_SUFFIX}{OPEN_SUFFIX}'
+        self._file = open(self._path, 'a', encoding='utf-8')
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+        path, self._path = self._path, None
+        closed = path.with_name(path.name[:-len(OPEN_SUFFIX)])
+        try:
+            if path.stat().st_size:
+                os.replace(path, closed)
+                return closed
+            path.unlink()
+        except FileNotFoundError:
+            logger.warning('Analytics segment %s disappeared before it was closed', path)
+        return None
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so forked workers start their own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='analytics-segment-rotator', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        # Close idle segments once they are old enough, even without new writes
+        while not self._stop.wait(min(self.max_age, 60)):
+            try:
+                self.rotate(force=False)
+            except OSError:
+                logger.exception('Failed to rotate analytics segment')
+
+    def stop(self):
+        self._stop.set()
+        self.rotate()
+
+
+segment_log = SegmentLog()
+
+
+def record_event(kind, **fields):
+    """
+    Record an analytics event through the configured sink
+
+    ``kind`` is one of EVENT_MODELS and ``fields`` are model field values
+    (use ``<relation>_id`` for foreign keys).
+    """
+    fields.setdefault('timestamp', timezone.now())
+    if getattr(settings, 'ANALYTICS_EVENT_SINK', 'database') == 'file':
+        segment_log.write(kind, fields)
+    elif kind == 'pageview':
+        page_view_buffer.record(**fields)
+    else:
+        EVENT_MODELS[kind].objects.create(**fields)
+
+
+def read_segment(path):
+    """
+    Return ({kind: [fields]}, number of unreadable lines) for a segment file
+
+    A line cut short by a crash is skipped instead of failing the whole segment.
+    """
+    events = defaultdict(list)
+    skipped = 0
+    with open(path, encoding='utf-8') as segment:
+        for line in segment:
+            try:
+                event = json.loads(line)
+                events[event['kind']].append(event['fields'])
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+    return events, skipped
+
+
+def load_segment(path):
+    """
+    Load a closed segment into the database and mark it as loaded
+
+    Rows are written with ``COPY ... FROM STDIN`` on PostgreSQL and with
+    bulk_create elsewhere. Returns the number of rows loaded, or None if the
+    segment had been loaded before.
+    """
+    path = Path(path)
+    events, skipped = read_segment(path)
+    if skipped:
+        logger.warning('Skipped %d unreadable lines in %s', skipped, path.name)
+    with transaction.atomic():
+        if LoadedSegment.objects.filter(name=path.name).exists():
+            loaded = None
+        else:
+            for kind, rows in events.items():
+                copy_rows(EVENT_MODELS[kind], rows)
+            loaded = sum(len(rows) for rows in events.values())
+            LoadedSegment.objects.create(name=path.name, rows=loaded)
+    # Keep the raw events for replay
+    os.replace(path, path.with_name(path.name + LOADED_SUFFIX))
+    return loaded
+
+
+def copy_rows(model, rows):
+    """Insert rows (dicts of field attnames) into a model's table"""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    if connection.vendor != 'postgresql':
+        model.objects.bulk_create(
+            [model(**{field.attname: row[field.attname] for field in fields if field.attname in row}) for row in rows],
+            batch_size=1000,
+        )
+        return
+
+    data = io.StringIO()
+    for row in rows:
+        data.write(','.join(_csv_value(field, row) for field in fields))
+        data.write('\n')
+    data.seek(0)
+    sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+    )
+    with connection.cursor() as cursor:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(sql, data)
+        else:
+            with cursor.copy(sql) as copy:
+                copy.write(data.getvalue())
+
+
+def _csv_value(field, row):
+    value = row[field.attname] if field.attname in row else field.get_default()
+    if value is None:
+        # An unquoted empty value is NULL in COPY's CSV format
+        return ''
+    if isinstance(field, JSONField):
+        value = json.dumps(value)
+    else:
+        value = encode_value(field.to_python(value))
+    return '"{}"'.format(str(value).replace('"', '""'))
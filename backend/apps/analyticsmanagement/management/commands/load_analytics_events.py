@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.analyticsmanagement.event_log import SegmentLog, load_segment
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load closed analytics event segment files into the database (COPY on PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Segment directory (default: ANALYTICS_EVENT_LOG_DIR)')
+        parser.add_argument('--limit', type=int, help='Load at most this many segments')
+
+    def handle(self, *args, **options):
+        segments = SegmentLog(directory=options['directory']).closed_segments()
+        if options['limit'] is not None:
+            segments = segments[:options['limit']]
+        total = 0
+        for path in segments:
+            loaded = load_segment(path)
+            if loaded is None:
+                self.stdout.write(f'{path.name}: already loaded, skipped')
+            else:
+                total += loaded
+                self.stdout.write(f'{path.name}: {loaded} rows')
+        self.stdout.write(self.style.SUCCESS(f'Loaded {total} rows from {len(segments)} segments'))
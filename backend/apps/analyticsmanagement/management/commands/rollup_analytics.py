@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.analyticsmanagement.rollups import CHUNK_SIZE, SOURCES, rollup_source
+
+
+class Command(BaseCommand):
+    help = 'Fold new PageView, ContentInteraction and UserActivity rows into the hourly/daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=sorted(SOURCES), action='append', help='Only roll up these sources')
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help=f'Rows processed per transaction (default: {CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        for source in options['source'] or SOURCES:
+            processed = rollup_source(source, chunk_size=options['chunk_size'])
+            self.stdout.write(f'{source}: {processed} new rows')
+        self.stdout.write(self.style.SUCCESS('Analytics rollups are up to date'))
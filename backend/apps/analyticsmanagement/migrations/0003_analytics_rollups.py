@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyticsmanagement', '0002_analyticsdashboardpage_contentinteraction_pageview_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalyticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day')),
+                ('metric', models.CharField(choices=[('page_views', 'Page views'), ('content_interactions', 'Content interactions'), ('user_activities', 'User activities')], max_length=30)),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('page', 'Page'), ('content_type', 'Content type'), ('action', 'Action'), ('role', 'Role')], max_length=20)),
+                ('key', models.CharField(blank=True, help_text='Dimension value, empty for totals', max_length=255)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Analytics Rollup',
+                'verbose_name_plural': 'Analytics Rollups',
+                'indexes': [models.Index(fields=['granularity', 'metric', 'dimension', 'bucket'], name='analytics_rollup_lookup')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'metric', 'dimension', 'key'), name='analytics_rollup_unique_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day')),
+                ('sketch', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Visitor Sketch',
+                'verbose_name_plural': 'Visitor Sketches',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket'), name='visitor_sketch_unique_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyticsmanagement', '0005_analytics_event_segments'),
+        ('wagtailcore', '0096_referenceindex_referenceindex_source_object_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pageview',
+            index=models.Index(fields=['timestamp'], name='page_view_timestamp'),
+        ),
+        # On PostgreSQL the table is partitioned by month separately, with
+        # the partition_logs command
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from wagtail.admin.panels import FieldPanel
 from wagtail.models import Page
@@ -35,8 +36,8 @@ class AnalyticsDashboardPage(Page):
         context = super().get_context(request)
         
         # Get analytics data
-        from .views import get_analytics_data
-        context['analytics_data'] = get_analytics_data()
+        from .dashboard_cache import dashboard_cache
+        context['analytics_data'] = dashboard_cache.get()
         
         return context
 
@@ -48,7 +49,8 @@ class PageView(models.Model):
     page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     session_key = models.CharField(max_length=40, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the view is recorded, not when the buffered row is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
     
@@ -56,6 +58,9 @@ class PageView(models.Model):
         verbose_name = "Page View"
         verbose_name_plural = "Page Views"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='page_view_timestamp'),
+        ]
         
     def __str__(self):
         page_title = self.page.title if self.page else "Unknown Page"
@@ -77,7 +82,7 @@ class ContentInteraction(models.Model):
     content_id = models.PositiveIntegerField()
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     action = models.CharField(max_length=50, help_text="Action performed (view, download, submit, etc.)")
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     metadata = models.JSONField(default=dict, blank=True)
     
     class Meta:
@@ -95,7 +100,7 @@ class UserActivity(models.Model):
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=100)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     details = models.JSONField(default=dict, blank=True)
     
     class Meta:
@@ -104,4 +109,98 @@ class UserActivity(models.Model):
         ordering = ['-timestamp']
         
     def __str__(self):
-        return f"{self.user.username} - {self.action} at {self.timestamp}"
\ No newline at end of file
+        return f"{self.user.username} - {self.action} at {self.timestamp}"
+
+
+class RollupGranularity(models.TextChoices):
+    HOUR = 'hour', 'Hour'
+    DAY = 'day', 'Day'
+
+
+class AnalyticsRollup(models.Model):
+    """
+    Pre-aggregated event count for one time bucket and dimension value
+
+    Maintained by the rollup_analytics command (see rollups.py).
+    """
+    METRICS = [
+        ('page_views', 'Page views'),
+        ('content_interactions', 'Content interactions'),
+        ('user_activities', 'User activities'),
+    ]
+    DIMENSIONS = [
+        ('total', 'Total'),
+        ('page', 'Page'),
+        ('content_type', 'Content type'),
+        ('action', 'Action'),
+        ('role', 'Role'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=RollupGranularity.choices)
+    bucket = models.DateTimeField(help_text="Start of the hour or day")
+    metric = models.CharField(max_length=30, choices=METRICS)
+    dimension = models.CharField(max_length=20, choices=DIMENSIONS)
+    key = models.CharField(max_length=255, blank=True, help_text="Dimension value, empty for totals")
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Analytics Rollup"
+        verbose_name_plural = "Analytics Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket', 'metric', 'dimension', 'key'],
+                name='analytics_rollup_unique_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'metric', 'dimension', 'bucket'], name='analytics_rollup_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} by {self.dimension}={self.key} for {self.granularity} {self.bucket}: {self.count}"
+
+
+class VisitorSketch(models.Model):
+    """
+    HyperLogLog sketch of the distinct visitors in one time bucket
+    """
+    granularity = models.CharField(max_length=4, choices=RollupGranularity.choices)
+    bucket = models.DateTimeField(help_text="Start of the hour or day")
+    sketch = models.BinaryField()
+
+    class Meta:
+        verbose_name = "Visitor Sketch"
+        verbose_name_plural = "Visitor Sketches"
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket'], name='visitor_sketch_unique_bucket'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """
+    Highest raw row id of a source model already folded into the rollups
+    """
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} up to #{self.last_id}"
+
+
+class LoadedSegment(models.Model):
+    """
+    Analytics event segment file already loaded by load_analytics_events
+
+    Recorded in the same transaction as the loaded rows, so a segment is
+    never loaded twice.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    rows = models.PositiveIntegerField(default=0)
+    loaded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-loaded_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.rows} rows)"
@@ -0,0 +1,156 @@
+"""
+Buffered, non-blocking PageView ingestion
+
+Serving a page only appends the view's fields to an in-memory ring buffer
+of PAGE_VIEW_BUFFER_SIZE entries. A daemon thread drains it every
+PAGE_VIEW_FLUSH_INTERVAL milliseconds, or sooner once PAGE_VIEW_BATCH_SIZE
+views are pending, and writes them with bulk_create. The INSERT is no longer
+part of the response time.
+
+When the buffer fills faster than it drains, views are sampled. Above
+PAGE_VIEW_SAMPLE_THRESHOLD of capacity, the fraction of views kept falls
+linearly towards PAGE_VIEW_MIN_SAMPLE_RATE as the buffer approaches full.
+If the buffer is completely full, the oldest views are overwritten. Both
+kinds of loss are counted. Pending views are flushed when the process
+exits. Setting PAGE_VIEW_ASYNC to False writes every view inline, which is
+what the tests use.
+"""
+import atexit
+import logging
+import random
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import PageView
+
+logger = logging.getLogger(__name__)
+
+
+class PageViewBuffer:
+    """
+    Ring buffer of pending page views drained by a background thread
+    """
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None,
+                 sample_threshold=None, min_sample_rate=None):
+        self.max_size = max_size or getattr(settings, 'PAGE_VIEW_BUFFER_SIZE', 20000)
+        self.batch_size = batch_size or getattr(settings, 'PAGE_VIEW_BATCH_SIZE', 1000)
+        # Milliseconds between flushes when the batch size is not reached
+        self.flush_interval = flush_interval or getattr(settings, 'PAGE_VIEW_FLUSH_INTERVAL', 2000)
+        self.sample_threshold = (
+            sample_threshold if sample_threshold is not None
+            else getattr(settings, 'PAGE_VIEW_SAMPLE_THRESHOLD', 0.5)
+        )
+        self.min_sample_rate = (
+            min_sample_rate if min_sample_rate is not None
+            else getattr(settings, 'PAGE_VIEW_MIN_SAMPLE_RATE', 0.1)
+        )
+        self.sampled_out = 0
+        self.overwritten = 0
+        # deque.append and popleft are atomic, so recording needs no lock
+        self._buffer = deque(maxlen=self.max_size)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample_rate(self):
+        """Fraction of new views currently kept"""
+        fill = len(self._buffer) / self.max_size
+        if fill <= self.sample_threshold:
+            return 1.0
+        headroom = (1 - fill) / (1 - self.sample_threshold)
+        return max(self.min_sample_rate, headroom)
+
+    def record(self, **fields):
+        """
+        Queue a page view without blocking. Returns False if it was sampled out.
+        """
+        rate = self.sample_rate()
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            if self.sampled_out == 1 or self.sampled_out % 1000 == 0:
+                logger.warning('Page view buffer under pressure, %d views sampled out so far', self.sampled_out)
+            return False
+        fields.setdefault('timestamp', timezone.now())
+        if len(self._buffer) == self.max_size:
+            self.overwritten += 1
+        self._buffer.append(fields)
+        if getattr(settings, 'PAGE_VIEW_ASYNC', True):
+            self._ensure_started()
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+        else:
+            self.flush()
+        return True
+
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self, max_rows=None):
+        """
+        Insert buffered views in batches and return the number written
+        """
+        written = 0
+        with self._flush_lock:
+            while max_rows is None or written < max_rows:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                written += self._write_batch(batch)
+        return written
+
+    def stop(self, timeout=5):
+        """Stop the background thread and write everything still buffered"""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # Writes on the caller's connection, which is the caller's to close
+        self.flush()
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._buffer.popleft())
+            except IndexError:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        try:
+            PageView.objects.bulk_create([PageView(**fields) for fields in batch], batch_size=self.batch_size)
+        except Exception:
+            # Losing a batch of page views must never take the worker down
+            logger.exception('Failed to write %d page views', len(batch))
+            return 0
+        return len(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='page-view-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        interval = self.flush_interval / 1000
+        while not self._stop.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self.pending():
+                self.flush(max_rows=self.batch_size * 10)
+                close_old_connections()
+
+
+page_view_buffer = PageViewBuffer()
@@ -0,0 +1,232 @@
+"""
+Incremental hourly and daily rollups of the raw analytics tables
+
+``rollup_analytics`` folds PageView, ContentInteraction and UserActivity
+rows newer than each source's RollupWatermark into AnalyticsRollup counts
+(per page, content type, action and role, plus totals) and into
+VisitorSketch HyperLogLog sketches of distinct visitors. Each run only reads
+rows it has not seen before, so its cost depends on the traffic since the
+previous run instead of on the size of the tables.
+
+Rows younger than ANALYTICS_ROLLUP_LAG seconds are left for the next run so
+that rows from transactions still in flight, which may have lower ids, are
+not skipped.
+
+``get_rollup_summary`` answers the analytics dashboard from the rollups.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q, Sum
+from django.utils import timezone
+
+from .hll import HyperLogLog
+from .models import (
+    AnalyticsRollup, ContentInteraction, PageView, RollupGranularity, RollupWatermark, UserActivity,
+    VisitorSketch,
+)
+
+HOUR = RollupGranularity.HOUR
+DAY = RollupGranularity.DAY
+CHUNK_SIZE = 5000
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment):
+    """Start of the local day containing moment"""
+    return timezone.make_aware(datetime.combine(timezone.localdate(moment), time.min))
+
+
+class RollupBatch:
+    """
+    Counts and visitor sketches accumulated in memory before being written
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.sketches = {}
+
+    def count(self, timestamp, metric, dimension, key=''):
+        for granularity, bucket in ((HOUR, hour_bucket(timestamp)), (DAY, day_bucket(timestamp))):
+            self.counts[(granularity, bucket, metric, dimension, str(key)[:255])] += 1
+
+    def visit(self, timestamp, visitor):
+        for granularity, bucket in ((HOUR, hour_bucket(timestamp)), (DAY, day_bucket(timestamp))):
+            sketch = self.sketches.get((granularity, bucket))
+            if sketch is None:
+                sketch = self.sketches[(granularity, bucket)] = HyperLogLog()
+            sketch.add(visitor)
+
+    def save(self):
+        """Add the batch to the stored rollups"""
+        self._save_counts()
+        self._save_sketches()
+
+    def _save_counts(self):
+        if not self.counts:
+            return
+        buckets = defaultdict(set)
+        for granularity, bucket, *_ in self.counts:
+            buckets[granularity].add(bucket)
+        existing = {
+            (rollup.granularity, rollup.bucket, rollup.metric, rollup.dimension, rollup.key): rollup
+            for rollup in AnalyticsRollup.objects.filter(
+                Q(granularity=HOUR, bucket__in=buckets[HOUR]) | Q(granularity=DAY, bucket__in=buckets[DAY])
+            )
+        }
+        to_create, to_update = [], []
+        for rollup_key, count in self.counts.items():
+            rollup = existing.get(rollup_key)
+            if rollup is None:
+                granularity, bucket, metric, dimension, key = rollup_key
+                to_create.append(AnalyticsRollup(
+                    granularity=granularity, bucket=bucket, metric=metric, dimension=dimension, key=key, count=count
+                ))
+            else:
+                rollup.count += count
+                to_update.append(rollup)
+        AnalyticsRollup.objects.bulk_create(to_create, batch_size=1000)
+        AnalyticsRollup.objects.bulk_update(to_update, ['count'], batch_size=1000)
+
+    def _save_sketches(self):
+        if not self.sketches:
+            return
+        existing = {
+            (stored.granularity, stored.bucket): stored
+            for stored in VisitorSketch.objects.filter(
+                Q(granularity=HOUR, bucket__in=[b for g, b in self.sketches if g == HOUR])
+                | Q(granularity=DAY, bucket__in=[b for g, b in self.sketches if g == DAY])
+            )
+        }
+        to_create, to_update = [], []
+        for (granularity, bucket), sketch in self.sketches.items():
+            stored = existing.get((granularity, bucket))
+            if stored is None:
+                to_create.append(VisitorSketch(granularity=granularity, bucket=bucket, sketch=sketch.to_bytes()))
+            else:
+                stored.sketch = sketch.merge(HyperLogLog.from_bytes(stored.sketch)).to_bytes()
+                to_update.append(stored)
+        VisitorSketch.objects.bulk_create(to_create, batch_size=500)
+        VisitorSketch.objects.bulk_update(to_update, ['sketch'], batch_size=500)
+
+
+def _page_views(batch, rows):
+    for _, timestamp, page_id, ip_address in rows:
+        batch.count(timestamp, 'page_views', 'total')
+        if page_id is not None:
+            batch.count(timestamp, 'page_views', 'page', page_id)
+        batch.visit(timestamp, ip_address or '')
+
+
+def _content_interactions(batch, rows):
+    for _, timestamp, content_type, action in rows:
+        batch.count(timestamp, 'content_interactions', 'total')
+        batch.count(timestamp, 'content_interactions', 'content_type', content_type)
+        batch.count(timestamp, 'content_interactions', 'action', action)
+
+
+def _user_activities(batch, rows):
+    from django.contrib.auth import get_user_model
+
+    groups = defaultdict(list)
+    user_ids = {user_id for _, _, user_id, _ in rows}
+    memberships = get_user_model().groups.through.objects.filter(user_id__in=user_ids)
+    for user_id, group_name in memberships.values_list('user_id', 'group__name'):
+        groups[user_id].append(group_name)
+    for _, timestamp, user_id, action in rows:
+        batch.count(timestamp, 'user_activities', 'total')
+        batch.count(timestamp, 'user_activities', 'action', action)
+        for group_name in groups[user_id]:
+            batch.count(timestamp, 'user_activities', 'role', group_name)
+
+
+# source name: (model, columns read, function folding rows into a batch)
+SOURCES = {
+    'pageview': (PageView, ('id', 'timestamp', 'page_id', 'ip_address'), _page_views),
+    'contentinteraction': (ContentInteraction, ('id', 'timestamp', 'content_type', 'action'), _content_interactions),
+    'useractivity': (UserActivity, ('id', 'timestamp', 'user_id', 'action'), _user_activities),
+}
+
+
+def rollup_source(source, now=None, chunk_size=CHUNK_SIZE):
+    """
+    Fold the new rows of one source into the rollups; returns the number of rows
+    """
+    model, columns, fold = SOURCES[source]
+    now = now or timezone.now()
+    lag = timedelta(seconds=getattr(settings, 'ANALYTICS_ROLLUP_LAG', 60))
+    processed = 0
+    while True:
+        with transaction.atomic():
+            # Locking the watermark keeps concurrent runs from counting rows twice
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(source=source)
+            new_rows = model.objects.filter(id__gt=watermark.last_id)
+            # Stop before the first row that is still too young
+            unsettled = new_rows.filter(timestamp__gt=now - lag).aggregate(first=Min('id'))['first']
+            if unsettled is not None:
+                new_rows = new_rows.filter(id__lt=unsettled)
+            rows = list(new_rows.order_by('id').values_list(*columns)[:chunk_size])
+            if not rows:
+                return processed
+            batch = RollupBatch()
+            fold(batch, rows)
+            batch.save()
+            watermark.last_id = rows[-1][0]
+            watermark.save(update_fields=['last_id', 'updated_at'])
+            processed += len(rows)
+
+
+def rollup_analytics(now=None, chunk_size=CHUNK_SIZE):
+    """Roll up every source; returns {source: rows processed}"""
+    return {source: rollup_source(source, now=now, chunk_size=chunk_size) for source in SOURCES}
+
+
+def get_rollup_summary(days=30, now=None):
+    """
+    Aggregate the rollups of the last ``days`` days
+
+    The partial first day is read from hourly buckets and every following
+    day, including today, from daily buckets.
+    """
+    now = now or timezone.now()
+    start = now - timedelta(days=days)
+    first_full_day = day_bucket(start) + timedelta(days=1)
+    window = (
+        Q(granularity=HOUR, bucket__gte=hour_bucket(start), bucket__lt=first_full_day)
+        | Q(granularity=DAY, bucket__gte=first_full_day, bucket__lte=now)
+    )
+
+    totals = defaultdict(Counter)
+    rows = AnalyticsRollup.objects.filter(window).values('metric', 'dimension', 'key').annotate(total=Sum('count'))
+    for row in rows:
+        totals[(row['metric'], row['dimension'])][row['key']] = row['total']
+
+    visitors = HyperLogLog()
+    for sketch in VisitorSketch.objects.filter(window).values_list('sketch', flat=True):
+        visitors.merge(HyperLogLog.from_bytes(sketch))
+
+    return {
+        'page_views': totals[('page_views', 'total')][''],
+        'unique_visitors': visitors.count(),
+        'user_activities': totals[('user_activities', 'total')][''],
+        'pages': totals[('page_views', 'page')],
+        'content_types': totals[('content_interactions', 'content_type')],
+        'interaction_actions': totals[('content_interactions', 'action')],
+        'activity_actions': totals[('user_activities', 'action')],
+        'roles': totals[('user_activities', 'role')],
+    }
+
+
+def get_daily_counts(metric, days=7, now=None):
+    """Return [(day, count)] of a metric's daily totals for the last ``days`` days, oldest first"""
+    now = now or timezone.now()
+    first_day = day_bucket(now - timedelta(days=days))
+    rows = AnalyticsRollup.objects.filter(
+        granularity=DAY, metric=metric, dimension='total', bucket__gte=first_day, bucket__lte=now
+    ).order_by('bucket').values_list('bucket', 'count')
+    return [(timezone.localdate(bucket), count) for bucket, count in rows]
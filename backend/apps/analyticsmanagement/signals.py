@@ -1,7 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from wagtail.models import Page
-from .models import PageView
+from .event_log import record_event
 
 
 # This signal handler would track page views automatically
@@ -9,22 +9,46 @@ from .models import PageView
 def track_page_view(request, page):
     """
     Helper function to track page views
-    This would be called from appropriate views or middleware
+    This would be called from appropriate views or middleware. The view is
+    queued in the page view buffer and written in bulk later, or appended to
+    the event log file when ANALYTICS_EVENT_SINK is "file".
     """
     if request.user.is_authenticated:
         user = request.user
     else:
         user = None
         
-    PageView.objects.create(
-        page=page,
-        user=user,
-        session_key=request.session.session_key or '',
+    record_event(
+        'pageview',
+        page_id=page.pk,
+        user_id=user.pk if user else None,
+        session_key=getattr(getattr(request, 'session', None), 'session_key', None) or '',
         ip_address=get_client_ip(request),
         user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
     )
 
 
+def track_content_interaction(user, content_type, content_id, action, metadata=None):
+    """
+    Helper function to track an interaction with a page, document, image or form
+    """
+    record_event(
+        'contentinteraction',
+        content_type=content_type,
+        content_id=content_id,
+        user_id=user.pk if user is not None and user.is_authenticated else None,
+        action=action,
+        metadata=metadata or {},
+    )
+
+
+def track_user_activity(user, action, details=None):
+    """
+    Helper function to track an activity of a logged in user
+    """
+    record_event('useractivity', user_id=user.pk, action=action, details=details or {})
+
+
 def get_client_ip(request):
     """
     Helper function to get client IP address
@@ -1,3 +1,334 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth.models import AnonymousUser, Group
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import ResolverMatch
+from django.utils import timezone
+from wagtail.models import Page
+from apps.usermanagement.models import Role
+from .dashboard_cache import CachedPayload
+from .event_log import SegmentLog, load_segment, segment_log
+from .hll import HyperLogLog
+from .middleware import AnalyticsMiddleware
+from .models import AnalyticsRollup, ContentInteraction, LoadedSegment, PageView, RollupWatermark, UserActivity
+from .page_view_buffer import PageViewBuffer, page_view_buffer
+from .rollups import rollup_analytics
+from .signals import track_content_interaction, track_user_activity
+from .views import get_analytics_data
 
-# Create your tests here.
+User = get_user_model()
+
+
+class HyperLogLogTest(TestCase):
+    def test_estimates_and_merges(self):
+        """Test that estimates are within a few percent and merging unions the sets"""
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f'10.0.{i // 256}.{i % 256}')
+        for i in range(10000, 30000):
+            second.add(f'10.0.{i // 256}.{i % 256}')
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.05)
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(merged.count(), 30000, delta=30000 * 0.05)
+
+    def test_small_counts_are_exact(self):
+        sketch = HyperLogLog()
+        for value in ['a', 'b', 'c', 'a']:
+            sketch.add(value)
+        self.assertEqual(sketch.count(), 3)
+
+
+class AnalyticsRollupTest(TestCase):
+    def setUp(self):
+        role, _ = Role.objects.get_or_create(name='Visitor', description='Visitor')
+        self.editor = User.objects.create_user(email='editor@example.com', username='editor', password='x', role=role)
+        self.editor.groups.add(Group.objects.create(name='Editor'))
+        self.pages = list(Page.objects.order_by('pk')[:2])
+        self.now = timezone.now()
+
+    def record(self, hours_ago, pages=3, interactions=2, activities=1):
+        timestamp = self.now - timedelta(hours=hours_ago)
+        created = []
+        for i in range(pages):
+            created.append(PageView.objects.create(page=self.pages[i % 2], ip_address=f'10.0.0.{i % 2}'))
+        for i in range(interactions):
+            created.append(ContentInteraction.objects.create(
+                content_type='document' if i % 2 else 'image', content_id=i, action='download'
+            ))
+        for _ in range(activities):
+            created.append(UserActivity.objects.create(user=self.editor, action='login'))
+        for row in created:
+            type(row).objects.filter(pk=row.pk).update(timestamp=timestamp)
+
+    def rollup_count(self, granularity, metric, dimension, key=''):
+        return sum(AnalyticsRollup.objects.filter(
+            granularity=granularity, metric=metric, dimension=dimension, key=key
+        ).values_list('count', flat=True))
+
+    def test_rollups_match_raw_rows(self):
+        """Test that hourly and daily rollups add up to the raw tables"""
+        self.record(hours_ago=50)
+        self.record(hours_ago=3, pages=4)
+        self.assertEqual(
+            rollup_analytics(now=self.now),
+            {'pageview': 7, 'contentinteraction': 4, 'useractivity': 2},
+        )
+        for granularity in ('hour', 'day'):
+            self.assertEqual(self.rollup_count(granularity, 'page_views', 'total'), 7)
+            self.assertEqual(self.rollup_count(granularity, 'page_views', 'page', self.pages[0].pk), 4)
+            self.assertEqual(self.rollup_count(granularity, 'content_interactions', 'content_type', 'image'), 2)
+            self.assertEqual(self.rollup_count(granularity, 'user_activities', 'role', 'Editor'), 2)
+        self.assertEqual(AnalyticsRollup.objects.filter(granularity='hour', dimension='total').count(), 6)
+
+    def test_incremental_runs_only_read_new_rows(self):
+        """Test that the watermark makes each run count only rows it has not seen"""
+        self.record(hours_ago=5)
+        rollup_analytics(now=self.now)
+        self.assertEqual(rollup_analytics(now=self.now)['pageview'], 0)
+
+        self.record(hours_ago=5, pages=2)
+        self.assertEqual(rollup_analytics(now=self.now)['pageview'], 2)
+        self.assertEqual(self.rollup_count('day', 'page_views', 'total'), 5)
+        self.assertEqual(
+            RollupWatermark.objects.get(source='pageview').last_id, PageView.objects.order_by('-id')[0].id
+        )
+
+    def test_recent_rows_wait_for_the_next_run(self):
+        """Test that rows younger than the lag are left for a later run"""
+        self.record(hours_ago=0, pages=2)
+        self.assertEqual(rollup_analytics(now=self.now)['pageview'], 0)
+        self.assertEqual(rollup_analytics(now=self.now + timedelta(minutes=5))['pageview'], 2)
+
+    def test_dashboard_reads_rollups(self):
+        """Test that the dashboard data comes from the rollups in a fixed number of queries"""
+        self.record(hours_ago=24 * 40)  # outside the 30-day window
+        self.record(hours_ago=30)
+        self.record(hours_ago=2, pages=5)
+        rollup_analytics()
+
+        with self.assertNumQueries(4):
+            data = get_analytics_data()
+        self.assertEqual(data['total_views'], 8)
+        self.assertEqual(data['unique_visitors'], 2)
+        self.assertEqual(data['total_activities'], 2)
+        self.assertEqual(data['content_interactions'], [
+            {'content_type': 'document', 'count': 2}, {'content_type': 'image', 'count': 2},
+        ])
+        self.assertEqual(data['top_pages'][0], {'page__title': self.pages[0].title, 'count': 5})
+        self.assertEqual(data['user_activity_by_role'], [{'user__groups__name': 'Editor', 'count': 2}])
+        self.assertEqual(sum(day['count'] for day in data['daily_activities']), 2)
+
+
+@override_settings(ANALYTICS_DASHBOARD_CACHE_ASYNC=False)
+class CachedPayloadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.payload = CachedPayload('test_payload', self.compute, ttl=60, stale_ttl=600, lock_timeout=1)
+
+    def compute(self):
+        self.calls += 1
+        return {'calls': self.calls}
+
+    def expire(self):
+        entry = cache.get(self.payload.key)
+        entry['computed_at'] -= 120
+        cache.set(self.payload.key, entry)
+
+    def test_fresh_payload_is_computed_once(self):
+        """Test that a fresh payload is served from the cache without recomputing it"""
+        self.assertEqual(self.payload.get(), {'calls': 1})
+        self.assertEqual(self.payload.get(), {'calls': 1})
+        self.assertEqual(self.payload.stats(), {'hit': 1, 'stale': 0, 'miss': 1, 'refresh': 1, 'error': 0})
+
+    def test_stale_payload_is_served_while_refreshing(self):
+        """Test that a stale payload is returned as is and replaced for the next request"""
+        self.payload.get()
+        self.expire()
+        self.assertEqual(self.payload.get(), {'calls': 1})
+        self.assertEqual(self.payload.get(), {'calls': 2})
+        self.assertEqual(self.payload.stats()['stale'], 1)
+
+    def test_single_flight_refresh(self):
+        """Test that only the holder of the lock recomputes a stale payload"""
+        self.payload.get()
+        self.expire()
+        cache.add(self.payload.lock_key, True)
+        for _ in range(5):
+            self.assertEqual(self.payload.get(), {'calls': 1})
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_misses_compute_once(self):
+        """Test that requests finding no payload wait for the one computing it"""
+        started, release = threading.Event(), threading.Event()
+
+        def slow_compute():
+            started.set()
+            release.wait(5)
+            return self.compute()
+
+        self.payload.compute = slow_compute
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.payload.get()))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(self.payload.get()))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, [{'calls': 1}, {'calls': 1}])
+        self.assertEqual(self.calls, 1)
+
+    def test_failed_refresh_releases_lock(self):
+        """Test that a computation that raises releases the lock and counts an error"""
+        self.payload.compute = mock.Mock(side_effect=RuntimeError)
+        with self.assertRaises(RuntimeError):
+            self.payload.get()
+        self.assertIsNone(cache.get(self.payload.lock_key))
+        self.assertEqual(self.payload.stats()['error'], 1)
+
+
+@override_settings(PAGE_VIEW_ASYNC=False)
+class PageViewBufferTest(TestCase):
+    def setUp(self):
+        self.page = Page.objects.order_by('pk').first()
+
+    @override_settings(PAGE_VIEW_ASYNC=True)
+    def test_views_are_written_in_bulk(self):
+        """Test that recording only buffers and a flush writes everything in one INSERT"""
+        buffer = PageViewBuffer(max_size=100, batch_size=50)
+        with mock.patch.object(buffer, '_ensure_started'), self.assertNumQueries(0):
+            for i in range(30):
+                buffer.record(page_id=self.page.pk, ip_address=f'10.0.0.{i}')
+        self.assertEqual(buffer.pending(), 30)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 30)
+        self.assertEqual(PageView.objects.count(), 30)
+
+    @override_settings(PAGE_VIEW_ASYNC=True)
+    def test_samples_under_overload(self):
+        """Test that views are sampled above the threshold and the oldest are overwritten when full"""
+        buffer = PageViewBuffer(max_size=10, sample_threshold=0.5, min_sample_rate=0.1)
+        with mock.patch.object(buffer, '_ensure_started'), \
+                mock.patch('apps.analyticsmanagement.page_view_buffer.random.random', return_value=0.99):
+            for i in range(6):
+                self.assertTrue(buffer.record(page_id=self.page.pk, session_key=str(i)))
+            with self.assertLogs('apps.analyticsmanagement.page_view_buffer', 'WARNING'):
+                self.assertFalse(buffer.record(page_id=self.page.pk))
+        self.assertEqual(buffer.sampled_out, 1)
+
+        with mock.patch.object(buffer, '_ensure_started'), \
+                mock.patch('apps.analyticsmanagement.page_view_buffer.random.random', return_value=0.0):
+            for i in range(6, 12):
+                buffer.record(page_id=self.page.pk, session_key=str(i))
+        self.assertEqual(buffer.sample_rate(), 0.1)
+        self.assertEqual(buffer.overwritten, 2)
+        self.assertEqual([fields['session_key'] for fields in buffer._buffer][:2], ['2', '3'])
+
+    @override_settings(PAGE_VIEW_ASYNC=True)
+    def test_stop_writes_pending_views(self):
+        """Test that stopping writes what is buffered and leaves the caller's connection usable"""
+        buffer = PageViewBuffer()
+        with mock.patch.object(buffer, '_ensure_started'):
+            buffer.record(page_id=self.page.pk)
+        buffer.stop()
+        self.assertEqual(PageView.objects.count(), 1)
+
+    def test_timestamp_is_recording_time(self):
+        buffer = PageViewBuffer()
+        recorded_at = timezone.now() - timedelta(minutes=5)
+        buffer.record(page_id=self.page.pk, timestamp=recorded_at)
+        self.assertEqual(PageView.objects.get().timestamp, recorded_at)
+
+
+@override_settings(PAGE_VIEW_ASYNC=False)
+class AnalyticsMiddlewareTest(TestCase):
+    def setUp(self):
+        self.page = Page.objects.order_by('pk').first()
+        self.middleware = AnalyticsMiddleware(lambda request: HttpResponse())
+
+    def make_request(self, url_name):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.1.2.3', HTTP_USER_AGENT='test')
+        request.user = AnonymousUser()
+        request.current_page = self.page
+        request.resolver_match = ResolverMatch(lambda request: None, (), {}, url_name=url_name)
+        return request
+
+    def test_tracks_served_pages_from_resolver_match(self):
+        """Test that the request's resolver match is used instead of resolving the path again"""
+        with mock.patch('django.urls.resolve') as resolve:
+            self.middleware.process_response(self.make_request('wagtail_serve'), HttpResponse())
+        resolve.assert_not_called()
+        view = PageView.objects.get()
+        self.assertEqual((view.page_id, view.ip_address, view.user_agent), (self.page.pk, '10.1.2.3', 'test'))
+
+    def test_ignores_other_views_and_errors(self):
+        self.middleware.process_response(self.make_request('api-root'), HttpResponse())
+        self.middleware.process_response(self.make_request('wagtail_serve'), HttpResponse(status=404))
+        self.assertFalse(PageView.objects.exists())
+        self.assertEqual(page_view_buffer.pending(), 0)
+
+
+class EventLogTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        role, _ = Role.objects.get_or_create(name='Visitor', description='Visitor')
+        self.user = User.objects.create_user(email='visitor@example.com', username='visitor', password='x', role=role)
+        self.page = Page.objects.order_by('pk').first()
+
+    def test_file_sink_writes_no_rows(self):
+        """Test that with the file sink events are only appended to the open segment"""
+        with override_settings(ANALYTICS_EVENT_SINK='file', ANALYTICS_EVENT_LOG_DIR=self.directory):
+            self.addCleanup(segment_log.rotate)
+            with self.assertNumQueries(0):
+                track_user_activity(self.user, 'login')
+                track_content_interaction(self.user, 'document', 7, 'download', {'size': 10})
+            self.assertEqual(segment_log.closed_segments(), [])
+            closed = segment_log.rotate()
+        self.assertEqual(closed.suffix, '.ndjson')
+        self.assertEqual(len(closed.read_text().splitlines()), 2)
+        self.assertFalse(UserActivity.objects.exists())
+
+    def test_segments_rotate_by_size(self):
+        log = SegmentLog(directory=self.directory, max_bytes=300)
+        for i in range(10):
+            log.write('pageview', {'page_id': self.page.pk, 'session_key': f'session-{i}'})
+        log.rotate()
+        segments = log.closed_segments()
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(sum(len(path.read_text().splitlines()) for path in segments), 10)
+
+    def test_load_closed_segments(self):
+        """Test that closed segments are loaded once with their original timestamps"""
+        recorded_at = timezone.now() - timedelta(hours=2)
+        log = SegmentLog(directory=self.directory)
+        log.write('pageview', {'page_id': self.page.pk, 'ip_address': '10.0.0.1', 'timestamp': recorded_at})
+        log.write('useractivity', {'user_id': self.user.pk, 'action': 'login', 'details': {'app': 'ios'}})
+        log.write('contentinteraction', {'content_type': 'image', 'content_id': 3, 'action': 'view'})
+        segment = log.rotate()
+        with open(segment, 'a') as f:
+            f.write('{"kind": "pagevi')  # cut short by a crash
+
+        with self.assertLogs('apps.analyticsmanagement.event_log', 'WARNING'):
+            call_command('load_analytics_events', directory=self.directory, stdout=io.StringIO())
+        self.assertEqual(PageView.objects.get().timestamp, recorded_at)
+        self.assertEqual(UserActivity.objects.get().details, {'app': 'ios'})
+        self.assertEqual(ContentInteraction.objects.get().metadata, {})
+        self.assertEqual(LoadedSegment.objects.get().rows, 3)
+        self.assertEqual(log.closed_segments(), [])
+
+        # A segment that reappears (e.g. restored from a backup) is not loaded twice
+        shutil.copy(f'{segment}.loaded', segment)
+        with self.assertLogs('apps.analyticsmanagement.event_log', 'WARNING'):
+            self.assertIsNone(load_segment(segment))
+        self.assertEqual(PageView.objects.count(), 1)
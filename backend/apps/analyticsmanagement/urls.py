@@ -8,4 +8,5 @@ app_name = 'analyticsmanagement'
 urlpatterns = [
     path('dashboard/', AnalyticsDashboardView.as_view(), name='analytics_dashboard'),
     path('api/data/', views.analytics_dashboard_api, name='analytics_api'),
+    path('api/cache-stats/', views.analytics_cache_stats, name='analytics_cache_stats'),
 ]
\ No newline at end of file
@@ -1,9 +1,10 @@
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
-from datetime import datetime, timedelta
-from .models import PageView, ContentInteraction, UserActivity
+from wagtail.models import Page
+from .dashboard_cache import dashboard_cache
+from .rollups import get_daily_counts, get_rollup_summary
 
 User = get_user_model()
 
@@ -11,62 +12,42 @@ User = get_user_model()
 def get_analytics_data():
     """
     Function to gather analytics data for the dashboard
+
+    Reads the hourly/daily rollups maintained by the rollup_analytics command
+    instead of scanning the raw PageView, UserActivity and ContentInteraction
+    tables, so rows newer than the last rollup run are not included yet.
     """
-    # Calculate date range (last 30 days)
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=30)
-    
-    # Total page views
-    total_views = PageView.objects.filter(
-        timestamp__range=[start_date, end_date]
-    ).count()
-    
-    # Total unique visitors
-    unique_visitors = PageView.objects.filter(
-        timestamp__range=[start_date, end_date]
-    ).values('ip_address').distinct().count()
-    
-    # Total user activities
-    total_activities = UserActivity.objects.filter(
-        timestamp__range=[start_date, end_date]
-    ).count()
-    
-    # Content interactions by type
-    content_interactions = ContentInteraction.objects.filter(
-        timestamp__range=[start_date, end_date]
-    ).values('content_type').annotate(count=Count('id'))
-    
-    # User activity by day (last 7 days)
-    week_start = end_date - timedelta(days=7)
-    daily_activities = UserActivity.objects.filter(
-        timestamp__range=[week_start, end_date]
-    ).extra(select={'day': 'date(timestamp)'}).values('day').annotate(
-        count=Count('id')
-    ).order_by('day')
-    
+    # Last 30 days
+    summary = get_rollup_summary(days=30)
+
     # Top pages viewed
-    top_pages = PageView.objects.filter(
-        timestamp__range=[start_date, end_date],
-        page__isnull=False
-    ).values('page__title').annotate(
-        count=Count('id')
-    ).order_by('-count')[:5]
-    
-    # User activity by role
-    user_activity_by_role = UserActivity.objects.filter(
-        timestamp__range=[start_date, end_date]
-    ).values('user__groups__name').annotate(
-        count=Count('id')
-    ).exclude(user__groups__name__isnull=True)
-    
+    top_page_ids = [page_id for page_id, _ in summary['pages'].most_common(5)]
+    titles = dict(Page.objects.filter(pk__in=top_page_ids).values_list('pk', 'title'))
+    top_pages = [
+        {'page__title': titles[int(page_id)], 'count': count}
+        for page_id, count in summary['pages'].most_common(5)
+        if int(page_id) in titles
+    ]
+
+    # User activity by day (last 7 days)
+    daily_activities = [
+        {'day': day.isoformat(), 'count': count}
+        for day, count in get_daily_counts('user_activities', days=7)
+    ]
+
     return {
-        'total_views': total_views,
-        'unique_visitors': unique_visitors,
-        'total_activities': total_activities,
-        'content_interactions': list(content_interactions),
-        'daily_activities': list(daily_activities),
-        'top_pages': list(top_pages),
-        'user_activity_by_role': list(user_activity_by_role),
+        'total_views': summary['page_views'],
+        'unique_visitors': summary['unique_visitors'],
+        'total_activities': summary['user_activities'],
+        'content_interactions': [
+            {'content_type': content_type, 'count': count}
+            for content_type, count in sorted(summary['content_types'].items())
+        ],
+        'daily_activities': daily_activities,
+        'top_pages': top_pages,
+        'user_activity_by_role': [
+            {'user__groups__name': role, 'count': count} for role, count in sorted(summary['roles'].items())
+        ],
     }
 
 
@@ -74,15 +55,23 @@ def analytics_dashboard_api(request):
     """
     API endpoint to provide analytics data for charts
     """
-    data = get_analytics_data()
+    data = dashboard_cache.get()
     return JsonResponse(data)
 
 
+@staff_member_required
+def analytics_cache_stats(request):
+    """
+    Hit/miss counters of the cached dashboard payload
+    """
+    return JsonResponse(dashboard_cache.stats())
+
+
 def analytics_page_view(request):
     """
     View for the analytics dashboard page
     """
     context = {
-        'analytics_data': get_analytics_data()
+        'analytics_data': dashboard_cache.get()
     }
     return render(request, 'analyticsmanagement/analytics_dashboard.html', context)
\ No newline at end of file
@@ -1,6 +1,18 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
 from django.contrib import admin
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import APIIntegration, APIIntegrationLog
+from .models import APIIntegration, APIIntegrationLog, APIUsageMinute
+from .profiling import profiler
+from .usage import UsageStats, usage_summary
+
+USAGE_REPORT_WINDOWS = {'1h': timedelta(hours=1), '24h': timedelta(hours=24), '7d': timedelta(days=7)}
 
 
 @admin.register(APIIntegration)
@@ -25,7 +37,9 @@ class APIIntegrationAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Permissions', {
-            'fields': ('is_active', 'allowed_endpoints', 'ip_whitelist', 'rate_limit')
+            'fields': ('is_active', 'allowed_endpoints', 'ip_whitelist', 'rate_limit'),
+            'description': 'IP whitelist entries may be single addresses or CIDR ranges, '
+                           'IPv4 or IPv6 (e.g. 10.0.0.0/8, 2001:db8::/32).'
         }),
         ('Metadata', {
             'fields': ('created_by', 'created_at', 'updated_at'),
@@ -85,4 +99,91 @@ class APIIntegrationLogAdmin(admin.ModelAdmin):
     def response_time_formatted(self, obj):
         return f"{obj.response_time:.3f}s"
     response_time_formatted.short_description = 'Response Time'
-    response_time_formatted.admin_order_field = 'response_time'
\ No newline at end of file
+    response_time_formatted.admin_order_field = 'response_time'
+
+
+@admin.register(APIUsageMinute)
+class APIUsageMinuteAdmin(admin.ModelAdmin):
+    """
+    Per-minute usage rows, plus a report of latency percentiles and error
+    rates per integration and endpoint
+    """
+    change_list_template = 'admin/api/apiusageminute/change_list.html'
+    list_display = ('minute', 'integration', 'method', 'endpoint', 'count', 'error_rate', 'p50', 'p95', 'p99')
+    list_filter = ('integration', 'method')
+    search_fields = ('endpoint',)
+    date_hierarchy = 'minute'
+    list_select_related = ('integration',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_reset_permission(self, request):
+        # Usage rows are read-only in the admin, but resetting the query
+        # profile still needs the model's change permission
+        opts = self.opts
+        return request.user.has_perm(f"{opts.app_label}.{get_permission_codename('change', opts)}")
+
+    def get_urls(self):
+        report = path('report/', self.admin_site.admin_view(self.report_view), name='api_apiusageminute_report')
+        profile = path('profile/', self.admin_site.admin_view(self.profile_view), name='api_apiusageminute_profile')
+        return [report, profile, *super().get_urls()]
+
+    def report_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        window = request.GET.get('window', '24h')
+        if window not in USAGE_REPORT_WINDOWS:
+            window = '24h'
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'API latency and errors',
+            'window': window,
+            'windows': list(USAGE_REPORT_WINDOWS),
+            'rows': usage_summary(timezone.now() - USAGE_REPORT_WINDOWS[window]),
+        }
+        return TemplateResponse(request, 'admin/api/apiusageminute/report.html', context)
+
+    def profile_view(self, request):
+        """Query and timing profile of the views, as sampled by this process"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if request.method == 'POST':
+            if not self.has_reset_permission(request):
+                raise PermissionDenied
+            profiler.reset()
+            return redirect('admin:api_apiusageminute_profile')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'View query profile',
+            'can_reset': self.has_reset_permission(request),
+            'started_at': datetime.fromtimestamp(profiler.started_at, tz=dt_timezone.utc),
+            'rows': profiler.summary(),
+        }
+        return TemplateResponse(request, 'admin/api/apiusageminute/profile.html', context)
+
+    def _stats(self, obj):
+        return UsageStats(
+            obj.count, obj.status_2xx, obj.status_3xx, obj.status_4xx, obj.status_5xx, obj.total_time,
+            list(obj.histogram),
+        ).as_dict()
+
+    def error_rate(self, obj):
+        return f"{self._stats(obj)['error_rate']:.1%}"
+
+    def p50(self, obj):
+        return self._stats(obj)['p50_ms']
+    p50.short_description = 'p50 (ms)'
+
+    def p95(self, obj):
+        return self._stats(obj)['p95_ms']
+    p95.short_description = 'p95 (ms)'
+
+    def p99(self, obj):
+        return self._stats(obj)['p99_ms']
+    p99.short_description = 'p99 (ms)'
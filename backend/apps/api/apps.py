@@ -6,4 +6,7 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.api'
\ No newline at end of file
+    name = 'apps.api'
+
+    def ready(self):
+        import apps.api.signals  # noqa: F401
@@ -0,0 +1,164 @@
+"""
+Streaming CSV/NDJSON exports of analytics events and API request logs
+
+Rows are read with ``QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE)``,
+which uses a server-side cursor on PostgreSQL. They are encoded and, when
+requested, gzipped chunk by chunk while the response is being sent, so an
+export of millions of rows needs constant memory on both the web worker
+and the database client.
+"""
+import csv
+import io
+import json
+import uuid
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from apps.analyticsmanagement.models import ContentInteraction, PageView, UserActivity
+from .models import APIIntegrationLog
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Encoded rows are handed to the response in pieces of about this many bytes
+CHUNK_BYTES = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Raised for invalid export parameters"""
+
+
+@dataclass(frozen=True)
+class Dataset:
+    model: type
+    columns: tuple
+    time_field: str
+    # Field holding the APIIntegration, if the dataset can be filtered by one
+    integration_field: str = None
+
+    def queryset(self, since=None, until=None, integration=None):
+        queryset = self.model.objects.all()
+        if since is not None:
+            queryset = queryset.filter(**{f'{self.time_field}__gte': since})
+        if until is not None:
+            queryset = queryset.filter(**{f'{self.time_field}__lt': until})
+        if integration is not None:
+            if self.integration_field is None:
+                raise ExportError('This export cannot be filtered by integration')
+            try:
+                integration = uuid.UUID(str(integration))
+            except ValueError:
+                raise ExportError(f'Invalid integration id: {integration}')
+            queryset = queryset.filter(**{self.integration_field: integration})
+        return queryset.order_by(self.time_field, 'pk').values_list(*self.columns)
+
+
+DATASETS = {
+    'page-views': Dataset(
+        PageView, ('id', 'timestamp', 'page_id', 'user_id', 'session_key', 'ip_address', 'user_agent'), 'timestamp',
+    ),
+    'user-activities': Dataset(UserActivity, ('id', 'timestamp', 'user_id', 'action', 'details'), 'timestamp'),
+    'content-interactions': Dataset(
+        ContentInteraction, ('id', 'timestamp', 'content_type', 'content_id', 'user_id', 'action', 'metadata'),
+        'timestamp',
+    ),
+    'api-logs': Dataset(
+        APIIntegrationLog,
+        ('id', 'request_time', 'integration_id', 'endpoint', 'method', 'ip_address', 'user_agent',
+         'response_status', 'response_time'),
+        'request_time',
+        integration_field='integration_id',
+    ),
+}
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a date or datetime query parameter
+
+    A bare date is the start of that day, or of the next day for the end of
+    a range, so ``until=2026-01-31`` includes all of January 31st.
+    """
+    if not value:
+        return None
+    # Well-formed values that are not a real date (2026-02-30) raise
+    # ValueError; badly formed ones return None
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        raise ExportError(f'Invalid date: {value}')
+    if moment is None:
+        if day is None:
+            raise ExportError(f'Invalid date: {value}')
+        moment = datetime.combine(day, time.min)
+        if end:
+            moment += timedelta(days=1)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def encode_rows(dataset, rows, file_format):
+    """Yield the encoded export as text chunks"""
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(dataset.columns)
+
+        def write(row):
+            writer.writerow([json.dumps(value) if isinstance(value, (dict, list)) else value for value in row])
+    elif file_format == 'ndjson':
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+        def write(row):
+            buffer.write(encoder.encode(dict(zip(dataset.columns, row))))
+            buffer.write('\n')
+    else:
+        raise ExportError(f'Unknown format: {file_format}')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of bytes on the fly"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(dataset_name, file_format='csv', since=None, until=None, integration=None, compress=False):
+    """
+    Return an iterator of bytes for an export
+
+    Parameters are validated before the first row is read, so an ExportError
+    is raised here rather than in the middle of a streamed response.
+    """
+    try:
+        dataset = DATASETS[dataset_name]
+    except KeyError:
+        raise ExportError(f'Unknown export: {dataset_name}')
+    if file_format not in FORMATS:
+        raise ExportError(f'Unknown format: {file_format}')
+    rows = dataset.queryset(since, until, integration).iterator(
+        chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    )
+    chunks = (chunk.encode('utf-8') for chunk in encode_rows(dataset, rows, file_format))
+    return gzip_chunks(chunks) if compress else chunks
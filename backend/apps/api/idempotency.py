@@ -0,0 +1,87 @@
+"""
+Idempotency-Key support for unsafe API views
+
+Mobile clients retry requests on flaky networks. A client that sends an
+``Idempotency-Key`` header gets the response of the first request with that
+key replayed on every retry, without the view running again. Responses are
+stored per user for IDEMPOTENCY_KEY_TIMEOUT seconds; reusing a key for a
+different request is rejected with 422.
+
+The key is claimed with ``cache.add`` before the view runs, so a duplicate
+that arrives while the first request is still being handled gets a 409
+instead of running the view a second time.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+CACHE_KEY_PREFIX = 'idempotency_'
+MAX_KEY_LENGTH = 255
+# How long a claim lasts if the worker handling the request dies
+PENDING_TIMEOUT = 60
+
+
+def request_fingerprint(request):
+    """Hash of the parts of a request that must match for a replay"""
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """Replay stored responses for requests carrying an Idempotency-Key header"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.pk if request.user.is_authenticated else 'anonymous'
+        cache_key = CACHE_KEY_PREFIX + hashlib.sha256(f'{user_id}:{key}'.encode()).hexdigest()
+        fingerprint = request_fingerprint(request)
+        if not cache.add(cache_key, {'pending': True, 'fingerprint': fingerprint}, PENDING_TIMEOUT):
+            return replay(cache.get(cache_key), fingerprint)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        # Only successful and client-error outcomes are final; server errors may be retried
+        if response.status_code < 500:
+            cache.set(
+                cache_key,
+                {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                timeout=getattr(settings, 'IDEMPOTENCY_KEY_TIMEOUT', 86400),
+            )
+        else:
+            cache.delete(cache_key)
+        return response
+    return wrapper
+
+
+def replay(stored, fingerprint):
+    """Answer a request whose key is already claimed or has a stored response"""
+    if stored is not None and stored['fingerprint'] != fingerprint:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    # The claim can also have just been released by a failed request
+    if stored is None or stored.get('pending'):
+        return Response(
+            {'error': 'A request with this Idempotency-Key is still being processed'},
+            status=status.HTTP_409_CONFLICT,
+        )
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
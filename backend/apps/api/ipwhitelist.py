@@ -0,0 +1,88 @@
+"""
+IP whitelist index and client address resolution for API integrations
+
+APIIntegration.ip_whitelist entries may be single addresses or CIDR ranges,
+IPv4 or IPv6 (e.g. ``10.0.0.0/8, 2001:db8::/32, 203.0.113.7``). They are
+collapsed into sorted, non-overlapping integer intervals per IP version so a
+lookup is a single binary search regardless of how many entries there are.
+"""
+import ipaddress
+import logging
+from bisect import bisect_right
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class IPWhitelist:
+    """
+    Sorted interval index over a set of IP networks
+    """
+    __slots__ = ('networks', '_starts', '_ends')
+
+    def __init__(self, entries):
+        networks = {4: [], 6: []}
+        for entry in entries:
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                logger.warning('Ignoring invalid IP whitelist entry %r', entry)
+                continue
+            networks[network.version].append(network)
+
+        self.networks = tuple(
+            network for version in (4, 6) for network in ipaddress.collapse_addresses(networks[version])
+        )
+        # collapse_addresses returns sorted, non-overlapping networks
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        for network in self.networks:
+            self._starts[network.version].append(int(network.network_address))
+            self._ends[network.version].append(int(network.broadcast_address))
+
+    @classmethod
+    def from_setting(cls, value):
+        """Build an index from a comma-separated ip_whitelist value"""
+        return _whitelist_for_setting(value or '')
+
+    def __bool__(self):
+        return bool(self.networks)
+
+    def __contains__(self, ip_address):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except (TypeError, ValueError):
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        starts = self._starts[address.version]
+        position = bisect_right(starts, int(address)) - 1
+        return position >= 0 and int(address) <= self._ends[address.version][position]
+
+
+@lru_cache(maxsize=256)
+def _whitelist_for_setting(value):
+    return IPWhitelist(entry.strip() for entry in value.split(',') if entry.strip())
+
+
+def get_client_ip(request):
+    """
+    Return the client address, trusting API_TRUSTED_PROXY_COUNT proxy hops
+
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client is the entry just before the trusted hops.
+    Anything further left was supplied by the client and cannot be trusted.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR')
+    trusted_hops = getattr(settings, 'API_TRUSTED_PROXY_COUNT', 0)
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not trusted_hops or not x_forwarded_for:
+        return remote_addr
+
+    chain = [ip.strip() for ip in x_forwarded_for.split(',') if ip.strip()]
+    chain.append(remote_addr)
+    if len(chain) <= trusted_hops:
+        return chain[0]
+    return chain[-(trusted_hops + 1)]
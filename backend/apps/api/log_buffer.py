@@ -0,0 +1,173 @@
+"""
+Buffered, asynchronous writer for APIIntegrationLog rows
+
+The API key middleware hands finished requests to the writer, which only
+appends them to a bounded in-memory queue. A daemon thread drains the queue
+and inserts rows with bulk_create once API_LOG_BATCH_SIZE rows are pending or
+API_LOG_FLUSH_INTERVAL milliseconds have passed, so logging never adds a
+database round trip to the response path. When the queue is full, rows are
+dropped according to API_LOG_DROP_POLICY instead of blocking the request.
+Pending rows are flushed when the worker process exits. The usage of the
+written rows (latency histograms and status counts, see usage.py) is
+accumulated in memory and saved after each round of flushing. Setting
+API_LOG_ASYNC to False writes every row inline, which is what the tests use.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import APIIntegrationLog
+from .usage import UsageStats, fold_logs, save_usage
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+
+
+class APILogWriter:
+    """
+    Bounded queue of pending log rows drained by a background thread
+    """
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None, drop_policy=None):
+        self.max_size = max_size or getattr(settings, 'API_LOG_BUFFER_SIZE', 10000)
+        self.batch_size = batch_size or getattr(settings, 'API_LOG_BATCH_SIZE', 500)
+        # Milliseconds between flushes when the batch size is not reached
+        self.flush_interval = flush_interval or getattr(settings, 'API_LOG_FLUSH_INTERVAL', 1000)
+        self.drop_policy = drop_policy or getattr(settings, 'API_LOG_DROP_POLICY', DROP_NEWEST)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._usage = defaultdict(UsageStats)
+        self._usage_lock = threading.Lock()
+
+    def write(self, **fields):
+        """
+        Queue a log row without blocking. Returns False if a row was dropped.
+        """
+        fields.setdefault('request_time', timezone.now())
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            if not self._handle_full(fields):
+                return False
+        if getattr(settings, 'API_LOG_ASYNC', True):
+            self._ensure_started()
+        else:
+            self.flush()
+            self.flush_usage()
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, max_rows=None):
+        """
+        Insert queued rows in batches and return the number written
+        """
+        written = 0
+        with self._flush_lock:
+            while max_rows is None or written < max_rows:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                written += self._write_batch(batch)
+        return written
+
+    def flush_usage(self):
+        """
+        Save the usage of the rows written since the last call; returns the
+        number of usage rows touched
+        """
+        with self._usage_lock:
+            usage, self._usage = self._usage, defaultdict(UsageStats)
+        try:
+            return save_usage(usage)
+        except Exception:
+            # The logs are stored, so the usage can be rebuilt from them
+            logger.exception('Failed to save API usage for %d minutes', len(usage))
+            return 0
+
+    def stop(self, timeout=5):
+        """Stop the background thread and write everything still queued"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # Writes on the caller's connection, which is the caller's to close
+        self.flush()
+        self.flush_usage()
+
+    def _handle_full(self, fields):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.warning('API log buffer full, %d rows dropped so far', self.dropped)
+        if self.drop_policy != DROP_OLDEST:
+            return False
+        try:
+            self._queue.get_nowait()
+            self._queue.put_nowait(fields)
+        except (queue.Empty, queue.Full):
+            return False
+        return True
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        try:
+            APIIntegrationLog.objects.bulk_create(
+                [APIIntegrationLog(**fields) for fields in batch],
+                batch_size=self.batch_size,
+            )
+        except Exception:
+            # Losing a batch of request logs must never take the worker down
+            logger.exception('Failed to write %d API log rows', len(batch))
+            return 0
+        with self._usage_lock:
+            fold_logs(self._usage, batch)
+        return len(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='api-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        interval = self.flush_interval / 1000
+        while not self._stop.is_set():
+            deadline = time.monotonic() + interval
+            while self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._stop.wait(min(remaining, 0.05))
+            if self.pending():
+                self.flush(max_rows=self.batch_size * 10)
+                self.flush_usage()
+                close_old_connections()
+
+
+log_writer = APILogWriter()
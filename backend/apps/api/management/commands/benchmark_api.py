@@ -0,0 +1,280 @@
+import re
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import ResolverMatch, resolve
+from django.utils import timezone
+from rest_framework.test import force_authenticate
+from wagtail.models import Page
+from apps.analyticsmanagement.middleware import AnalyticsMiddleware
+from apps.analyticsmanagement.models import PageView
+from apps.analyticsmanagement.page_view_buffer import PageViewBuffer
+from apps.api.matching import EndpointMatcher
+from apps.api.middleware import APIKeyAuthMiddleware
+from apps.api.models import APIIntegration, APIIntegrationLog
+from apps.api.pagination import RequestTimeKeysetPagination
+from apps.api.ratelimit import LIMITERS
+from apps.api.registry import registry
+from apps.api.views import APIIntegrationLogListView
+from apps.contentmanagement.geo import haversine
+from apps.contentmanagement.marker_index import MarkerIndex
+from apps.usermanagement.models import Role
+
+
+class RollbackBenchmark(Exception):
+    """Raised to discard the fixtures created for a benchmark run"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks hot paths of the API layer (fixtures are rolled back afterwards)'
+
+    scenarios = ('auth', 'ratelimit', 'endpoints', 'markers', 'pageviews', 'pagination')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios, help='Which code path to benchmark')
+        parser.add_argument('--requests', type=int, default=5000, help='Number of iterations (default: 5000)')
+        parser.add_argument('--workers', type=int, default=8, help='Parallel workers where applicable (default: 8)')
+        parser.add_argument('--rate', type=int, default=1000, help='Target request rate for paced scenarios (default: 1000)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                getattr(self, f"benchmark_{options['scenario']}")(options)
+                raise RollbackBenchmark()
+        except RollbackBenchmark:
+            pass
+
+    def report(self, label, iterations, elapsed, queries=None):
+        line = f'{label:<28} {iterations / elapsed:>12,.0f} req/s  {elapsed * 1000 / iterations:8.3f} ms/req'
+        if queries is not None:
+            line += f'  {queries / iterations:6.2f} queries/req'
+        self.stdout.write(line)
+
+    def timed(self, label, iterations, func):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            elapsed = time.perf_counter() - start
+        self.report(label, iterations, elapsed, len(ctx.captured_queries))
+
+    def benchmark_auth(self, options):
+        """API key resolution: per-request database lookup vs. integration registry"""
+        integration = APIIntegration.objects.create(name='Benchmark integration', rate_limit=10 ** 9)
+        factory = RequestFactory()
+        middleware = APIKeyAuthMiddleware(lambda request: HttpResponse())
+        iterations = options['requests']
+
+        def database_lookup():
+            # The lookup the middleware performed before the registry existed
+            request = factory.get('/api/markers/', HTTP_AUTHORIZATION=f'Api-Key {integration.api_key}')
+            api_key = request.META['HTTP_AUTHORIZATION'].replace('Api-Key ', '').strip()
+            APIIntegration.objects.get(api_key=api_key)
+
+        def registry_lookup():
+            request = factory.get('/api/markers/', HTTP_AUTHORIZATION=f'Api-Key {integration.api_key}')
+            api_key = request.META['HTTP_AUTHORIZATION'].replace('Api-Key ', '').strip()
+            registry.get(api_key)
+
+        def full_middleware():
+            request = factory.get('/api/markers/', HTTP_AUTHORIZATION=f'Api-Key {integration.api_key}')
+            middleware.process_request(request)
+
+        self.timed('before: database lookup', iterations, database_lookup)
+        registry.invalidate(integration.api_key)
+        registry.get(integration.api_key)  # warm the cache
+        self.timed('after: registry lookup', iterations, registry_lookup)
+        self.timed('after: process_request', iterations, full_middleware)
+        registry.invalidate(integration.api_key)
+
+    def benchmark_ratelimit(self, options):
+        """Parallel hits against each limiter; exactly `limit` requests must be allowed"""
+        workers = options['workers']
+        per_worker = max(1, options['requests'] // workers)
+        limit = workers * per_worker // 2
+
+        for name, limiter_class in LIMITERS.items():
+            limiter = limiter_class()
+            key = f'benchmark-{uuid.uuid4()}'
+            allowed = []
+
+            def worker():
+                for _ in range(per_worker):
+                    allowed.append(limiter.hit(key, limit, 3600).allowed)
+
+            threads = [threading.Thread(target=worker) for _ in range(workers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            self.report(name, len(allowed), elapsed)
+            status = self.style.SUCCESS('ok') if allowed.count(True) == limit else self.style.ERROR('WRONG')
+            self.stdout.write(f'  allowed {allowed.count(True)} of {len(allowed)} (limit {limit}) {status}')
+
+    def benchmark_endpoints(self, options):
+        """Allowed-endpoint checks: per-rule regexes vs. one precompiled matcher"""
+        iterations = options['requests']
+        for rule_count in (10, 100, 500):
+            endpoints = [f'/exhibit-{i}/markers/*' for i in range(rule_count)]
+            setting = ','.join(endpoints)
+            # Worst case for the old loop: the only matching rule is the last one
+            path = f'/api/exhibit-{rule_count - 1}/markers/42/'
+
+            def per_rule():
+                # The check process_view performed before the matcher existed
+                for endpoint in [ep.strip() for ep in setting.split(',')]:
+                    if path == f'/api{endpoint}' or re.match(r'^/api' + endpoint.replace('*', '.*') + '/?$', path):
+                        return True
+                return False
+
+            matcher = EndpointMatcher.from_setting(setting)
+            self.timed(f'{rule_count} rules: per-rule regex', iterations, per_rule)
+            self.timed(f'{rule_count} rules: matcher', iterations, lambda: matcher.matches(path))
+
+    def benchmark_markers(self, options):
+        """Nearest-20 marker queries: Python haversine loop vs. NumPy index with argpartition"""
+        rng = np.random.default_rng(0)
+        origin = (14.5869, 120.9762)
+        for size in (10_000, 100_000, 1_000_000):
+            latitudes = origin[0] + rng.uniform(-0.5, 0.5, size)
+            longitudes = origin[1] + rng.uniform(-0.5, 0.5, size)
+            rows = list(zip(range(size), latitudes.tolist(), longitudes.tolist()))
+            index = MarkerIndex.from_arrays(range(size), latitudes, longitudes)
+            iterations = max(3, min(options['requests'], 10 ** 7 // size))
+
+            def python_loop():
+                # How candidates were ranked before the index existed
+                ranked = sorted((haversine(*origin, lat, lon), marker_id) for marker_id, lat, lon in rows)
+                return ranked[:20]
+
+            self.timed(f'{size:>9,} markers: python loop', 3, python_loop)
+            self.timed(f'{size:>9,} markers: numpy index', iterations, lambda: index.nearest(*origin, 20))
+
+    def paced(self, label, iterations, rate, func, between=None):
+        """Call func at a fixed rate and report achieved throughput and per-call latency"""
+        latencies = []
+        queries = 0
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for i in range(iterations):
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                captured = len(ctx.captured_queries)
+                began = time.perf_counter()
+                func()
+                latencies.append(time.perf_counter() - began)
+                queries += len(ctx.captured_queries) - captured
+                if between is not None:
+                    between()
+            elapsed = time.perf_counter() - start
+        latencies = np.array(latencies) * 1000
+        self.stdout.write(
+            f'{label:<28} {iterations / elapsed:>12,.0f} req/s  p50 {np.percentile(latencies, 50):7.3f} ms'
+            f'  p99 {np.percentile(latencies, 99):7.3f} ms  {queries / iterations:6.2f} queries/req'
+        )
+
+    def benchmark_pageviews(self, options):
+        """Page view capture at --rate req/s: resolve + INSERT per response vs. resolver_match + ring buffer"""
+        page = Page.objects.order_by('pk').first()
+        factory = RequestFactory()
+        iterations, rate = options['requests'], options['rate']
+
+        def make_request():
+            request = factory.get('/', HTTP_USER_AGENT='benchmark')
+            request.user = AnonymousUser()
+            request.current_page = page
+            request.resolver_match = ResolverMatch(lambda request: None, (), {}, url_name='wagtail_serve')
+            return request
+
+        request, response = make_request(), HttpResponse()
+
+        def inline_insert():
+            # What process_response did before the buffer existed
+            try:
+                resolve(request.path_info)
+            except Exception:
+                pass
+            PageView.objects.create(page=page, session_key='', ip_address='127.0.0.1', user_agent='benchmark')
+
+        self.paced('before: resolve + INSERT', iterations, rate, inline_insert)
+
+        buffer = PageViewBuffer()
+        middleware = AnalyticsMiddleware(lambda request: response)
+        flushes = []
+
+        def flush_full_batches():
+            # Stands in for the background writer, outside the timed request path
+            if buffer.pending() >= buffer.batch_size:
+                began = time.perf_counter()
+                written = buffer.flush()
+                flushes.append((written, time.perf_counter() - began))
+
+        with override_settings(PAGE_VIEW_ASYNC=True), \
+                mock.patch('apps.analyticsmanagement.signals.page_view_buffer', buffer), \
+                mock.patch.object(buffer, '_ensure_started'):
+            self.paced(
+                'after: ring buffer', iterations, rate,
+                lambda: middleware.process_response(request, response), between=flush_full_batches,
+            )
+            began = time.perf_counter()
+            flushes.append((buffer.flush(), time.perf_counter() - began))
+        written = sum(count for count, _ in flushes)
+        flush_time = sum(elapsed for _, elapsed in flushes)
+        self.stdout.write(
+            f'  {written} views written in {len(flushes)} bulk flushes '
+            f'({written / flush_time:,.0f} rows/s), {buffer.sampled_out} sampled out, {buffer.overwritten} overwritten'
+        )
+
+    def benchmark_pagination(self, options):
+        """Page 1 vs. page 1000 of the API log list: page numbers (COUNT + OFFSET) vs. keyset cursor"""
+        page_size, pages = 20, 1000
+        integration = APIIntegration.objects.create(name='Benchmark integration')
+        role, _ = Role.objects.get_or_create(name='Benchmark', defaults={'description': 'Benchmark'})
+        admin = get_user_model().objects.create_user(
+            email=f'{uuid.uuid4()}@example.com', username=f'benchmark-{uuid.uuid4()}', password=None, role=role,
+            is_staff=True,
+        )
+        now = timezone.now()
+        APIIntegrationLog.objects.bulk_create((
+            APIIntegrationLog(
+                integration=integration, endpoint='/api/markers/', method='GET', response_status=200,
+                request_time=now - timedelta(milliseconds=index),
+            )
+            for index in range(page_size * pages)
+        ), batch_size=5000)
+        factory = RequestFactory()
+        view = APIIntegrationLogListView.as_view()
+        iterations = min(options['requests'], 200)
+
+        def fetch(params):
+            request = factory.get('/api/api-integration-logs/', params)
+            force_authenticate(request, user=admin)
+            response = view(request)
+            response.render()
+            assert len(response.data['results']) == page_size, response.data
+
+        # The cursor of page 1000 points after the last row of page 999
+        boundary = APIIntegrationLog.objects.order_by('-request_time', '-id')[page_size * (pages - 1) - 1]
+        paginator = RequestTimeKeysetPagination()
+        paginator.request, paginator.model = factory.get('/api/api-integration-logs/'), APIIntegrationLog
+        cursor = parse_qs(urlsplit(paginator.link(boundary, reverse=False)).query)['cursor'][0]
+
+        self.timed('before: page 1', iterations, lambda: fetch({'page': 1}))
+        self.timed(f'before: page {pages}', iterations, lambda: fetch({'page': pages}))
+        self.timed('after: cursor page 1', iterations, lambda: fetch({'cursor': ''}))
+        self.timed(f'after: cursor page {pages}', iterations, lambda: fetch({'cursor': cursor}))
@@ -16,7 +16,7 @@ class Command(BaseCommand):
         parser.add_argument('--user-id', type=str, help='ID of the user creating this integration', default=None)
         parser.add_argument('--active', action='store_true', help='Set integration as active (default: True)', default=True)
         parser.add_argument('--allowed-endpoints', type=str, help='Comma-separated list of allowed endpoints', default='')
-        parser.add_argument('--ip-whitelist', type=str, help='Comma-separated list of allowed IP addresses', default='')
+        parser.add_argument('--ip-whitelist', type=str, help='Comma-separated list of allowed IP addresses or CIDR ranges', default='')
 
     def handle(self, *args, **options):
         # Get the user if provided
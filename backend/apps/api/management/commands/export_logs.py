@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.exports import DATASETS, FORMATS, ExportError, parse_bound, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Stream an export of analytics events or API logs as CSV or NDJSON in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', dest='file_format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', help='Start date or datetime (inclusive)')
+        parser.add_argument('--until', help='End date or datetime (exclusive; a date includes that whole day)')
+        parser.add_argument('--integration', help='Only API logs of this integration id')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--output', default='-', help='File to write to (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            chunks = stream_export(
+                options['dataset'],
+                options['file_format'],
+                since=parse_bound(options['since']),
+                until=parse_bound(options['until'], end=True),
+                integration=options['integration'],
+                compress=options['gzip'],
+            )
+        except ExportError as error:
+            raise CommandError(str(error))
+
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
+            return
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written} bytes to {options['output']}")
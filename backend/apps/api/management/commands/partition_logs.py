@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.api.partitioning import partition_by_month
+from apps.api.retention import POLICIES
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the API log and page view tables into tables partitioned by month (PostgreSQL only). '
+        'The existing rows are kept as one legacy partition; each table is locked while it is converted'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=sorted(POLICIES), action='append', help='Only these datasets')
+        parser.add_argument('--months-ahead', type=int, help='Partitions to create ahead (default: PARTITION_MONTHS_AHEAD)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL; retention uses batched deletes elsewhere')
+        months_ahead = options['months_ahead']
+        if months_ahead is None:
+            months_ahead = getattr(settings, 'PARTITION_MONTHS_AHEAD', 3)
+        for dataset in options['dataset'] or POLICIES:
+            policy = POLICIES[dataset]
+            if partition_by_month(connection, policy.model, policy.time_field, months_ahead=months_ahead):
+                self.stdout.write(f'{dataset}: partitioned {policy.table} by month')
+            else:
+                self.stdout.write(f'{dataset}: {policy.table} is already partitioned')
+        self.stdout.write(self.style.SUCCESS('Partitioning applied'))
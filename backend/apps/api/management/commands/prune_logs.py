@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from apps.api.retention import POLICIES, ensure_partitions, prune
+
+
+class Command(BaseCommand):
+    help = (
+        'Drop (or, without partitioning, delete) API logs and page views older than their retention period '
+        'and create upcoming monthly partitions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=sorted(POLICIES), action='append', help='Only these datasets')
+        parser.add_argument('--months', type=int, help='Override the retention period in months')
+        parser.add_argument('--archive-dir', help='Archive removed rows as gzipped CSV files in this directory')
+        parser.add_argument('--months-ahead', type=int, help='Partitions to create ahead (default: PARTITION_MONTHS_AHEAD)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+
+    def handle(self, *args, **options):
+        for dataset in options['dataset'] or POLICIES:
+            if not options['dry_run']:
+                for name in ensure_partitions(dataset, months_ahead=options['months_ahead']):
+                    self.stdout.write(f'{dataset}: created partition {name}')
+            removed = prune(
+                dataset, months=options['months'], archive_dir=options['archive_dir'], dry_run=options['dry_run']
+            )
+            if not removed:
+                self.stdout.write(f'{dataset}: nothing to remove')
+            for description, path in removed:
+                verb = 'would remove' if options['dry_run'] else 'removed'
+                self.stdout.write(f'{dataset}: {verb} {description}' + (f' (archived to {path})' if path else ''))
+        self.stdout.write(self.style.SUCCESS('Retention applied'))
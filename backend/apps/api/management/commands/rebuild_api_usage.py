@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.exports import ExportError, parse_bound
+from apps.api.usage import rebuild_usage
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-minute API usage histograms from the request logs, e.g. to backfill them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', required=True, help='Start date or datetime (inclusive)')
+        parser.add_argument('--until', help='End date or datetime (exclusive; default: now)')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'], end=True)
+        except ExportError as error:
+            raise CommandError(str(error))
+        processed = rebuild_usage(since, until)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt API usage from {processed} request logs'))
@@ -0,0 +1,77 @@
+"""
+Matching of request paths against APIIntegration.allowed_endpoints
+
+Each entry is an endpoint below /api where ``*`` matches any sequence of
+characters, e.g. ``/markers/*`` or ``/content/``. An integration's rules are
+compiled once into a single regular expression whose alternatives are
+factored through a character trie, so requests are matched in one pass no
+matter how many rules an integration has.
+"""
+import re
+from functools import lru_cache
+
+WILDCARD = object()
+END = ''
+
+
+def _tokens(endpoint):
+    return [WILDCARD if char == '*' else char for char in endpoint]
+
+
+def _trie_to_regex(node):
+    alternatives = []
+    for token, child in node.items():
+        if token == END:
+            continue
+        piece = '.*' if token is WILDCARD else re.escape(token)
+        alternatives.append(piece + _trie_to_regex(child))
+
+    optional = END in node
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+    return '(?:' + '|'.join(alternatives) + ')' + ('?' if optional else '')
+
+
+def compile_endpoint_pattern(endpoints, prefix='/api'):
+    """Compile endpoint rules into one anchored regex matching request paths"""
+    trie = {}
+    for endpoint in endpoints:
+        node = trie
+        for token in _tokens(endpoint):
+            node = node.setdefault(token, {})
+        node[END] = {}
+    return re.compile('^' + re.escape(prefix) + _trie_to_regex(trie) + '/?$')
+
+
+class EndpointMatcher:
+    """
+    Precompiled matcher for a list of allowed endpoint rules
+    """
+    __slots__ = ('endpoints', 'exact_paths', 'pattern')
+
+    def __init__(self, endpoints, prefix='/api'):
+        self.endpoints = tuple(endpoints)
+        self.exact_paths = frozenset(f'{prefix}{endpoint}' for endpoint in self.endpoints if '*' not in endpoint)
+        self.pattern = compile_endpoint_pattern(self.endpoints, prefix) if self.endpoints else None
+
+    @classmethod
+    def from_setting(cls, value):
+        """Build a matcher from a comma-separated allowed_endpoints value"""
+        return _matcher_for_setting(value or '')
+
+    def __bool__(self):
+        return bool(self.endpoints)
+
+    def matches(self, path):
+        if path in self.exact_paths:
+            return True
+        return self.pattern is not None and self.pattern.match(path) is not None
+
+
+@lru_cache(maxsize=256)
+def _matcher_for_setting(value):
+    # Integrations are re-read from the shared cache every few seconds, so
+    # keep compiled matchers keyed by the raw setting instead of recompiling
+    return EndpointMatcher(endpoint.strip() for endpoint in value.split(',') if endpoint.strip())
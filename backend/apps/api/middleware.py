@@ -1,10 +1,10 @@
 import time
-import re
 from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
-from django.core.cache import cache
-from .models import APIIntegration, APIIntegrationLog
-from django.utils import timezone
+from .ipwhitelist import get_client_ip
+from .log_buffer import log_writer
+from .ratelimit import check_rate_limits
+from .registry import registry
 
 
 class APIKeyAuthMiddleware(MiddlewareMixin):
@@ -37,9 +37,10 @@ class APIKeyAuthMiddleware(MiddlewareMixin):
         else:
             api_key = auth_header.replace('Api-Key ', '').strip()
 
-        try:
-            integration = APIIntegration.objects.get(api_key=api_key)
-        except APIIntegration.DoesNotExist:
+        # Resolved from the integration registry, so steady-state traffic
+        # does not need a database query to authenticate
+        integration = registry.get(api_key)
+        if integration is None:
             return JsonResponse({'error': 'Invalid API key'}, status=401)
 
         # Check if integration is active
@@ -48,14 +49,17 @@ class APIKeyAuthMiddleware(MiddlewareMixin):
 
         # Check IP whitelist if configured
         ip_address = self.get_client_ip(request)
-        if integration.ip_whitelist:
-            allowed_ips = [ip.strip() for ip in integration.ip_whitelist.split(',')]
-            if allowed_ips and ip_address not in allowed_ips:
-                return JsonResponse({'error': 'IP address not allowed'}, status=403)
+        if not integration.is_ip_allowed(ip_address):
+            return JsonResponse({'error': 'IP address not allowed'}, status=403)
 
         # Check rate limiting
-        if self.is_rate_limited(integration, ip_address):
-            return JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+        rate_limit = check_rate_limits(integration, ip_address, request.path)
+        if not rate_limit.allowed:
+            response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+            for header, value in rate_limit.headers().items():
+                response[header] = value
+            return response
+        request.rate_limit = rate_limit
 
         # Store integration in request for later use
         request.api_integration = integration
@@ -64,6 +68,11 @@ class APIKeyAuthMiddleware(MiddlewareMixin):
         return None
 
     def process_response(self, request, response):
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            for header, value in rate_limit.headers().items():
+                response[header] = value
+
         # Log API request if this is an API request and has an integration
         if (hasattr(request, 'api_integration') and 
             request.path.startswith('/api/') and 
@@ -73,9 +82,9 @@ class APIKeyAuthMiddleware(MiddlewareMixin):
             start_time = getattr(request, 'start_time', time.time())
             response_time = time.time() - start_time
 
-            # Create log entry
-            APIIntegrationLog.objects.create(
-                integration=request.api_integration,
+            # Queue the log entry; it is written in bulk by a background thread
+            log_writer.write(
+                integration_id=request.api_integration.id,
                 endpoint=request.path,
                 method=request.method,
                 ip_address=self.get_client_ip(request),
@@ -92,43 +101,13 @@ class APIKeyAuthMiddleware(MiddlewareMixin):
         
         # Check if integration is set and has allowed endpoints restriction
         if hasattr(request, 'api_integration'):
-            integration = request.api_integration
-            if integration.allowed_endpoints:
-                allowed_endpoints = [ep.strip() for ep in integration.allowed_endpoints.split(',')]
-                # Check if current path matches any of the allowed endpoints
-                path_matches = False
-                for endpoint in allowed_endpoints:
-                    # Support both exact matches and pattern matches
-                    if request.path == f'/api{endpoint}' or \
-                       re.match(r'^/api' + endpoint.replace('*', '.*') + '/?$', request.path):
-                        path_matches = True
-                        break
-                
-                if not path_matches:
-                    return JsonResponse({
-                        'error': f'Access to {request.path} is not allowed for this API key'
-                    }, status=403)
+            # Endpoint rules are compiled once when the integration is cached
+            if not request.api_integration.is_endpoint_allowed(request.path):
+                return JsonResponse({
+                    'error': f'Access to {request.path} is not allowed for this API key'
+                }, status=403)
 
         return None
 
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
-
-    def is_rate_limited(self, integration, ip_address):
-        # Create a cache key based on integration ID and IP
-        cache_key = f"api_rate_limit_{integration.id}_{ip_address}_{timezone.now().hour}"
-        
-        # Get current count
-        current_count = cache.get(cache_key, 0)
-        
-        # Increment count
-        current_count += 1
-        cache.set(cache_key, current_count, timeout=3600)  # 1 hour timeout
-        
-        # Check if count exceeds rate limit
-        return current_count > integration.rate_limit
\ No newline at end of file
+        return get_client_ip(request)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='apiintegrationlog',
+            index=models.Index(fields=['integration', 'request_time'], name='api_log_integration_time'),
+        ),
+        migrations.AddIndex(
+            model_name='apiintegrationlog',
+            index=models.Index(fields=['request_time'], name='api_log_request_time'),
+        ),
+        # On PostgreSQL the table is partitioned by month separately, with
+        # the partition_logs command
+    ]
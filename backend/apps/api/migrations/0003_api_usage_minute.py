@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_log_indexes_and_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIUsageMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(help_text='Endpoint with ids replaced by {id}', max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('minute', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('status_2xx', models.IntegerField(default=0)),
+                ('status_3xx', models.IntegerField(default=0)),
+                ('status_4xx', models.IntegerField(default=0)),
+                ('status_5xx', models.IntegerField(default=0)),
+                ('total_time', models.FloatField(default=0.0, help_text='Sum of response times in seconds')),
+                ('histogram', models.JSONField(default=list, help_text='Request counts per latency bucket')),
+                ('integration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='api.apiintegration')),
+            ],
+            options={
+                'verbose_name': 'API Usage Minute',
+                'verbose_name_plural': 'API Usage',
+                'db_table': 'api_usage_minute',
+                'ordering': ['-minute'],
+                'indexes': [models.Index(fields=['minute'], name='api_usage_minute_time')],
+                'constraints': [models.UniqueConstraint(fields=('integration', 'endpoint', 'method', 'minute'), name='api_usage_unique_minute')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_api_usage_minute'),
+    ]
+
+    operations = [
+        # (request_time, id) is the keyset of the log list and also serves
+        # every query the request_time index did
+        migrations.RemoveIndex(
+            model_name='apiintegrationlog',
+            name='api_log_request_time',
+        ),
+        migrations.AddIndex(
+            model_name='apiintegrationlog',
+            index=models.Index(fields=['request_time', 'id'], name='api_log_request_time_id'),
+        ),
+    ]
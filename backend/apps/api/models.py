@@ -75,4 +75,50 @@ class APIIntegrationLog(models.Model):
         db_table = 'api_integration_log'
         verbose_name = 'API Integration Log'
         verbose_name_plural = 'API Integration Logs'
-        ordering = ['-request_time']
\ No newline at end of file
+        ordering = ['-request_time']
+        indexes = [
+            models.Index(fields=['integration', 'request_time'], name='api_log_integration_time'),
+            # Also the keyset of the log list (pagination.py)
+            models.Index(fields=['request_time', 'id'], name='api_log_request_time_id'),
+        ]
+
+
+class APIUsageMinute(models.Model):
+    """
+    Request counts, status classes and latency histogram of one integration,
+    endpoint and method during one minute
+
+    Maintained from the request logs as they are written (see usage.py).
+    """
+    integration = models.ForeignKey(
+        APIIntegration,
+        on_delete=models.CASCADE,
+        related_name='usage'
+    )
+    endpoint = models.CharField(max_length=255, help_text="Endpoint with ids replaced by {id}")
+    method = models.CharField(max_length=10)
+    minute = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    status_2xx = models.IntegerField(default=0)
+    status_3xx = models.IntegerField(default=0)
+    status_4xx = models.IntegerField(default=0)
+    status_5xx = models.IntegerField(default=0)
+    total_time = models.FloatField(default=0.0, help_text="Sum of response times in seconds")
+    histogram = models.JSONField(default=list, help_text="Request counts per latency bucket")
+
+    class Meta:
+        db_table = 'api_usage_minute'
+        verbose_name = 'API Usage Minute'
+        verbose_name_plural = 'API Usage'
+        ordering = ['-minute']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['integration', 'endpoint', 'method', 'minute'], name='api_usage_unique_minute'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['minute'], name='api_usage_minute_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.integration} {self.method} {self.endpoint} at {self.minute:%Y-%m-%d %H:%M}: {self.count}"
@@ -0,0 +1,133 @@
+"""
+Keyset pagination for the high-volume list endpoints
+
+Page-number pagination runs a ``COUNT(*)`` and an ``OFFSET n`` on every
+request, so a deep page costs as much as reading every row before it. Given
+a ``cursor`` query parameter (empty for the first page) these endpoints page
+by keyset instead: rows are ordered by ``ordering`` (a timestamp, then the
+primary key to break ties) and a page starts right after the boundary row
+of the previous one, e.g. ``WHERE created_at <= %s AND (created_at < %s OR
+(created_at = %s AND id < %s))``, which the composite index on the same
+columns answers without reading the rows skipped. There is no count; the
+``next`` and ``previous`` links carry opaque cursors encoding the boundary
+row and the direction.
+
+Without the cursor parameter the endpoints keep page-number pagination. In
+keyset mode the ``ordering`` query parameter is ignored.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page-number pagination, or keyset pagination when a cursor is given
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor.'
+    # Most significant field first; the last one must be unique
+    ordering = ('-created_at', '-id')
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        self.model = queryset.model
+        position, reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+        ordering = [self.flip(name) for name in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+        rows = list(queryset[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        # Rows exist on the side of the page the cursor came from
+        self.has_next, self.has_previous = (position is not None, more) if reverse else (more, position is not None)
+        self.page_rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.page_rows:
+            return None
+        return self.link(self.page_rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page_rows:
+            return None
+        return self.link(self.page_rows[0], reverse=True)
+
+    @staticmethod
+    def flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def after(self, position, reverse):
+        """Filter for the rows that come after position in the (possibly reversed) ordering"""
+        condition, equal = Q(), {}
+        for (name, descending), value in zip(self.fields(), position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        # Implied by the above, but a plain range on the leading column is
+        # what lets the planner start an index scan at the position
+        (name, descending), value = self.fields()[0], position[0]
+        return Q(**{f"{name}__{'lte' if descending != reverse else 'gte'}": value}) & condition
+
+    def link(self, row, reverse):
+        position = [self.model._meta.get_field(name).value_to_string(row) for name, _ in self.fields()]
+        token = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': reverse}).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, token):
+        """Return (position or None for the first page, reverse)"""
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = cursor['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.model._meta.get_field(name).to_python(value) for (name, _), value in zip(self.fields(), values)
+            ]
+            return position, bool(cursor['r'])
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RequestTimeKeysetPagination(KeysetPagination):
+    """Keyset pagination of request logs"""
+    ordering = ('-request_time', '-id')
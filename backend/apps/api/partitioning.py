@@ -0,0 +1,237 @@
+"""
+Monthly range partitioning of append-only log tables on PostgreSQL
+
+``partition_by_month`` (run by the ``partition_logs`` command) turns a
+model's table into a table partitioned by month on a timestamp column:
+
+* the existing table is kept, with all of its rows, as the ``<table>_legacy``
+  partition covering everything before the first day of the next month, so
+  no rows are copied;
+* a ``<table>_default`` partition catches rows outside every monthly range;
+* the primary key becomes ``(id, <timestamp>)``, because PostgreSQL requires
+  the partition key in every unique constraint. Django still treats ``id``
+  as the primary key.
+
+It is an explicit step rather than a migration because it rewrites the
+table's primary key and locks the table while it runs.
+
+``create_partition`` adds a month (moving any of its rows out of the default
+partition) and ``drop_partition`` detaches and drops one, which removes a
+month of rows without a DELETE. ``list_partitions`` reads the partition
+bounds from the catalog. On other databases tables are not partitioned and
+retention falls back to batched deletes (see retention.py).
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+LEGACY_SUFFIX = '_legacy'
+DEFAULT_SUFFIX = '_default'
+# Table of a pg_indexes.indexdef, e.g. "CREATE INDEX i ON public.t USING btree (c)"
+INDEX_TABLE_RE = re.compile(r' ON (?:ONLY )?\S+ USING ')
+
+
+def month_start(moment):
+    """First instant of the UTC month containing moment"""
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def timestamp_literal(moment):
+    # DDL statements cannot take query parameters
+    return f"'{moment.isoformat()}'"
+
+
+def partition_name(table, month):
+    return f'{table}_{month:%Y_%m}'
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    # None for MINVALUE/MAXVALUE; both None for the default partition
+    start: datetime = None
+    end: datetime = None
+    is_default: bool = False
+
+
+BOUND_RE = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \((?:'([^']+)'|MAXVALUE)\)")
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('p', 'r')", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(connection, table):
+    """Return the Partitions of a partitioned table ordered by start"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        if match is None:
+            partitions.append(Partition(name, is_default=True))
+            continue
+        start, end = (parse_datetime(value) if value else None for value in match.groups())
+        partitions.append(Partition(name, start, end))
+    return sorted(partitions, key=lambda p: (p.is_default, p.start or datetime.min.replace(tzinfo=dt_timezone.utc)))
+
+
+def create_partition(connection, table, column, month):
+    """
+    Create the partition of one month unless the month is already covered;
+    returns its name or None
+
+    Rows of that month already in the default partition are moved into it,
+    since PostgreSQL refuses to add a partition overlapping rows in the default.
+    """
+    name = partition_name(table, month)
+    bounds = [month, add_months(month, 1)]
+    for partition in list_partitions(connection, table):
+        # Already covered, e.g. by the legacy partition
+        if not partition.is_default and (partition.start is None or partition.start < bounds[1]) \
+                and (partition.end is None or partition.end > bounds[0]):
+            return None
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS)')
+        default = f'{table}{DEFAULT_SUFFIX}'
+        if any(partition.name == default for partition in list_partitions(connection, table)):
+            range_sql = f'{quote(column)} >= %s AND {quote(column)} < %s'
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {quote(default)} WHERE {range_sql} RETURNING *) '
+                f'INSERT INTO {quote(name)} SELECT * FROM moved',
+                bounds,
+            )
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} '
+            f'FOR VALUES FROM ({timestamp_literal(bounds[0])}) TO ({timestamp_literal(bounds[1])})'
+        )
+    return name
+
+
+def drop_partition(connection, table, name):
+    """Detach and drop a partition, discarding its rows at once"""
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+        cursor.execute(f'DROP TABLE {quote(name)}')
+
+
+def partition_by_month(connection, model, field_name, months_ahead=3, now=None):
+    """
+    Convert a model's table into a table range-partitioned by month on a
+    timestamp field; returns False if it already was
+
+    Runs in one transaction, holding an exclusive lock on the table.
+    """
+    table = model._meta.db_table
+    if is_partitioned(connection, table):
+        return False
+    with transaction.atomic(using=connection.alias), connection.schema_editor(atomic=False) as schema_editor:
+        # Deferred foreign key checks of rows written earlier in the
+        # transaction must run before the table can be altered
+        connection.check_constraints()
+        _partition_table(connection, schema_editor, model, field_name, months_ahead, now)
+    return True
+
+
+def _partition_table(connection, schema_editor, model, field_name, months_ahead, now):
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    legacy = f'{table}{LEGACY_SUFFIX}'
+    pk = model._meta.pk
+    column = model._meta.get_field(field_name).column
+    cutover = add_months(month_start(now or timezone.now()), 1)
+
+    schema_editor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}')
+    # A partition cannot keep a primary key other than its parent's: the
+    # (id, timestamp) unique index replaces it and becomes the partition's
+    # part of the parent's primary key when the table is attached
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [quote(legacy)]
+        )
+        pk_constraint = cursor.fetchone()[0]
+    schema_editor.execute(f'ALTER TABLE {quote(legacy)} DROP CONSTRAINT {quote(pk_constraint)}')
+    schema_editor.execute(
+        f'CREATE UNIQUE INDEX {quote(pk_constraint)} ON {quote(legacy)} ({quote(pk.column)}, {quote(column)})'
+    )
+    # The parent gets the indexes and foreign keys the table has now, which
+    # are those of the applied migrations rather than of the current model
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s', [legacy])
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [quote(legacy)],
+        )
+        foreign_keys = cursor.fetchall()
+    # Free the index names for the new parent table
+    for index_name, _ in indexes:
+        schema_editor.execute(
+            f'ALTER INDEX {quote(index_name)} RENAME TO {quote(index_name[:55] + LEGACY_SUFFIX)}'
+        )
+
+    schema_editor.execute(
+        f'CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE ({quote(column)})'
+    )
+    if pk.get_internal_type() in ('AutoField', 'BigAutoField', 'SmallAutoField'):
+        # Identity columns cannot be carried over to partitions, so the
+        # parent gets its own sequence continuing after the existing ids
+        # (not the legacy table's, which is dropped along with it)
+        sequence = f'{table}_{pk.column}_partitioned_seq'
+        schema_editor.execute(
+            f'ALTER TABLE {quote(legacy)} ALTER COLUMN {quote(pk.column)} DROP IDENTITY IF EXISTS'
+        )
+        schema_editor.execute(
+            f'CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.{quote(pk.column)}'
+        )
+        schema_editor.execute(
+            f'SELECT setval(%s, COALESCE((SELECT MAX({quote(pk.column)}) FROM {quote(legacy)}), 0) + 1, false)',
+            [sequence],
+        )
+        schema_editor.execute(
+            f"ALTER TABLE {quote(table)} ALTER COLUMN {quote(pk.column)} SET DEFAULT nextval('{sequence}')"
+        )
+    schema_editor.execute(f'ALTER TABLE {quote(table)} ADD PRIMARY KEY ({quote(pk.column)}, {quote(column)})')
+    for index_name, definition in indexes:
+        if index_name != pk_constraint:
+            schema_editor.execute(INDEX_TABLE_RE.sub(f' ON {quote(table)} USING ', definition, count=1))
+    for constraint_name, definition in foreign_keys:
+        schema_editor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(constraint_name)} {definition}')
+
+    # Matching indexes of the legacy table are attached instead of rebuilt
+    schema_editor.execute(
+        f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} '
+        f'FOR VALUES FROM (MINVALUE) TO ({timestamp_literal(cutover)})'
+    )
+    schema_editor.execute(f'CREATE TABLE {quote(table + DEFAULT_SUFFIX)} PARTITION OF {quote(table)} DEFAULT')
+    for months in range(months_ahead + 1):
+        create_partition(connection, table, column, add_months(cutover, months))
@@ -0,0 +1,180 @@
+"""
+Sampling profiler of the /api/ and /content/ endpoints
+
+``QueryProfilerMiddleware`` profiles a random QUERY_PROFILER_SAMPLE_RATE
+share of the requests whose path starts with one of QUERY_PROFILER_PATHS.
+For a sampled request it counts the SQL queries and their time with
+``connection.execute_wrapper``, times the rendering of the response (the
+JSON encoding of API responses, the templates of pages; queries run while
+rendering count as DB time, not rendering time) and the whole request. The
+figures are added to the histograms of the view, keyed by method and URL
+route. With QUERY_PROFILER_SERVER_TIMING on, they are also sent back to
+staff users in a ``Server-Timing`` header; other clients never see them.
+Requests that are not sampled only pay for one random number.
+
+Histograms use the log-scale buckets of usage.py, so percentiles are
+accurate to about 19%. They are kept in the memory of each process: the
+admin report shows what the process serving it has seen since it started
+or was last reset.
+"""
+import random
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+
+from .usage import BUCKET_COUNT, PERCENTILES, bucket_index, percentile
+
+# Histogrammed per view: queries are counted, the others are milliseconds
+METRICS = ('queries', 'db_ms', 'render_ms', 'total_ms')
+
+
+class RequestProfile:
+    """
+    Queries and timings of one request; installed as an execute wrapper on
+    every database connection while the request is handled
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_time = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def time_render(self, response):
+        """Time the rendering of a template response, less its queries"""
+        start, db_time = time.perf_counter(), self.db_time
+
+        def rendered(response):
+            self.render_time += time.perf_counter() - start - (self.db_time - db_time)
+        response.add_post_render_callback(rendered)
+
+    def values(self):
+        return {
+            'queries': self.queries,
+            'db_ms': self.db_time * 1000,
+            'render_ms': self.render_time * 1000,
+            'total_ms': self.total_time * 1000,
+        }
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ))
+
+
+@dataclass
+class ViewProfile:
+    """Aggregated profiles of one view"""
+    count: int = 0
+    totals: dict = field(default_factory=lambda: dict.fromkeys(METRICS, 0))
+    maxima: dict = field(default_factory=lambda: dict.fromkeys(METRICS, 0))
+    histograms: dict = field(default_factory=lambda: {metric: [0] * BUCKET_COUNT for metric in METRICS})
+
+    def add(self, values):
+        self.count += 1
+        for metric, value in values.items():
+            self.totals[metric] += value
+            self.maxima[metric] = max(self.maxima[metric], value)
+            self.histograms[metric][bucket_index(value)] += 1
+
+    def as_dict(self):
+        data = {'count': self.count}
+        for metric in METRICS:
+            data[f'{metric}_avg'] = self.totals[metric] / self.count if self.count else None
+            data[f'{metric}_max'] = self.maxima[metric]
+            for q in PERCENTILES:
+                value = percentile(self.histograms[metric], q)
+                data[f'{metric}_p{q}'] = round(value, 2) if value is not None else None
+        return data
+
+
+class Profiler:
+    """
+    Per-process store of the view profiles
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self.started_at = time.time()
+
+    def record(self, method, route, profile):
+        values = profile.values()
+        with self._lock:
+            view = self._views.get((method, route))
+            if view is None:
+                view = self._views[(method, route)] = ViewProfile()
+            view.add(values)
+
+    def summary(self):
+        """Return the profile of each view, slowest p95 first"""
+        with self._lock:
+            rows = [
+                {'method': method, 'route': route, **view.as_dict()}
+                for (method, route), view in self._views.items()
+            ]
+        rows.sort(key=lambda row: (-(row['total_ms_p95'] or 0), -row['count']))
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+            self.started_at = time.time()
+
+
+profiler = Profiler()
+
+
+class QueryProfilerMiddleware:
+    """
+    Profile a sample of the requests to the configured paths
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        rate = getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 0.0)
+        if rate <= 0 or not request.path.startswith(tuple(getattr(settings, 'QUERY_PROFILER_PATHS', ()))):
+            return False
+        return rate >= 1 or random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profile = request.query_profile = RequestProfile()
+        with ExitStack() as stack:
+            # Getting a connection handler does not connect to the database
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(profile))
+            response = self.get_response(request)
+        profile.finish()
+
+        match = request.resolver_match
+        if match is not None:
+            profiler.record(request.method, '/' + match.route, profile)
+        user = getattr(request, 'user', None)
+        if getattr(settings, 'QUERY_PROFILER_SERVER_TIMING', False) and getattr(user, 'is_staff', False):
+            response['Server-Timing'] = profile.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, 'query_profile', None)
+        if profile is not None:
+            profile.time_render(response)
+        return response
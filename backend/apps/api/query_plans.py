@@ -0,0 +1,29 @@
+"""
+Declarative query plans for API views
+
+A view lists the relations its serializer reads in ``select_related`` (foreign
+keys and one-to-ones, joined into the same query) and ``prefetch_related``
+(reverse and many-to-many relations, loaded with one query each per page), and
+``QueryPlanMixin`` applies them to whatever ``get_queryset`` returns, so
+serializing a page does not query once per row. The plans are checked by the
+query budget tests (see testing.py).
+"""
+
+
+class QueryPlanMixin:
+    """
+    Apply the view's select_related and prefetch_related to its queryset
+
+    Must come before the generic view class so that filtering done in a
+    subclass's get_queryset applies to the planned queryset.
+    """
+    select_related = ()
+    prefetch_related = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
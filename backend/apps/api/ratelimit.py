@@ -0,0 +1,278 @@
+"""
+Rate limiting engine for API integrations
+
+Two algorithms are available and selected with API_RATE_LIMIT_ALGORITHM:
+
+* ``sliding_window`` - sliding window counter. Each key keeps one counter per
+  fixed window, updated with the atomic ``cache.add`` + ``cache.incr`` pair,
+  and the previous window is weighted by how much of it still overlaps the
+  sliding window. Unlike fixed hourly buckets this never lets twice the limit
+  through around a window boundary.
+* ``token_bucket`` - classic token bucket refilled at ``limit / period``
+  tokens per second. On a Redis cache the whole read-refill-take step runs as
+  one Lua script; on other backends it is serialised with a process lock,
+  which is only atomic across workers for process-local caches.
+
+API_RATE_LIMIT_ALGORITHM may also be the dotted path of a RateLimiter
+subclass. Per-endpoint limits are configured in API_ENDPOINT_RATE_LIMITS, a
+mapping of endpoint pattern (same syntax as APIIntegration.allowed_endpoints)
+to a rate such as ``'60/minute'``.
+"""
+import math
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.utils.module_loading import import_string
+
+from apps.redis_client import get_redis_client
+
+from .matching import compile_endpoint_pattern
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {allowed, tostring(tokens)}
+"""
+
+TOKEN_BUCKET_RELEASE_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+return 0
+"""
+
+
+def parse_rate(rate):
+    """Parse a rate string like '100/hour' into (limit, period in seconds)"""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period.strip()[0]]
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the limit is fully available again
+    reset: int
+    # Seconds the client should wait before retrying, 0 when allowed
+    retry_after: int = 0
+
+    def headers(self):
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    """
+    Base class for rate limiting algorithms
+    """
+    key_prefix = 'api_rate_limit'
+
+    def __init__(self, cache=None):
+        self.cache = cache or default_cache
+
+    def hit(self, key, limit, period):
+        """Count one request for key and return a RateLimitResult"""
+        raise NotImplementedError
+
+    def release(self, key, limit, period):
+        """
+        Give back a request counted by an allowed hit, e.g. because another
+        limit rejected it; limiters that cannot leave it counted
+        """
+
+
+class SlidingWindowLimiter(RateLimiter):
+    """
+    Sliding window counter built on atomic cache increments
+    """
+    key_prefix = 'api_rate_limit_sw'
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        window = int(now // period)
+        elapsed = now - window * period
+        current_key = f'{self.key_prefix}:{key}:{window}'
+        previous_count = self.cache.get(f'{self.key_prefix}:{key}:{window - 1}', 0)
+        previous_weight = (period - elapsed) / period
+
+        count = self._incr(current_key, period)
+        used = previous_count * previous_weight + count
+        if used <= limit:
+            return RateLimitResult(
+                allowed=True,
+                limit=limit,
+                remaining=max(0, int(limit - used)),
+                reset=math.ceil(period - elapsed),
+            )
+
+        # Rejected requests do not consume the allowance
+        self.cache.decr(current_key)
+        if previous_count and count - 1 < limit:
+            # Wait until enough of the previous window has slid out
+            needed = used - limit
+            retry_after = needed / previous_count * period
+        else:
+            retry_after = period - elapsed
+        return RateLimitResult(
+            allowed=False,
+            limit=limit,
+            remaining=0,
+            reset=math.ceil(period - elapsed),
+            retry_after=max(1, math.ceil(retry_after)),
+        )
+
+    def release(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        try:
+            self.cache.decr(f'{self.key_prefix}:{key}:{int(now // period)}')
+        except ValueError:
+            # Counted in a window that has just ended
+            pass
+
+    def _incr(self, key, period):
+        # Keep the counter for two windows so it can be weighted as the
+        # previous window later on
+        for _ in range(2):
+            self.cache.add(key, 0, timeout=period * 2)
+            try:
+                return self.cache.incr(key)
+            except ValueError:
+                # The key expired between add() and incr()
+                continue
+        return self.cache.incr(key)
+
+
+class TokenBucketLimiter(RateLimiter):
+    """
+    Token bucket holding up to ``limit`` tokens refilled over ``period``
+    """
+    key_prefix = 'api_rate_limit_tb'
+    _local_lock = threading.Lock()
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        rate = limit / period
+        cache_key = f'{self.key_prefix}:{key}'
+        client = get_redis_client(self.cache)
+        if client is not None:
+            allowed, tokens = client.eval(
+                TOKEN_BUCKET_SCRIPT, 1, self.cache.make_and_validate_key(cache_key),
+                limit, rate, now, period,
+            )
+            allowed, tokens = bool(int(allowed)), float(tokens)
+        else:
+            allowed, tokens = self._take_local(cache_key, limit, rate, now, period)
+
+        if allowed:
+            retry_after = 0
+        else:
+            retry_after = max(1, math.ceil((1 - tokens) / rate))
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=int(tokens),
+            reset=math.ceil((limit - tokens) / rate),
+            retry_after=retry_after,
+        )
+
+    def release(self, key, limit, period):
+        cache_key = f'{self.key_prefix}:{key}'
+        client = get_redis_client(self.cache)
+        if client is not None:
+            client.eval(TOKEN_BUCKET_RELEASE_SCRIPT, 1, self.cache.make_and_validate_key(cache_key), limit)
+            return
+        with self._local_lock:
+            state = self.cache.get(cache_key)
+            if state is not None:
+                tokens, updated = state
+                self.cache.set(cache_key, (min(limit, tokens + 1), updated), timeout=period)
+
+    def _take_local(self, cache_key, limit, rate, now, period):
+        with self._local_lock:
+            tokens, updated = self.cache.get(cache_key, (limit, now))
+            tokens = min(limit, tokens + max(0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.cache.set(cache_key, (tokens, now), timeout=period)
+        return allowed, tokens
+
+
+LIMITERS = {
+    'sliding_window': SlidingWindowLimiter,
+    'token_bucket': TokenBucketLimiter,
+}
+
+
+def get_rate_limiter(algorithm=None):
+    algorithm = algorithm or getattr(settings, 'API_RATE_LIMIT_ALGORITHM', 'sliding_window')
+    limiter_class = LIMITERS.get(algorithm) or import_string(algorithm)
+    return limiter_class()
+
+
+@lru_cache(maxsize=8)
+def _compile_endpoint_limits(endpoint_limits):
+    return tuple(
+        (endpoint, compile_endpoint_pattern([endpoint]), parse_rate(rate))
+        for endpoint, rate in endpoint_limits
+    )
+
+
+def endpoint_limits_for(path):
+    """Return (endpoint pattern, limit, period) for every per-endpoint limit matching path"""
+    configured = getattr(settings, 'API_ENDPOINT_RATE_LIMITS', {})
+    rules = _compile_endpoint_limits(tuple(sorted(configured.items())))
+    return [(endpoint, limit, period) for endpoint, pattern, (limit, period) in rules if pattern.match(path)]
+
+
+def check_rate_limits(integration, ip_address, path, limiter=None):
+    """
+    Apply any matching per-endpoint limits and the integration's hourly limit
+
+    Returns the most restrictive RateLimitResult, or the first denial. A
+    denied request does not count against any of the limits: the narrower
+    endpoint limits are checked first, and the requests counted by the ones
+    that allowed it are given back, so retrying a throttled endpoint does
+    not use up the hourly allowance.
+    """
+    limiter = limiter or get_rate_limiter()
+    scope = f'{integration.id}:{ip_address}'
+    checks = [(f'{scope}:{endpoint}', limit, period) for endpoint, limit, period in endpoint_limits_for(path)]
+    checks.append((scope, integration.rate_limit, 3600))
+
+    results = []
+    for key, limit, period in checks:
+        result = limiter.hit(key, limit, period)
+        if not result.allowed:
+            for counted in checks[:len(results)]:
+                limiter.release(*counted)
+            return result
+        results.append(result)
+    return min(results, key=lambda result: result.remaining)
@@ -0,0 +1,149 @@
+"""
+Cached lookup of API integrations for the API key middleware
+
+Integrations are resolved by a SHA-256 hash of the API key so raw keys never
+end up in cache keys. Each entry is held in a short-lived process-local map in
+front of the shared Django cache, so a steady stream of requests with the same
+key does not touch the database at all. Entries are invalidated by the
+APIIntegration save/delete signals (see signals.py).
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ipwhitelist import IPWhitelist
+from .matching import EndpointMatcher
+from .models import APIIntegration
+
+CACHE_KEY_PREFIX = 'api_integration_'
+
+# Marker stored in the shared cache for keys that do not belong to any
+# integration, so invalid keys do not hit the database on every request
+MISSING = 'missing'
+
+
+def hash_api_key(api_key):
+    """Return the hex digest used to identify an API key in caches"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+@dataclass(frozen=True)
+class CachedIntegration:
+    """
+    Immutable snapshot of the parts of an APIIntegration used on the request path
+    """
+    id: object
+    name: str
+    is_active: bool
+    rate_limit: int
+    ip_whitelist: IPWhitelist
+    endpoint_matcher: EndpointMatcher
+
+    @classmethod
+    def from_fields(cls, fields):
+        return cls(
+            id=fields['id'],
+            name=fields['name'],
+            is_active=fields['is_active'],
+            rate_limit=fields['rate_limit'],
+            ip_whitelist=IPWhitelist.from_setting(fields['ip_whitelist']),
+            endpoint_matcher=EndpointMatcher.from_setting(fields['allowed_endpoints']),
+        )
+
+    @staticmethod
+    def fields_from_model(integration):
+        """Plain, picklable representation stored in the shared cache"""
+        return {
+            'id': integration.id,
+            'name': integration.name,
+            'is_active': integration.is_active,
+            'rate_limit': integration.rate_limit,
+            'ip_whitelist': integration.ip_whitelist or '',
+            'allowed_endpoints': integration.allowed_endpoints or '',
+        }
+
+    def is_ip_allowed(self, ip_address):
+        if not self.ip_whitelist:
+            return True
+        return ip_address in self.ip_whitelist
+
+    def is_endpoint_allowed(self, path):
+        if not self.endpoint_matcher:
+            return True
+        return self.endpoint_matcher.matches(path)
+
+
+class IntegrationRegistry:
+    """
+    Two-level (process-local + shared cache) registry of API integrations
+    """
+
+    def __init__(self):
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @property
+    def local_timeout(self):
+        return getattr(settings, 'API_INTEGRATION_LOCAL_CACHE_TIMEOUT', 5)
+
+    @property
+    def shared_timeout(self):
+        return getattr(settings, 'API_INTEGRATION_CACHE_TIMEOUT', 300)
+
+    @property
+    def local_max_entries(self):
+        return getattr(settings, 'API_INTEGRATION_LOCAL_CACHE_MAX_ENTRIES', 1000)
+
+    def get(self, api_key):
+        """
+        Return the CachedIntegration for an API key, or None if the key is unknown
+        """
+        key_hash = hash_api_key(api_key)
+        now = time.monotonic()
+
+        local_entry = self._local.get(key_hash)
+        if local_entry is not None and local_entry[0] > now:
+            return local_entry[1]
+
+        cache_key = CACHE_KEY_PREFIX + key_hash
+        fields = cache.get(cache_key)
+        if fields is None:
+            fields = self._load(api_key)
+            cache.set(cache_key, fields, timeout=self.shared_timeout)
+
+        integration = None if fields == MISSING else CachedIntegration.from_fields(fields)
+        self._store_local(key_hash, integration, now)
+        return integration
+
+    def invalidate(self, api_key):
+        """Drop an API key from both the shared and the process-local cache"""
+        if not api_key:
+            return
+        key_hash = hash_api_key(api_key)
+        cache.delete(CACHE_KEY_PREFIX + key_hash)
+        with self._lock:
+            self._local.pop(key_hash, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _load(self, api_key):
+        try:
+            integration = APIIntegration.objects.get(api_key=api_key)
+        except APIIntegration.DoesNotExist:
+            return MISSING
+        return CachedIntegration.fields_from_model(integration)
+
+    def _store_local(self, key_hash, integration, now):
+        with self._lock:
+            if len(self._local) >= self.local_max_entries:
+                self._local.clear()
+            self._local[key_hash] = (now + self.local_timeout, integration)
+
+
+registry = IntegrationRegistry()
@@ -0,0 +1,172 @@
+"""
+Retention of API request logs and page views
+
+Rows older than a dataset's retention period (API_LOG_RETENTION_MONTHS,
+PAGE_VIEW_RETENTION_MONTHS) are removed a whole month at a time. When the
+table is partitioned (PostgreSQL, see partitioning.py), expired monthly
+partitions are detached and dropped, which takes constant time however many
+rows they hold, and upcoming months get their partitions ahead of time. The
+legacy partition (until its whole range has expired) and the default
+partition also hold expired rows; those are deleted from them in batches.
+Elsewhere all expired rows are deleted in batches.
+
+Before anything is removed, it can be archived as a gzipped CSV written by
+the streaming exporter (exports.py).
+"""
+import logging
+import os
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from apps.analyticsmanagement.models import PageView
+from . import exports, partitioning
+from .models import APIIntegrationLog
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 5000
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    model: type
+    time_field: str
+    setting: str
+    default_months: int
+
+    @property
+    def months(self):
+        return getattr(settings, self.setting, self.default_months)
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def column(self):
+        return self.model._meta.get_field(self.time_field).column
+
+
+# Keyed by export dataset name
+POLICIES = {
+    'api-logs': RetentionPolicy(APIIntegrationLog, 'request_time', 'API_LOG_RETENTION_MONTHS', 6),
+    'page-views': RetentionPolicy(PageView, 'timestamp', 'PAGE_VIEW_RETENTION_MONTHS', 13),
+}
+
+
+def retention_cutoff(months, now=None):
+    """Start of the oldest month that is kept"""
+    return partitioning.add_months(partitioning.month_start(now or timezone.now()), -months)
+
+
+def archive(dataset, directory, since, until):
+    """Write the rows in [since, until) to a gzipped CSV and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    start = f'{since:%Y%m%d}' if since else 'start'
+    path = os.path.join(directory, f'{dataset}-{start}-{until:%Y%m%d}.csv.gz')
+    with open(path, 'wb') as output:
+        for chunk in exports.stream_export(dataset, 'csv', since=since, until=until, compress=True):
+            output.write(chunk)
+    return path
+
+
+def ensure_partitions(dataset, months_ahead=None, now=None):
+    """Create the partitions of the current and next months; returns the names created"""
+    policy = POLICIES[dataset]
+    if not partitioning.is_partitioned(connection, policy.table):
+        return []
+    months_ahead = months_ahead if months_ahead is not None else getattr(settings, 'PARTITION_MONTHS_AHEAD', 3)
+    this_month = partitioning.month_start(now or timezone.now())
+    created = []
+    for months in range(months_ahead + 1):
+        month = partitioning.add_months(this_month, months)
+        name = partitioning.create_partition(connection, policy.table, policy.column, month)
+        if name:
+            created.append(name)
+    return created
+
+
+def prune(dataset, months=None, archive_dir=None, dry_run=False, now=None):
+    """
+    Remove the rows of a dataset that are older than its retention period
+
+    Returns a list of (what was removed, archive path or None).
+    """
+    policy = POLICIES[dataset]
+    cutoff = retention_cutoff(months if months is not None else policy.months, now)
+    if partitioning.is_partitioned(connection, policy.table):
+        return _drop_partitions(dataset, policy, cutoff, archive_dir, dry_run)
+    return _delete_rows(dataset, policy, cutoff, archive_dir, dry_run)
+
+
+def _drop_partitions(dataset, policy, cutoff, archive_dir, dry_run):
+    removed, partial = [], []
+    for partition in partitioning.list_partitions(connection, policy.table):
+        if partition.is_default or partition.end is None or partition.end > cutoff:
+            if partition.is_default or partition.start is None or partition.start < cutoff:
+                # Holds expired rows but cannot be dropped as a whole
+                partial.append(partition)
+            continue
+        path = None
+        if not dry_run:
+            if archive_dir:
+                path = archive(dataset, archive_dir, partition.start, partition.end)
+            partitioning.drop_partition(connection, policy.table, partition.name)
+            logger.info('Dropped partition %s', partition.name)
+        removed.append((f'partition {partition.name}', path))
+    removed.extend(_delete_partition_rows(dataset, policy, partial, cutoff, archive_dir, dry_run))
+    return removed
+
+
+def _delete_partition_rows(dataset, policy, partitions, cutoff, archive_dir, dry_run):
+    """Delete the expired rows of partitions that also hold rows still kept"""
+    quote = connection.ops.quote_name
+    counts = {}
+    with connection.cursor() as cursor:
+        for partition in partitions:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {quote(partition.name)} WHERE {quote(policy.column)} < %s', [cutoff]
+            )
+            counts[partition.name] = cursor.fetchone()[0]
+    expired = [partition for partition in partitions if counts[partition.name]]
+    if dry_run or not expired:
+        return [(f'{counts[p.name]} rows of partition {p.name} before {cutoff:%Y-%m-%d}', None) for p in expired]
+    # The expired months that had partitions of their own are gone by now,
+    # so the export only reads these rows
+    path = archive(dataset, archive_dir, None, cutoff) if archive_dir else None
+    removed = []
+    for partition in expired:
+        deleted = 0
+        while True:
+            # Small batches keep each transaction and its locks short
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {quote(partition.name)} WHERE ctid = ANY(ARRAY('
+                    f'SELECT ctid FROM {quote(partition.name)} WHERE {quote(policy.column)} < %s LIMIT %s))',
+                    [cutoff, DELETE_BATCH_SIZE],
+                )
+                if not cursor.rowcount:
+                    break
+                deleted += cursor.rowcount
+        logger.info('Deleted %s expired rows from partition %s', deleted, partition.name)
+        removed.append((f'{deleted} rows of partition {partition.name} before {cutoff:%Y-%m-%d}', path))
+    return removed
+
+
+def _delete_rows(dataset, policy, cutoff, archive_dir, dry_run):
+    expired = policy.model.objects.filter(**{f'{policy.time_field}__lt': cutoff})
+    count = expired.count()
+    if dry_run or not count:
+        return [(f'{count} rows before {cutoff:%Y-%m-%d}', None)] if count else []
+    path = archive(dataset, archive_dir, None, cutoff) if archive_dir else None
+    deleted = 0
+    while True:
+        # Small batches keep each transaction and its locks short
+        batch = list(expired.order_by(policy.time_field).values_list('pk', flat=True)[:DELETE_BATCH_SIZE])
+        if not batch:
+            break
+        deleted += policy.model.objects.filter(pk__in=batch).delete()[0]
+    return [(f'{deleted} rows before {cutoff:%Y-%m-%d}', path)]
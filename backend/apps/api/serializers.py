@@ -76,7 +76,11 @@ class DetailedUserSerializer(serializers.ModelSerializer):
         ]
     
     def get_content_count(self, obj):
-        return obj.content_set.filter(deleted_at__isnull=True).count()
+        # Annotated by the user views; counted here for a freshly saved user
+        count = getattr(obj, 'content_count', None)
+        if count is None:
+            count = obj.contents.filter(deleted_at__isnull=True).count()
+        return count
 
 
 class RoleDetailedSerializer(serializers.ModelSerializer):
@@ -87,7 +91,11 @@ class RoleDetailedSerializer(serializers.ModelSerializer):
         fields = '__all__'
     
     def get_user_count(self, obj):
-        return obj.users.filter(deleted_at__isnull=True).count()
+        # Annotated by the role views; counted here for a freshly saved role
+        count = getattr(obj, 'user_count', None)
+        if count is None:
+            count = obj.users.filter(deleted_at__isnull=True).count()
+        return count
 
 
 # Mobile AR Tour specific serializers
@@ -110,6 +118,13 @@ class MarkerSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
+class NearbyMarkerSerializer(MarkerSerializer):
+    distance = serializers.FloatField(read_only=True, help_text='Distance from the requested location in metres')
+
+    class Meta(MarkerSerializer.Meta):
+        fields = MarkerSerializer.Meta.fields + ['distance']
+
+
 class ChallengeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Challenge
@@ -189,4 +204,38 @@ class CreateMobileMediaContentSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
             validated_data['uploader'] = request.user
-        return MediaLibrary.objects.create(**validated_data)
\ No newline at end of file
+        return MediaLibrary.objects.create(**validated_data)
+
+class PositionSerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+
+
+class LocationPingSerializer(serializers.Serializer):
+    """
+    Serializer for location pings: the positions recorded since the last ping
+    """
+    positions = PositionSerializer(many=True, allow_empty=False, max_length=50)
+    reset = serializers.BooleanField(
+        default=False, help_text='Ignore the previous ping and report everything in range'
+    )
+
+
+class ProgressEventSerializer(serializers.Serializer):
+    """
+    Serializer for one queued challenge progress event
+    """
+    id = serializers.CharField(
+        max_length=64, required=False, help_text='Client-generated event id used to drop duplicates'
+    )
+    challenge = serializers.UUIDField()
+    occurred_at = serializers.DateTimeField()
+    score = serializers.IntegerField(min_value=0, required=False)
+    completed = serializers.BooleanField(default=True)
+
+
+class ProgressSyncSerializer(serializers.Serializer):
+    """
+    Serializer for a batch of queued challenge progress events
+    """
+    events = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=200)
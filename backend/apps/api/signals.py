@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.contentmanagement.models import Content
+from apps.usermanagement.models import Role
+from .models import APIIntegration
+from .registry import registry
+from .stats import system_stats_cache
+
+
+@receiver(post_init, sender=APIIntegration)
+def remember_api_key(sender, instance, **kwargs):
+    # Keep the key the instance was loaded with so a key rotation also
+    # invalidates the cache entry of the old key
+    instance._registry_api_key = instance.api_key
+
+
+def invalidate_integration(instance):
+    old_key, new_key = getattr(instance, '_registry_api_key', None), instance.api_key
+
+    def invalidate():
+        registry.invalidate(old_key)
+        registry.invalidate(new_key)
+    # Wait for the commit so a lookup in between cannot cache the old row
+    # again for API_INTEGRATION_CACHE_TIMEOUT
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=APIIntegration)
+def invalidate_integration_on_save(sender, instance, **kwargs):
+    invalidate_integration(instance)
+    instance._registry_api_key = instance.api_key
+
+
+@receiver(post_delete, sender=APIIntegration)
+def invalidate_integration_on_delete(sender, instance, **kwargs):
+    invalidate_integration(instance)
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def expire_system_stats(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which the statistics do not read
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    # Wait for the commit so a recomputation cannot read the old rows
+    transaction.on_commit(system_stats_cache.expire)
@@ -0,0 +1,37 @@
+"""
+Cached snapshot of the system-wide statistics served by /api/system-stats/
+
+The statistics are computed with three queries: one conditional aggregate
+over Content for the total and the count of every ContentStatus, one Role
+query annotated with its user count (every user has a role, so the user
+total is their sum) and a PageView count. The result is kept in the shared
+cache as a stale-while-revalidate snapshot (SYSTEM_STATS_CACHE_TTL and
+SYSTEM_STATS_STALE_TTL) and marked stale when content, users or roles change
+(logins excepted), so the endpoint itself needs no queries however many
+roles there are.
+"""
+from django.db.models import Count, Q
+
+from apps.analyticsmanagement.dashboard_cache import CachedPayload
+from apps.analyticsmanagement.models import PageView
+from apps.contentmanagement.models import Content, ContentStatus
+from apps.usermanagement.models import Role
+
+
+def compute_system_stats():
+    content = Content.objects.aggregate(
+        total=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status in ContentStatus.values},
+    )
+    roles = list(Role.objects.annotate(user_count=Count('users')).order_by('name').values_list('name', 'user_count'))
+    return {
+        'total_users': sum(count for _, count in roles),
+        'total_content': content.pop('total'),
+        'total_roles': len(roles),
+        'total_page_views': PageView.objects.count(),
+        'content_by_status': content,
+        'users_by_role': [{'role': name, 'count': count} for name, count in roles],
+    }
+
+
+system_stats_cache = CachedPayload('system_stats', compute_system_stats, setting_prefix='SYSTEM_STATS')
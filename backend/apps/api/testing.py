@@ -0,0 +1,78 @@
+"""
+Query budgets for API list endpoints
+
+``QueryBudgetMixin.assertQueryBudget`` requests a list endpoint after growing
+its data to each of several sizes and fails if the view runs more queries
+than its budget, or if the number of queries changes with the number of rows
+listed, which is how an N+1 query shows up. Only the view's own queries are
+counted: it is called directly with an authenticated request, without the
+middleware and session lookups.
+
+``list_endpoints`` finds every list view (including the list routes of
+viewsets) in a URLconf, so a test can require each of them to have a budget.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, resolve, reverse
+from rest_framework.mixins import ListModelMixin
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+
+def list_endpoints(urlconf='apps.api.urls'):
+    """Return the URL names of the list views (without path parameters) in urlconf"""
+    names = set()
+    patterns = list(get_resolver(urlconf).url_patterns)
+    while patterns:
+        pattern = patterns.pop()
+        if isinstance(pattern, URLResolver):
+            patterns.extend(pattern.url_patterns)
+            continue
+        # Router routes of viewsets carry the class and the actions they map
+        callback = pattern.callback
+        view_class = getattr(callback, 'view_class', None) or getattr(callback, 'cls', None)
+        if isinstance(pattern, URLPattern) and pattern.name and view_class is not None \
+                and issubclass(view_class, ListModelMixin) and not pattern.pattern.regex.groups \
+                and getattr(callback, 'actions', {}).get('get', 'list') == 'list':
+            names.add(pattern.name)
+    return names
+
+
+class QueryBudgetMixin:
+    """
+    Assertions on the number of queries of API list endpoints
+    """
+    budget_sizes = (2, 8)
+    # URL names are looked up in this URLconf, which is mounted at url_prefix
+    urlconf = 'apps.api.urls'
+    url_prefix = '/api'
+
+    def count_queries(self, url_name, user, params=None):
+        """Call a list view directly; returns (response, number of queries)"""
+        path = reverse(url_name, urlconf=self.urlconf)
+        request = APIRequestFactory().get(self.url_prefix + path, params or {})
+        force_authenticate(request, user=user)
+        view = resolve(path, urlconf=self.urlconf).func
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+            response.render()
+        return response, len(queries)
+
+    def assertQueryBudget(self, url_name, budget, user, grow, params=None, sizes=None):
+        """
+        Assert that listing url_name runs at most ``budget`` queries whatever
+        the number of rows
+
+        ``grow(n)`` must make the endpoint list at least n rows.
+        """
+        counts = []
+        sizes = sizes or self.budget_sizes
+        for size in sizes:
+            grow(size)
+            response, count = self.count_queries(url_name, user, params)
+            self.assertEqual(response.status_code, 200, f'{url_name}: {response.data}')
+            counts.append(count)
+        self.assertEqual(
+            len(set(counts)), 1, f'{url_name} runs {counts} queries for {list(sizes)} rows: an N+1 query'
+        )
+        self.assertLessEqual(counts[0], budget, f'{url_name} runs {counts[0]} queries, budget {budget}')
+
@@ -1,10 +1,42 @@
-from django.test import TestCase, Client
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from unittest import mock, skipIf
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
-from apps.contentmanagement.models import MediaLibrary
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from apps.analyticsmanagement.models import PageView
+from apps.contentmanagement import progress as progress_service
+from apps.contentmanagement.leaderboard import leaderboard
+from apps.contentmanagement.models import (
+    Challenge, ChallengeProgress, Content, ContentAnalytics, ContentCategory, MediaLibrary, Marker
+)
 from apps.usermanagement.models import Role
+from . import exports, partitioning, retention, usage, views
+from .ipwhitelist import IPWhitelist, get_client_ip
+from .log_buffer import APILogWriter
+from .matching import EndpointMatcher
+from .models import APIIntegration, APIIntegrationLog, APIUsageMinute
+from .profiling import profiler
+from .ratelimit import SlidingWindowLimiter, TokenBucketLimiter, check_rate_limits
+from .registry import registry
+from .serializers import DetailedUserSerializer, RoleDetailedSerializer
+from .stats import system_stats_cache
+from .testing import QueryBudgetMixin, list_endpoints
 
 User = get_user_model()
 
@@ -81,4 +113,1409 @@ class MobileMediaContentAPITest(APITestCase):
         """Test that users can get a specific media item"""
         response = self.client.get(self.media_detail_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['file_name'], 'test_image.jpg')
\ No newline at end of file
+        self.assertEqual(response.data['file_name'], 'test_image.jpg')
+
+class IntegrationRegistryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.integration = APIIntegration.objects.create(name='AR Mobile App')
+
+    def test_lookup_is_served_from_cache(self):
+        """Test that a resolved API key needs no queries on later requests"""
+        self.assertEqual(registry.get(self.integration.api_key).id, self.integration.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.get(self.integration.api_key).id, self.integration.id)
+
+        # Other workers only share the cache, not the local map
+        registry.clear_local()
+        with self.assertNumQueries(0):
+            registry.get(self.integration.api_key)
+
+    def test_unknown_key_is_cached(self):
+        """Test that invalid keys are not looked up in the database every time"""
+        self.assertIsNone(registry.get('not-a-key'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(registry.get('not-a-key'))
+
+    def test_save_and_delete_invalidate_entry(self):
+        """Test that saving or deleting an integration drops its cache entry"""
+        self.assertTrue(registry.get(self.integration.api_key).is_active)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration.is_active = False
+            self.integration.save()
+        self.assertFalse(registry.get(self.integration.api_key).is_active)
+
+        old_key = self.integration.api_key
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration.api_key = 'rotated-key'
+            self.integration.save()
+        self.assertIsNone(registry.get(old_key))
+        self.assertIsNotNone(registry.get('rotated-key'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration.delete()
+        self.assertIsNone(registry.get('rotated-key'))
+
+    def test_lookup_before_commit_is_not_kept(self):
+        """Test that an entry cached while the save is uncommitted is dropped on commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration.is_active = False
+            self.integration.save()
+            # Another worker resolving the key now still reads the committed,
+            # active row and caches it
+            with mock.patch.object(registry, '_load', return_value={
+                **registry._load(self.integration.api_key), 'is_active': True,
+            }):
+                self.assertTrue(registry.get(self.integration.api_key).is_active)
+        self.assertFalse(registry.get(self.integration.api_key).is_active)
+
+    def test_middleware_uses_cached_state(self):
+        """Test that the middleware rejects inactive keys from the registry"""
+        self.integration.is_active = False
+        self.integration.save()
+        response = self.client.get(
+            '/api/system-stats/', HTTP_AUTHORIZATION=f'Api-Key {self.integration.api_key}'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error'], 'API key is inactive')
+
+
+class APILogWriterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.integration = APIIntegration.objects.create(name='AR Mobile App')
+
+    def make_writer(self, **kwargs):
+        writer = APILogWriter(**kwargs)
+        # Keep the background thread out of the test transaction
+        writer._ensure_started = lambda: None
+        return writer
+
+    def log_fields(self, endpoint='/api/markers/'):
+        return {
+            'integration_id': self.integration.id,
+            'endpoint': endpoint,
+            'method': 'GET',
+            'response_status': 200,
+        }
+
+    def test_rows_are_written_in_batches(self):
+        """Test that queued rows are inserted with one query per batch"""
+        writer = self.make_writer(batch_size=2)
+        for _ in range(3):
+            writer.write(**self.log_fields())
+        self.assertEqual(writer.pending(), 3)
+        self.assertEqual(APIIntegrationLog.objects.count(), 0)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(writer.flush(), 3)
+        self.assertEqual(APIIntegrationLog.objects.count(), 3)
+
+    def test_stop_writes_pending_rows(self):
+        """Test that stopping writes what is queued and leaves the caller's connection usable"""
+        writer = self.make_writer()
+        writer.write(**self.log_fields())
+        writer.stop()
+        self.assertEqual(APIIntegrationLog.objects.count(), 1)
+
+    def test_drop_policies(self):
+        """Test that a full buffer drops rows instead of blocking"""
+        writer = self.make_writer(max_size=2, drop_policy='drop_newest')
+        for endpoint in ('/api/a/', '/api/b/', '/api/c/'):
+            writer.write(**self.log_fields(endpoint))
+        self.assertEqual(writer.dropped, 1)
+        writer.flush()
+        self.assertEqual(
+            sorted(APIIntegrationLog.objects.values_list('endpoint', flat=True)), ['/api/a/', '/api/b/']
+        )
+
+        APIIntegrationLog.objects.all().delete()
+        writer = self.make_writer(max_size=2, drop_policy='drop_oldest')
+        for endpoint in ('/api/a/', '/api/b/', '/api/c/'):
+            writer.write(**self.log_fields(endpoint))
+        writer.flush()
+        self.assertEqual(
+            sorted(APIIntegrationLog.objects.values_list('endpoint', flat=True)), ['/api/b/', '/api/c/']
+        )
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_middleware_logs_request(self):
+        """Test that authenticated API requests are logged"""
+        response = self.client.get(
+            '/api/challenges/', HTTP_AUTHORIZATION=f'Api-Key {self.integration.api_key}'
+        )
+        self.assertEqual(response.status_code, 200)
+        log = APIIntegrationLog.objects.get()
+        self.assertEqual(log.integration_id, self.integration.id)
+        self.assertEqual(log.endpoint, '/api/challenges/')
+
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+
+    def hit_in_parallel(self, limiter, limit, workers=16, hits_per_worker=25):
+        allowed = []
+
+        def worker():
+            for _ in range(hits_per_worker):
+                allowed.append(limiter.hit('load-test', limit, 86400).allowed)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return allowed.count(True)
+
+    def test_sliding_window_is_exact_under_parallel_hits(self):
+        """Test that concurrent workers never exceed the limit"""
+        self.assertEqual(self.hit_in_parallel(SlidingWindowLimiter(), 100), 100)
+
+    def test_token_bucket_is_exact_under_parallel_hits(self):
+        """Test that concurrent workers never take more tokens than the bucket holds"""
+        self.assertEqual(self.hit_in_parallel(TokenBucketLimiter(), 100), 100)
+
+    def test_sliding_window_across_window_boundary(self):
+        """Test that a new window does not grant a fresh allowance immediately"""
+        limiter = SlidingWindowLimiter()
+        for _ in range(10):
+            self.assertTrue(limiter.hit('boundary', 10, 60, now=59).allowed)
+        result = limiter.hit('boundary', 10, 60, now=61)
+        self.assertFalse(result.allowed)
+        self.assertGreater(result.retry_after, 0)
+        self.assertTrue(limiter.hit('boundary', 10, 60, now=119).allowed)
+
+    def test_token_bucket_refills(self):
+        """Test that tokens are refilled over the period"""
+        limiter = TokenBucketLimiter()
+        self.assertTrue(limiter.hit('refill', 2, 60, now=0).allowed)
+        self.assertTrue(limiter.hit('refill', 2, 60, now=0).allowed)
+        result = limiter.hit('refill', 2, 60, now=1)
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.retry_after, 29)
+        self.assertTrue(limiter.hit('refill', 2, 60, now=31).allowed)
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_middleware_returns_rate_limit_headers(self):
+        """Test that responses carry X-RateLimit headers and 429s carry Retry-After"""
+        integration = APIIntegration.objects.create(name='AR Mobile App', rate_limit=1)
+        auth = f'Api-Key {integration.api_key}'
+
+        response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-RateLimit-Limit'], '1')
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+
+        response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(API_LOG_ASYNC=False, API_ENDPOINT_RATE_LIMITS={'/challenges/*': '1/minute'})
+    def test_per_endpoint_limits(self):
+        """Test that per-endpoint limits apply on top of the integration limit"""
+        integration = APIIntegration.objects.create(name='AR Mobile App')
+        auth = f'Api-Key {integration.api_key}'
+
+        self.assertEqual(self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth).status_code, 200)
+        self.assertEqual(self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth).status_code, 429)
+        self.assertEqual(self.client.get('/api/categories/', HTTP_AUTHORIZATION=auth).status_code, 200)
+
+
+    @override_settings(API_ENDPOINT_RATE_LIMITS={'/challenges/*': '1/minute'})
+    def test_denied_requests_do_not_count(self):
+        """Test that an endpoint 429 leaves the hourly remaining unchanged and an hourly 429 the endpoint's"""
+        for limiter in (SlidingWindowLimiter(), TokenBucketLimiter()):
+            cache.clear()
+            integration = APIIntegration.objects.create(name='AR Mobile App', rate_limit=3)
+            first = check_rate_limits(integration, '10.0.0.1', '/api/challenges/', limiter)
+            self.assertEqual(first.remaining, 0)
+            for _ in range(5):
+                self.assertFalse(check_rate_limits(integration, '10.0.0.1', '/api/challenges/', limiter).allowed)
+            self.assertEqual(check_rate_limits(integration, '10.0.0.1', '/api/categories/', limiter).remaining, 1)
+
+            integration.rate_limit = 1
+            self.assertTrue(check_rate_limits(integration, '10.0.0.2', '/api/categories/', limiter).allowed)
+            self.assertFalse(check_rate_limits(integration, '10.0.0.2', '/api/challenges/', limiter).allowed)
+            # The endpoint request the hourly limit denied was given back
+            self.assertTrue(limiter.hit(f'{integration.id}:10.0.0.2:/challenges/*', 1, 60).allowed)
+
+
+class EndpointMatcherTest(TestCase):
+    def test_exact_and_wildcard_rules(self):
+        """Test that rules match like the per-rule checks they replace"""
+        matcher = EndpointMatcher.from_setting('/markers/, /challenges/*, /content/*/media')
+        self.assertTrue(matcher.matches('/api/markers/'))
+        self.assertTrue(matcher.matches('/api/challenges/123/'))
+        self.assertTrue(matcher.matches('/api/content/abc/media/'))
+        self.assertFalse(matcher.matches('/api/markers/123/'))
+        self.assertFalse(matcher.matches('/api/content/abc/'))
+        self.assertFalse(matcher.matches('/api/users/'))
+
+    def test_rules_are_literal_apart_from_wildcards(self):
+        """Test that regex characters in a rule are not treated as patterns"""
+        matcher = EndpointMatcher.from_setting('/v1.0/items/')
+        self.assertTrue(matcher.matches('/api/v1.0/items/'))
+        self.assertFalse(matcher.matches('/api/v1x0/items/'))
+
+    def test_hundreds_of_rules(self):
+        """Test that a large rule set compiles into one working matcher"""
+        endpoints = [f'/exhibit-{i}/markers/*' for i in range(500)] + [f'/exhibit-{i}/info/' for i in range(500)]
+        matcher = EndpointMatcher(endpoints)
+        self.assertTrue(matcher.matches('/api/exhibit-42/markers/7/'))
+        self.assertTrue(matcher.matches('/api/exhibit-499/info/'))
+        self.assertFalse(matcher.matches('/api/exhibit-500/info/'))
+        self.assertFalse(matcher.matches('/api/exhibit-42/other/'))
+
+    def test_empty_setting_allows_everything(self):
+        """Test that integrations without rules are not restricted"""
+        self.assertFalse(EndpointMatcher.from_setting(''))
+
+
+class IPWhitelistTest(TestCase):
+    def test_cidr_ranges(self):
+        """Test that IPv4 and IPv6 CIDR entries and single addresses are matched"""
+        whitelist = IPWhitelist.from_setting('10.0.0.0/8, 192.168.1.7, 2001:db8::/32')
+        self.assertIn('10.20.30.40', whitelist)
+        self.assertIn('192.168.1.7', whitelist)
+        self.assertIn('2001:db8::1', whitelist)
+        self.assertIn('::ffff:10.1.2.3', whitelist)
+        self.assertNotIn('11.0.0.1', whitelist)
+        self.assertNotIn('192.168.1.8', whitelist)
+        self.assertNotIn('2001:db9::1', whitelist)
+        self.assertNotIn('not-an-ip', whitelist)
+
+    def test_overlapping_and_invalid_entries(self):
+        """Test that overlapping ranges are merged and invalid entries skipped"""
+        whitelist = IPWhitelist.from_setting('10.0.0.0/24, 10.0.0.128/25, bogus, 10.0.1.0/24')
+        self.assertEqual([str(network) for network in whitelist.networks], ['10.0.0.0/23'])
+        self.assertIn('10.0.1.255', whitelist)
+
+    def test_large_whitelist(self):
+        """Test lookups against hundreds of individual addresses"""
+        whitelist = IPWhitelist([f'172.16.{i // 256}.{i % 256}' for i in range(0, 1000, 2)])
+        self.assertIn('172.16.3.230', whitelist)
+        self.assertNotIn('172.16.3.231', whitelist)
+
+    def test_client_ip_with_trusted_proxies(self):
+        """Test that only addresses added by trusted proxies are believed"""
+        factory = RequestFactory()
+        request = factory.get('/api/markers/', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.5', REMOTE_ADDR='10.0.0.2')
+        with self.settings(API_TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(get_client_ip(request), '10.0.0.2')
+        with self.settings(API_TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(get_client_ip(request), '203.0.113.5')
+        with self.settings(API_TRUSTED_PROXY_COUNT=2):
+            self.assertEqual(get_client_ip(request), '6.6.6.6')
+        with self.settings(API_TRUSTED_PROXY_COUNT=5):
+            self.assertEqual(get_client_ip(request), '6.6.6.6')
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_middleware_applies_cidr_whitelist(self):
+        """Test that the middleware accepts clients inside a whitelisted range"""
+        cache.clear()
+        registry.clear_local()
+        integration = APIIntegration.objects.create(name='AR Mobile App', ip_whitelist='127.0.0.0/8')
+        auth = f'Api-Key {integration.api_key}'
+        self.assertEqual(self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth).status_code, 200)
+        response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=auth, REMOTE_ADDR='8.8.8.8')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class NearbyMarkersAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='AR Mobile App').api_key}"
+        for i, offset in enumerate((0.001, 0.002, 0.003, 0.2)):
+            Marker.objects.create(
+                code=f'marker-{i}', latitude=14.5869 + offset, longitude=120.9762, content_url=f'/content/{i}/'
+            )
+
+    def get(self, **params):
+        return self.client.get('/api/nearby-markers/', params, HTTP_AUTHORIZATION=self.auth)
+
+    def test_radius_query(self):
+        """Test that only markers within the radius are returned, nearest first"""
+        response = self.get(latitude=14.5869, longitude=120.9762, radius=1000)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([m['code'] for m in response.data['results']], ['marker-0', 'marker-1', 'marker-2'])
+        self.assertAlmostEqual(response.data['results'][0]['distance'], 111, delta=1)
+
+    def test_nearest_query_is_paginated(self):
+        """Test that nearest-marker queries honour limit and offset"""
+        response = self.get(latitude=14.5869, longitude=120.9762, limit=2)
+        self.assertEqual([m['code'] for m in response.data['results']], ['marker-0', 'marker-1'])
+        self.assertNotIn('count', response.data)
+        self.assertIn('offset=2', response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.get(latitude=14.5869, longitude=120.9762, limit=2, offset=2)
+        self.assertEqual([m['code'] for m in response.data['results']], ['marker-2', 'marker-3'])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    @override_settings(MARKER_INDEX_ENABLED=False)
+    def test_database_nearest_query_is_paginated(self):
+        """Test that nearest-marker pages from the database search have no count either"""
+        response = self.get(latitude=14.5869, longitude=120.9762, limit=3)
+        self.assertEqual([m['code'] for m in response.data['results']], ['marker-0', 'marker-1', 'marker-2'])
+        self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+        self.assertIsNotNone(response.data['next'])
+
+    @override_settings(MARKER_INDEX_ENABLED=False)
+    def test_database_search_fallback(self):
+        """Test that the geohash database search returns the same ranking"""
+        response = self.get(latitude=14.5869, longitude=120.9762, radius=1000)
+        self.assertEqual([m['code'] for m in response.data['results']], ['marker-0', 'marker-1', 'marker-2'])
+
+    def test_location_is_required(self):
+        """Test that a missing or invalid location is rejected"""
+        self.assertEqual(self.get().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get(latitude=91, longitude=0).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class LocationPingAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='AR Mobile App').api_key}"
+        role, _ = Role.objects.get_or_create(name='Player', description='Mobile app player')
+        self.user = User.objects.create_user(
+            email='player@example.com', username='player', password='testpass123', role=role
+        )
+        self.client.force_login(self.user)
+        self.origin = (14.5869, 120.9762)
+        # About 55 m, 110 m and 220 m north of the origin
+        self.near, self.middle, self.far = [
+            Marker.objects.create(
+                code=f'marker-{i}', latitude=self.origin[0] + offset, longitude=self.origin[1],
+                content_url=f'/content/{i}/',
+            )
+            for i, offset in enumerate((0.0005, 0.001, 0.002))
+        ]
+        self.challenge = Challenge.objects.create(
+            title='Find the exhibit', description='...', type='scavenger_hunt', points=10, author=self.user, marker=self.near
+        )
+
+    def ping(self, *positions, **extra):
+        data = {'positions': [{'latitude': lat, 'longitude': lon} for lat, lon in positions], **extra}
+        return self.client.post('/api/location-ping/', data, content_type='application/json', HTTP_AUTHORIZATION=self.auth)
+
+    def test_only_newly_entered_markers_are_returned(self):
+        """Test that consecutive pings return diffs of the markers in range"""
+        response = self.ping(self.origin)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['code'] for m in response.data['markers']], ['marker-0'])
+        self.assertEqual([c['id'] for c in response.data['challenges']], [str(self.challenge.id)])
+
+        response = self.ping(self.origin)
+        self.assertEqual(response.data['markers'], [])
+        self.assertEqual(response.data['challenges'], [])
+
+        # Walking north: marker-1 enters range, marker-0 is still within 100 m
+        response = self.ping((self.origin[0] + 0.0008, self.origin[1]))
+        self.assertEqual([m['code'] for m in response.data['markers']], ['marker-1'])
+        self.assertEqual(response.data['exited_markers'], [])
+
+        response = self.ping((self.origin[0] + 0.002, self.origin[1]))
+        self.assertEqual([m['code'] for m in response.data['markers']], ['marker-2'])
+        self.assertEqual(response.data['exited_markers'], sorted([str(self.near.id), str(self.middle.id)]))
+
+    def test_batched_positions(self):
+        """Test that every position in a batch counts towards the markers in range"""
+        response = self.ping(self.origin, (self.origin[0] + 0.002, self.origin[1]))
+        self.assertEqual([m['code'] for m in response.data['markers']], ['marker-2', 'marker-0'])
+
+    def test_reset_and_completed_challenges(self):
+        """Test that reset reports everything again, except completed challenges"""
+        self.ping(self.origin)
+        ChallengeProgress.objects.create(
+            user=self.user, challenge=self.challenge, score=10, completed_at=self.challenge.created_at
+        )
+        response = self.ping(self.origin, reset=True)
+        self.assertEqual([m['code'] for m in response.data['markers']], ['marker-0'])
+        self.assertEqual(response.data['challenges'], [])
+
+    def test_invalid_ping(self):
+        """Test that pings without valid positions are rejected"""
+        self.assertEqual(self.ping().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.ping((91, 0)).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class LeaderboardAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        leaderboard.clear()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='AR Mobile App').api_key}"
+        role, _ = Role.objects.get_or_create(name='Player', description='Mobile app player')
+        self.users = [
+            User.objects.create_user(email=f'player{i}@example.com', username=f'player{i}', password='x', role=role)
+            for i in range(3)
+        ]
+        self.client.force_login(self.users[2])
+        challenge = Challenge.objects.create(
+            title='Quiz', description='...', type='quiz', points=10, author=self.users[0]
+        )
+        for user, score in zip(self.users, (10, 30, 20)):
+            with self.captureOnCommitCallbacks(execute=True):
+                ChallengeProgress.objects.create(
+                    user=user, challenge=challenge, score=score, completed_at=challenge.created_at
+                )
+
+    def test_leaderboard(self):
+        """Test that the leaderboard lists users by score with the caller's rank"""
+        response = self.client.get('/api/leaderboard/', {'limit': 2}, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['username'] for entry in response.data['results']], ['player1', 'player2'])
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['me'], {'rank': 2, 'score': 20})
+
+        response = self.client.get('/api/leaderboard/', {'board': 'quiz', 'offset': 2}, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.data['results'], [
+            {'rank': 3, 'user': str(self.users[0].pk), 'username': 'player0', 'score': 10}
+        ])
+
+    def test_unknown_board(self):
+        """Test that unknown boards are rejected"""
+        response = self.client.get('/api/leaderboard/', {'board': 'monthly'}, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class CompleteChallengeAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        leaderboard.clear()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='AR Mobile App').api_key}"
+        role, _ = Role.objects.get_or_create(name='Player', description='Mobile app player')
+        self.user = User.objects.create_user(email='player@example.com', username='player', password='x', role=role)
+        self.client.force_login(self.user)
+        self.challenge = Challenge.objects.create(
+            title='Quiz', description='...', type='quiz', points=30, author=self.user
+        )
+
+    def complete(self, challenge_id=None, **headers):
+        return self.client.post(
+            f'/api/complete-challenge/{challenge_id or self.challenge.pk}/', HTTP_AUTHORIZATION=self.auth, **headers
+        )
+
+    def test_complete_is_idempotent(self):
+        """Test that completing twice keeps the first completion"""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.complete()
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data['score'], 30)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.complete()
+        self.assertEqual(second.data['completed_at'], first.data['completed_at'])
+        self.assertEqual(ChallengeProgress.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(leaderboard.rank('global', self.user.pk), (1, 30))
+
+    def test_completes_started_progress(self):
+        """Test that an existing, incomplete progress row gets completed"""
+        ChallengeProgress.objects.create(user=self.user, challenge=self.challenge, score=0)
+        response = self.complete()
+        self.assertEqual(response.data['score'], 30)
+        self.assertIsNotNone(response.data['completed_at'])
+
+    def test_unknown_challenge(self):
+        """Test that completing a missing challenge returns 404"""
+        self.assertEqual(self.complete(challenge_id=uuid.uuid4()).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_idempotency_key_replays_response(self):
+        """Test that retries with the same Idempotency-Key do not touch the database"""
+        first = self.complete(HTTP_IDEMPOTENCY_KEY='tap-1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.complete(HTTP_IDEMPOTENCY_KEY='tap-1')
+        # Only the session, user and request log queries remain
+        self.assertFalse([query for query in ctx.captured_queries if 'FROM "challenge' in query['sql'] or 'INTO "challenge' in query['sql']])
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        other = Challenge.objects.create(title='Hunt', description='...', type='quiz', points=5, author=self.user)
+        response = self.complete(challenge_id=other.pk, HTTP_IDEMPOTENCY_KEY='tap-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_concurrent_duplicate_is_rejected(self):
+        """Test that a retry arriving while the first request runs gets a 409 without running the view"""
+        duplicates = []
+        complete_challenge = progress_service.complete_challenge
+
+        def complete_with_retry(*args, **kwargs):
+            duplicates.append(self.complete(HTTP_IDEMPOTENCY_KEY='tap-1'))
+            return complete_challenge(*args, **kwargs)
+
+        with mock.patch.object(progress_service, 'complete_challenge', side_effect=complete_with_retry) as patched:
+            first = self.complete(HTTP_IDEMPOTENCY_KEY='tap-1')
+        self.assertEqual(patched.call_count, 1)
+        self.assertEqual(duplicates[0].status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.complete(HTTP_IDEMPOTENCY_KEY='tap-1')['Idempotent-Replayed'], 'true')
+
+    def test_completion_reads_challenge_type_in_upsert(self):
+        """Test that completing a challenge is one query and scores on its type's board"""
+        leaderboard.count('type:quiz')
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            progress, completed = progress_service.complete_challenge(self.user, self.challenge.pk)
+        self.assertTrue(completed)
+        self.assertEqual(leaderboard.rank('type:quiz', self.user.pk), (1, 30))
+
+
+@skipIf(
+    connection.vendor == 'sqlite',
+    'SQLite test databases are shared-cache in-memory databases that reject concurrent writers',
+)
+class ConcurrentCompletionTest(TransactionTestCase):
+    def setUp(self):
+        leaderboard.clear()
+        role = Role.objects.create(name='Player', description='Mobile app player')
+        self.user = User.objects.create_user(email='player@example.com', username='player', password='x', role=role)
+        self.challenge = Challenge.objects.create(
+            title='Quiz', description='...', type='quiz', points=30, author=self.user
+        )
+
+    def test_parallel_completions(self):
+        """Test that parallel completions create one row and score once"""
+        results, errors = [], []
+        barrier = threading.Barrier(8)
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(progress_service.complete_challenge(self.user, self.challenge.pk))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len({progress.pk for progress, _ in results}), 1)
+        self.assertEqual([completed for _, completed in results].count(True), 1)
+        self.assertEqual(ChallengeProgress.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(leaderboard.rank('global', self.user.pk), (1, 30))
+
+
+@override_settings(API_LOG_ASYNC=False)
+class ChallengeProgressSyncAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        leaderboard.clear()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='AR Mobile App').api_key}"
+        role, _ = Role.objects.get_or_create(name='Player', description='Mobile app player')
+        self.user = User.objects.create_user(email='player@example.com', username='player', password='x', role=role)
+        self.client.force_login(self.user)
+        self.challenges = [
+            Challenge.objects.create(title=f'Quiz {i}', description='...', type='quiz', points=10, author=self.user)
+            for i in range(20)
+        ]
+
+    def sync(self, events):
+        return self.client.post(
+            '/api/challenge-progress/sync/', {'events': events},
+            content_type='application/json', HTTP_AUTHORIZATION=self.auth,
+        )
+
+    def event(self, challenge, minutes_ago, **fields):
+        occurred_at = timezone.now() - timedelta(minutes=minutes_ago)
+        return {'challenge': str(challenge.pk), 'occurred_at': occurred_at.isoformat(), **fields}
+
+    def test_sync_applies_and_reports_each_event(self):
+        """Test that a batch is merged per challenge with a result per event"""
+        # A board this process has read, so it updates it
+        leaderboard.count('global')
+        started = ChallengeProgress.objects.create(user=self.user, challenge=self.challenges[1], score=2)
+        done = ChallengeProgress.objects.create(
+            user=self.user, challenge=self.challenges[2], score=10, completed_at=timezone.now()
+        )
+        completion = self.event(self.challenges[0], 10, id='b')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.sync([
+                self.event(self.challenges[0], 30, id='a', score=3, completed=False),
+                completion,
+                completion,
+                self.event(self.challenges[1], 5, id='c', score=50),
+                self.event(self.challenges[2], 5, id='d', score=1),
+                {'id': 'e', 'challenge': str(uuid.uuid4()), 'occurred_at': timezone.now().isoformat()},
+                {'id': 'f', 'challenge': 'not-a-uuid'},
+            ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['created', 'created', 'duplicate', 'updated', 'unchanged', 'invalid', 'invalid'],
+        )
+        self.assertEqual(results[3]['progress'], started.pk)
+        self.assertIn('challenge', results[6]['errors'])
+
+        progress = ChallengeProgress.objects.get(user=self.user, challenge=self.challenges[0])
+        self.assertEqual(progress.score, 10)
+        self.assertEqual(progress.completed_at.isoformat(), completion['occurred_at'])
+        started.refresh_from_db()
+        self.assertEqual((started.score, started.completed_at is not None), (10, True))
+        done.refresh_from_db()
+        self.assertEqual(done.score, 10)
+        self.assertEqual(leaderboard.rank('global', self.user.pk), (1, 20))
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        """Test that syncing 50 events costs the same queries as syncing 5"""
+        def count(events):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.sync(events).status_code, status.HTTP_200_OK)
+            return len(ctx.captured_queries)
+
+        self.sync([self.event(self.challenges[0], 5)])  # resolve the API key outside the counts
+        ChallengeProgress.objects.all().delete()
+        small = count([self.event(challenge, 5) for challenge in self.challenges[:5]])
+        ChallengeProgress.objects.all().delete()
+        large = count([
+            self.event(challenge, minutes, score=minutes)
+            for challenge in self.challenges for minutes in (1, 2)
+        ] + [self.event(challenge, 0) for challenge in self.challenges[:10]])
+        self.assertEqual(small, large)
+
+
+@override_settings(API_LOG_ASYNC=False, VIEW_COUNTER_ASYNC=False)
+class ContentViewCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='Web').api_key}"
+        role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        user = User.objects.create_user(email='editor@example.com', username='editor', password='x', role=role)
+        self.client.force_login(user)
+        self.content = Content.objects.create(
+            title='Exhibit', body='...', excerpt='...', file_path='', content_type='image',
+            author=user, analytics=ContentAnalytics.objects.create(),
+        )
+
+    def test_retrieve_counts_views(self):
+        """Test that reading content increments its view count"""
+        for _ in range(3):
+            response = self.client.get(f'/api/content/{self.content.pk}/', HTTP_AUTHORIZATION=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.content.analytics.refresh_from_db()
+        self.assertEqual(self.content.analytics.view_count, 3)
+        self.assertIsNotNone(self.content.analytics.last_viewed_at)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class ExportAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.integration = APIIntegration.objects.create(name='Museum kiosk')
+        self.other = APIIntegration.objects.create(name='Partner site')
+        self.auth = f"Api-Key {self.integration.api_key}"
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=role, is_staff=True
+        )
+        self.client.force_login(self.admin)
+        day = timezone.make_aware(timezone.datetime(2026, 3, 10, 12))
+        for i in range(30):
+            APIIntegrationLog.objects.create(
+                integration=self.other if i % 3 else self.integration, endpoint=f'/api/markers/{i}/',
+                method='GET', response_status=200, request_time=day + timedelta(hours=i),
+            )
+
+    def export(self, path, **params):
+        response = self.client.get(f'/api/exports/{path}', params, HTTP_AUTHORIZATION=self.auth)
+        if not response.streaming:
+            return response, None
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_filtered_by_range_and_integration(self):
+        """Test that a CSV export only contains the integration's rows in the date range"""
+        response, body = self.export(
+            'api-logs.csv', since='2026-03-10T18:00:00+00:00', until='2026-03-11', integration=str(self.other.pk)
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        expected = [f'/api/markers/{i}/' for i in range(6, 12) if i % 3]
+        self.assertEqual([row['endpoint'] for row in rows], expected)
+        self.assertEqual({row['integration_id'] for row in rows}, {str(self.other.pk)})
+
+    def test_gzipped_ndjson_is_streamed_in_chunks(self):
+        with mock.patch.object(exports, 'CHUNK_BYTES', 256):
+            plain = self.client.get('/api/exports/api-logs.ndjson', HTTP_AUTHORIZATION=self.auth)
+            self.assertGreater(len(list(plain.streaming_content)), 1)
+            response, body = self.export('api-logs.ndjson', until='2026-03-11T18:00:00+00:00', gzip='1')
+        self.assertEqual(plain['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0]['request_time'][:19], '2026-03-10T12:00:00')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.export('api-logs.csv', since='yesterday')[0].status_code, 400)
+        self.assertEqual(self.export('api-logs.csv', since='2026-02-30')[0].status_code, 400)
+        self.assertEqual(self.export('page-views.csv', until='2026-03-10T25:00:00')[0].status_code, 400)
+        self.assertEqual(self.export('page-views.csv', integration=str(self.other.pk))[0].status_code, 400)
+        self.assertEqual(self.export('api-logs.xml')[0].status_code, 400)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(self.export('api-logs.csv')[0].status_code, 403)
+
+    def test_export_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'logs.csv.gz')
+        self.addCleanup(os.remove, path)
+        call_command(
+            'export_logs', 'api-logs', '--integration', str(self.integration.pk), '--gzip', '--output', path,
+            stderr=io.StringIO(),
+        )
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 10)
+        with self.assertRaisesMessage(CommandError, 'Invalid date: 2026-02-30'):
+            call_command('export_logs', 'api-logs', '--since', '2026-02-30', stdout=io.StringIO())
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.integration = APIIntegration.objects.create(name='Museum kiosk')
+        self.now = timezone.make_aware(timezone.datetime(2026, 6, 15, 12))
+        for month in range(1, 7):
+            for day in (1, 28):
+                APIIntegrationLog.objects.create(
+                    integration=self.integration, endpoint='/api/markers/', method='GET', response_status=200,
+                    request_time=timezone.make_aware(timezone.datetime(2026, month, day, 8)),
+                )
+
+    def test_month_arithmetic(self):
+        month = partitioning.month_start(self.now)
+        self.assertEqual(month.isoformat(), '2026-06-01T00:00:00+00:00')
+        self.assertEqual(partitioning.add_months(month, 7).isoformat(), '2027-01-01T00:00:00+00:00')
+        self.assertEqual(retention.retention_cutoff(6, self.now).isoformat(), '2025-12-01T00:00:00+00:00')
+        self.assertEqual(partitioning.partition_name('api_integration_log', month), 'api_integration_log_2026_06')
+
+    def test_partition_bounds_are_parsed(self):
+        bound = "FOR VALUES FROM ('2026-06-01 00:00:00+00') TO ('2026-07-01 00:00:00+00')"
+        start, end = partitioning.BOUND_RE.search(bound).groups()
+        self.assertEqual((start, end), ('2026-06-01 00:00:00+00', '2026-07-01 00:00:00+00'))
+        self.assertEqual(partitioning.BOUND_RE.search("FOR VALUES FROM (MINVALUE) TO ('2026-07-01')").groups(),
+                         (None, '2026-07-01'))
+        self.assertIsNone(partitioning.BOUND_RE.search('DEFAULT'))
+
+    def test_prune_deletes_and_archives_whole_months(self):
+        """Test that without partitions expired months are archived and deleted in batches"""
+        archive_dir = tempfile.mkdtemp()
+        self.assertEqual(
+            retention.prune('api-logs', months=2, dry_run=True, now=self.now), [('6 rows before 2026-04-01', None)]
+        )
+        self.assertEqual(APIIntegrationLog.objects.count(), 12)
+
+        with mock.patch.object(retention, 'DELETE_BATCH_SIZE', 4):
+            (description, path), = retention.prune('api-logs', months=2, archive_dir=archive_dir, now=self.now)
+        self.addCleanup(os.remove, path)
+        self.assertEqual(description, '6 rows before 2026-04-01')
+        self.assertEqual(
+            APIIntegrationLog.objects.earliest('request_time').request_time,
+            timezone.make_aware(timezone.datetime(2026, 4, 1, 8)),
+        )
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 6)
+        self.assertEqual(retention.prune('api-logs', months=2, now=self.now), [])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('prune_logs', '--dataset', 'api-logs', '--months', '1', stdout=out)
+        self.assertIn('api-logs: removed', out.getvalue())
+
+    @skipIf(connection.vendor == 'postgresql', 'Partitioning is supported on PostgreSQL')
+    def test_partitioning_needs_postgresql(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_logs', stdout=io.StringIO())
+
+
+@skipIf(connection.vendor != 'postgresql', 'Partitioning needs PostgreSQL')
+class PartitioningTest(TestCase):
+    def setUp(self):
+        self.integration = APIIntegration.objects.create(name='Museum kiosk')
+        self.now = timezone.make_aware(timezone.datetime(2026, 6, 15, 12))
+        for month in range(1, 7):
+            for day in (1, 28):
+                self.log(timezone.datetime(2026, month, day, 8))
+
+    def log(self, moment):
+        return APIIntegrationLog.objects.create(
+            integration=self.integration, endpoint='/api/markers/', method='GET', response_status=200,
+            request_time=timezone.make_aware(moment),
+        )
+
+    def partitions(self, table='api_integration_log'):
+        return [partition.name for partition in partitioning.list_partitions(connection, table)]
+
+    def test_existing_rows_become_the_legacy_partition(self):
+        """Test that a table is partitioned in place, keeping its rows and its primary key lookups"""
+        converted = partitioning.partition_by_month(
+            connection, APIIntegrationLog, 'request_time', months_ahead=1, now=self.now
+        )
+        self.assertTrue(converted)
+        self.assertTrue(partitioning.is_partitioned(connection, 'api_integration_log'))
+        self.assertEqual(self.partitions(), [
+            'api_integration_log_legacy', 'api_integration_log_2026_07', 'api_integration_log_2026_08',
+            'api_integration_log_default',
+        ])
+        self.assertEqual(APIIntegrationLog.objects.count(), 12)
+
+        july, later = self.log(timezone.datetime(2026, 7, 3)), self.log(timezone.datetime(2027, 1, 3))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM api_integration_log_2026_07')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('SELECT COUNT(*) FROM api_integration_log_default')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(APIIntegrationLog.objects.get(pk=later.pk).request_time, later.request_time)
+        july.delete()
+        self.assertFalse(partitioning.partition_by_month(connection, APIIntegrationLog, 'request_time'))
+
+    def test_auto_increment_ids_continue(self):
+        """Test that a table with an identity primary key keeps numbering rows after its existing ids"""
+        first = PageView.objects.create(session_key='a')
+        partitioning.partition_by_month(connection, PageView, 'timestamp', months_ahead=0)
+        self.assertGreater(PageView.objects.create(session_key='b').pk, first.pk)
+        self.assertEqual(PageView.objects.count(), 2)
+
+    def test_prune_deletes_expired_rows_of_legacy_and_default_partitions(self):
+        """Test that expired rows in partitions that cannot be dropped whole are deleted in batches"""
+        partitioning.partition_by_month(connection, APIIntegrationLog, 'request_time', months_ahead=1, now=self.now)
+        self.log(timezone.datetime(2027, 1, 3))
+
+        with mock.patch.object(retention, 'DELETE_BATCH_SIZE', 4):
+            self.assertEqual(retention.prune('api-logs', months=2, now=self.now), [
+                ('6 rows of partition api_integration_log_legacy before 2026-04-01', None),
+            ])
+        self.assertEqual(APIIntegrationLog.objects.count(), 7)
+
+        later = timezone.make_aware(timezone.datetime(2028, 1, 15))
+        self.assertEqual(retention.prune('api-logs', months=2, dry_run=True, now=later), [
+            ('partition api_integration_log_legacy', None),
+            ('partition api_integration_log_2026_07', None),
+            ('partition api_integration_log_2026_08', None),
+            ('1 rows of partition api_integration_log_default before 2027-11-01', None),
+        ])
+        retention.prune('api-logs', months=2, now=later)
+        self.assertEqual(self.partitions(), ['api_integration_log_default'])
+        self.assertEqual(APIIntegrationLog.objects.count(), 0)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('partition_logs', '--dataset', 'page-views', stdout=out)
+        self.assertIn('page-views: partitioned', out.getvalue())
+        self.assertTrue(partitioning.is_partitioned(connection, PageView._meta.db_table))
+
+
+@override_settings(API_LOG_ASYNC=False)
+class APIUsageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.integration = APIIntegration.objects.create(name='AR Mobile App')
+        self.other = APIIntegration.objects.create(name='Partner site')
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=role, is_staff=True
+        )
+        self.minute = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=10)
+
+    def log(self, integration, endpoint, milliseconds, status_code=200, minute=0, method='GET'):
+        return {
+            'integration_id': integration.id,
+            'endpoint': endpoint,
+            'method': method,
+            'request_time': self.minute + timedelta(minutes=minute, seconds=5),
+            'response_status': status_code,
+            'response_time': milliseconds / 1000,
+        }
+
+    def test_percentiles_are_within_a_bucket(self):
+        histogram = [0] * usage.BUCKET_COUNT
+        for milliseconds in range(1, 1001):
+            histogram[usage.bucket_index(milliseconds)] += 1
+        for q in usage.PERCENTILES:
+            self.assertAlmostEqual(usage.percentile(histogram, q) / (q * 10), 1, delta=0.2)
+        self.assertIsNone(usage.percentile([0] * usage.BUCKET_COUNT, 50))
+        self.assertEqual(usage.normalize_endpoint(f'/api/markers/{uuid.uuid4()}/'), '/api/markers/{id}/')
+        self.assertEqual(usage.normalize_endpoint('/api/roles/12/'), '/api/roles/{id}/')
+
+    def test_batches_are_added_to_minute_rows(self):
+        """Test that usage from several batches accumulates in one row per endpoint and minute"""
+        usage.record_logs([self.log(self.integration, '/api/markers/1/', 10) for _ in range(3)])
+        usage.record_logs([
+            self.log(self.integration, '/api/markers/2/', 100, status_code=404),
+            self.log(self.integration, '/api/markers/3/', 10, minute=1),
+        ])
+        first, second = APIUsageMinute.objects.order_by('minute')
+        self.assertEqual(
+            (first.endpoint, first.count, first.status_2xx, first.status_4xx), ('/api/markers/{id}/', 4, 3, 1)
+        )
+        self.assertEqual(sum(first.histogram), 4)
+        self.assertAlmostEqual(first.total_time, 0.13)
+        self.assertEqual((second.minute - first.minute, second.count), (timedelta(minutes=1), 1))
+
+    def test_middleware_requests_are_counted(self):
+        for _ in range(2):
+            self.client.get('/api/challenges/', HTTP_AUTHORIZATION=f'Api-Key {self.integration.api_key}')
+        row = APIUsageMinute.objects.get()
+        self.assertEqual(
+            (row.integration_id, row.endpoint, row.method, row.count),
+            (self.integration.id, '/api/challenges/', 'GET', 2),
+        )
+
+    def test_writer_saves_usage_separately_from_log_batches(self):
+        writer = APILogWriter(batch_size=2)
+        writer._ensure_started = lambda: None
+        with override_settings(API_LOG_ASYNC=True):
+            for _ in range(3):
+                writer.write(**self.log(self.integration, '/api/markers/', 5))
+        writer.flush()
+        self.assertFalse(APIUsageMinute.objects.exists())
+        self.assertEqual(writer.flush_usage(), 1)
+        self.assertEqual(APIUsageMinute.objects.get().count, 3)
+        self.assertEqual(writer.flush_usage(), 0)
+
+    def test_rebuild_matches_incremental_usage(self):
+        rows = [
+            self.log(self.integration, f'/api/markers/{i}/', i * 7, status_code=500 if i % 5 == 0 else 200, minute=i % 3)
+            for i in range(1, 40)
+        ]
+        usage.record_logs(rows)
+        columns = ('minute', 'count', 'status_5xx', 'histogram')
+        incremental = list(APIUsageMinute.objects.order_by('minute').values(*columns))
+        APIIntegrationLog.objects.bulk_create([APIIntegrationLog(**row) for row in rows])
+        call_command('rebuild_api_usage', '--since', self.minute.isoformat(), stdout=io.StringIO())
+        rebuilt = list(APIUsageMinute.objects.order_by('minute').values(*columns))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_usage_endpoint(self):
+        usage.record_logs(
+            [self.log(self.integration, '/api/markers/', 20) for _ in range(10)]
+            + [
+                self.log(self.integration, '/api/content/', 400, status_code=500 if i < 2 else 200, minute=i % 2)
+                for i in range(10)
+            ]
+            + [self.log(self.other, '/api/markers/', 5)]
+        )
+        url = reverse('api-usage')
+        auth = f'Api-Key {self.integration.api_key}'
+        self.client.force_login(self.admin)
+        data = self.client.get(url, HTTP_AUTHORIZATION=auth).json()
+        self.assertEqual([(row['endpoint'], row['integration']) for row in data['results']], [
+            ('/api/content/', 'AR Mobile App'), ('/api/markers/', 'AR Mobile App'), ('/api/markers/', 'Partner site'),
+        ])
+        slowest = data['results'][0]
+        self.assertEqual((slowest['count'], slowest['status_5xx'], slowest['error_rate']), (10, 2, 0.2))
+        self.assertAlmostEqual(slowest['p95_ms'] / 400, 1, delta=0.2)
+        self.assertNotIn('series', data)
+
+        data = self.client.get(url, {'integration': str(self.integration.pk), 'endpoint': '/api/content/'},
+                               HTTP_AUTHORIZATION=auth).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual([point['count'] for point in data['series']], [5, 5])
+
+        self.assertEqual(self.client.get(url, {'since': 'soon'}, HTTP_AUTHORIZATION=auth).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2026-02-30'}, HTTP_AUTHORIZATION=auth).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=auth).status_code, 403)
+
+    def test_admin_report(self):
+        usage.record_logs([self.log(self.integration, '/api/markers/', 20)])
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('admin:api_apiusageminute_report')).status_code, 403)
+        self.admin.is_superuser = True
+        self.admin.save()
+        response = self.client.get(reverse('admin:api_apiusageminute_report'))
+        self.assertContains(response, '/api/markers/')
+        self.assertContains(self.client.get(reverse('admin:api_apiusageminute_changelist')), 'Latency report')
+
+
+@override_settings(API_LOG_ASYNC=False, SYSTEM_STATS_CACHE_ASYNC=False)
+class SystemStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        self.editor_role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        self.viewer_role, _ = Role.objects.get_or_create(name='Viewer', description='Viewer')
+        self.user = User.objects.create_user(
+            email='editor@example.com', username='editor', password='x', role=self.editor_role
+        )
+        for i in range(3):
+            User.objects.create_user(
+                email=f'viewer{i}@example.com', username=f'viewer{i}', password='x', role=self.viewer_role
+            )
+        for status_value in ('draft', 'draft', 'pending_review', 'approved'):
+            self.create_content(status_value)
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='Web').api_key}"
+        self.client.force_login(self.user)
+        self.url = reverse('system-stats')
+
+    def create_content(self, status_value):
+        return Content.objects.create(
+            title=f'{status_value} content', body='...', excerpt='...', file_path='', content_type='image',
+            status=status_value, author=self.user, analytics=ContentAnalytics.objects.create(),
+        )
+
+    def get(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_stats_use_content_statuses_and_role_counts(self):
+        data = self.get()
+        self.assertEqual(data['total_users'], 4)
+        self.assertEqual(data['total_content'], 4)
+        self.assertEqual(data['content_by_status'], {
+            'draft': 2, 'pending_review': 1, 'reviewed': 0, 'approved': 1, 'rejected': 0,
+        })
+        roles = {row['role']: row['count'] for row in data['users_by_role']}
+        self.assertEqual((roles['Editor'], roles['Viewer']), (1, 3))
+        self.assertEqual(data['total_roles'], len(roles))
+
+    def test_snapshot_query_count_does_not_depend_on_roles(self):
+        system_stats_cache.invalidate()
+        with self.assertNumQueries(3):
+            system_stats_cache.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Role.objects.create(name=f'Role {i}')
+        with self.assertNumQueries(3):
+            system_stats_cache.get()
+        request = APIRequestFactory().get(self.url)
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(0):
+            response = views.system_stats(request)
+        self.assertEqual(response.data['total_roles'], 7)
+
+    def test_snapshot_is_expired_when_content_changes(self):
+        """Test that a change serves the stale snapshot once while it is recomputed"""
+        self.assertEqual(self.get()['total_content'], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            content = self.create_content('rejected')
+        self.assertEqual(self.get()['total_content'], 4)
+        data = self.get()
+        self.assertEqual((data['total_content'], data['content_by_status']['rejected']), (5, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            content.delete()
+        self.get()
+        self.assertEqual(self.get()['total_content'], 4)
+
+    def test_login_keeps_snapshot(self):
+        """Test that saving only last_login does not expire the snapshot"""
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.client.login(email='editor@example.com', password='x'))
+        self.get()
+        self.assertEqual(system_stats_cache.stats()['stale'], 0)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Every list endpoint must keep a constant number of queries per page
+    """
+    # List endpoints that have no budget test yet; MarkerSerializer reads a
+    # content relation Marker does not have
+    UNBUDGETED = {'marker-list'}
+
+    def setUp(self):
+        cache.clear()
+        self.role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=self.role, is_staff=True
+        )
+
+    def grow_users(self, count):
+        role = Role.objects.create(name=f'Role {User.objects.count()}')
+        while User.objects.count() < count:
+            index = User.objects.count()
+            User.objects.create_user(email=f'user{index}@example.com', username=f'user{index}', password='x', role=role)
+
+    def grow_roles(self, count):
+        while Role.objects.count() < count:
+            role = Role.objects.create(name=f'Role {Role.objects.count()}')
+            index = User.objects.count()
+            User.objects.create_user(email=f'user{index}@example.com', username=f'user{index}', password='x', role=role)
+
+    def grow_challenges(self, count):
+        for i in range(count):
+            Challenge.objects.create(
+                title=f'Challenge {i}', description='...', type='quiz', author=self.admin
+            )
+
+    def new_user(self):
+        index = User.objects.count()
+        role = Role.objects.create(name=f'Role {index}')
+        return User.objects.create_user(
+            email=f'user{index}@example.com', username=f'user{index}', password=None, role=role
+        )
+
+    def test_every_list_endpoint_has_a_budget(self):
+        budgeted = {name[len('test_'):].replace('_', '-') for name in dir(self) if name.startswith('test_')}
+        self.assertEqual(list_endpoints() - budgeted - self.UNBUDGETED, set())
+
+    def test_user_list(self):
+        self.assertQueryBudget('user-list', 2, self.admin, self.grow_users)
+        response, _ = self.count_queries('user-list', self.admin)
+        user = next(row for row in response.data['results'] if row['username'] == 'user1')
+        self.assertEqual(user['content_count'], 0)
+        self.assertEqual(user['role']['name'], 'Role 1')
+
+    def test_role_list(self):
+        self.assertQueryBudget('role-list', 2, self.admin, self.grow_roles)
+        response, _ = self.count_queries('role-list', self.admin)
+        counts = {row['name']: row['user_count'] for row in response.data['results']}
+        self.assertEqual(counts['Editor'], 1)
+
+    def test_category_list(self):
+        def grow(count):
+            while ContentCategory.objects.count() < count:
+                ContentCategory.objects.create(name=f'Category {ContentCategory.objects.count()}')
+        self.assertQueryBudget('category-list', 2, self.admin, grow)
+
+    def test_challenge_list(self):
+        self.assertQueryBudget('challenge-list', 2, self.admin, self.grow_challenges)
+
+    def test_api_integration_list(self):
+        def grow(count):
+            while APIIntegration.objects.count() < count:
+                APIIntegration.objects.create(name=f'Integration {APIIntegration.objects.count()}')
+        self.assertQueryBudget('api-integration-list', 2, self.admin, grow)
+
+    def test_api_integration_log_list(self):
+        integration = APIIntegration.objects.create(name='Kiosk')
+
+        def grow(count):
+            APIIntegrationLog.objects.bulk_create([
+                APIIntegrationLog(integration=integration, endpoint='/api/markers/', method='GET', response_status=200)
+                for _ in range(count)
+            ])
+        self.assertQueryBudget('api-integration-log-list', 2, self.admin, grow)
+
+    def test_content_list(self):
+        def grow(count):
+            while Content.objects.count() < count:
+                Content.objects.create(
+                    title='Exhibit', body='...', excerpt='...', file_path='', content_type='image',
+                    author=self.new_user(), analytics=ContentAnalytics.objects.create(),
+                )
+        self.assertQueryBudget('content-list', 2, self.admin, grow)
+        response, _ = self.count_queries('content-list', self.admin)
+        self.assertEqual(response.data['results'][0]['role']['name'], 'Role 8')
+
+    def test_challenge_progress_list(self):
+        def grow(count):
+            while ChallengeProgress.objects.filter(user=self.admin).count() < count:
+                challenge = Challenge.objects.create(title='Hunt', description='...', type='quiz', author=self.admin)
+                ChallengeProgress.objects.create(user=self.admin, challenge=challenge)
+        self.assertQueryBudget('challenge-progress-list', 2, self.admin, grow)
+
+    def test_mobile_media_list(self):
+        def grow(count):
+            while MediaLibrary.objects.count() < count:
+                MediaLibrary.objects.create(
+                    file_name='a.png', file_path=f'/media/{MediaLibrary.objects.count()}.png', file_size=1,
+                    mime_type='image/png', uploader=self.new_user(),
+                )
+        self.assertQueryBudget('mobile-media-list', 2, self.admin, grow, params={'media_type': 'image'})
+
+    def test_detailed_serializers_count_fresh_objects(self):
+        """Test that objects without the annotations are still counted"""
+        self.assertEqual(DetailedUserSerializer(self.admin).data['content_count'], 0)
+        self.assertEqual(RoleDetailedSerializer(self.role).data['user_count'], 1)
+
+
+
+@override_settings(API_LOG_ASYNC=False, QUERY_PROFILER_SAMPLE_RATE=1, QUERY_PROFILER_SERVER_TIMING=True)
+class QueryProfilerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        profiler.reset()
+        self.auth = f"Api-Key {APIIntegration.objects.create(name='Kiosk').api_key}"
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        self.developer = User.objects.create_user(
+            email='developer@example.com', username='developer', password=None, role=role, is_staff=True
+        )
+
+    def test_sampled_requests_are_profiled(self):
+        self.client.force_login(self.developer)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        query_count = len(queries)
+        self.assertRegex(response['Server-Timing'], rf'^db;dur=[\d.]+;desc="{query_count} queries", render;dur=')
+
+        self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        rows = profiler.summary()
+        self.assertEqual(len(rows), 1)
+        row = rows[0]
+        self.assertEqual((row['method'], row['route'], row['count']), ('GET', '/api/challenges/', 2))
+        self.assertEqual(row['queries_max'], query_count)
+        self.assertGreater(row['render_ms_max'], 0)
+        self.assertGreaterEqual(row['total_ms_max'], row['db_ms_max'])
+
+    def test_detail_views_are_grouped_by_route(self):
+        for _ in range(2):
+            self.client.get(f'/api/challenges/{uuid.uuid4()}/', HTTP_AUTHORIZATION=self.auth)
+        [row] = profiler.summary()
+        self.assertEqual((row['route'], row['count']), ('/api/challenges/<uuid:pk>/', 2))
+
+    def test_unsampled_requests_are_not_profiled(self):
+        with override_settings(QUERY_PROFILER_SAMPLE_RATE=0):
+            response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        self.assertNotIn('Server-Timing', response)
+        self.client.get('/django-admin/login/')
+        self.assertEqual(profiler.summary(), [])
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        """Test that other clients' sampled requests are profiled without the header"""
+        response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        self.assertNotIn('Server-Timing', response)
+        self.developer.is_staff = False
+        self.developer.save()
+        self.client.force_login(self.developer)
+        response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(profiler.summary()[0]['count'], 2)
+
+    def test_server_timing_can_be_disabled(self):
+        self.client.force_login(self.developer)
+        with override_settings(QUERY_PROFILER_SERVER_TIMING=False):
+            response = self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(profiler.summary()), 1)
+
+    def test_admin_report(self):
+        self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=role, is_staff=True, is_superuser=True
+        )
+        self.client.force_login(admin)
+        url = reverse('admin:api_apiusageminute_profile')
+        self.assertContains(self.client.get(url), '/api/challenges/')
+        self.assertContains(self.client.get(reverse('admin:api_apiusageminute_changelist')), 'Query profile')
+
+        self.assertRedirects(self.client.post(url), url)
+        self.assertEqual(profiler.summary(), [])
+
+    def test_reset_needs_change_permission(self):
+        """Test that staff who can only view the profile cannot reset it"""
+        self.client.get('/api/challenges/', HTTP_AUTHORIZATION=self.auth)
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password=None, role=role, is_staff=True
+        )
+        staff.user_permissions.add(Permission.objects.get(codename='view_apiusageminute'))
+        self.client.force_login(staff)
+        url = reverse('admin:api_apiusageminute_profile')
+        response = self.client.get(url)
+        self.assertContains(response, '/api/challenges/')
+        self.assertNotContains(response, 'value="Reset"')
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertEqual(len(profiler.summary()), 1)
+
+
+@override_settings(API_LOG_ASYNC=False)
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear_local()
+        role, _ = Role.objects.get_or_create(name='Admin', description='Administrator')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=role, is_staff=True
+        )
+        self.integration = APIIntegration.objects.create(name='Kiosk')
+        now = timezone.now()
+        # Groups of rows share a request time, so the id has to break ties
+        APIIntegrationLog.objects.bulk_create([
+            APIIntegrationLog(
+                integration=self.integration, endpoint=f'/api/markers/{index}/', method='GET', response_status=200,
+                request_time=now - timedelta(seconds=index // 7),
+            )
+            for index in range(50)
+        ])
+        self.expected = list(APIIntegrationLog.objects.order_by('-request_time', '-id').values_list('id', flat=True))
+
+    def get(self, url, params=None):
+        request = APIRequestFactory().get(url, params)
+        force_authenticate(request, user=self.admin)
+        response = views.APIIntegrationLogListView.as_view()(request)
+        response.render()
+        return response
+
+    def walk(self, url, link):
+        """Follow link from url; returns the response data of every page"""
+        pages = []
+        while url:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data[link]
+        return pages
+
+    def ids(self, page):
+        return [uuid.UUID(row['id']) for row in page['results']]
+
+    def test_pages_forwards_and_backwards(self):
+        # The ordering parameter does not apply to keyset pages
+        pages = self.walk('http://testserver/api/api-integration-logs/?cursor=&ordering=endpoint', 'next')
+        self.assertNotIn('count', pages[0])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertEqual([len(page['results']) for page in pages], [20, 20, 10])
+        self.assertEqual([row for page in pages for row in self.ids(page)], self.expected)
+
+        backwards = self.walk(pages[-1]['previous'], 'previous')
+        self.assertEqual([self.ids(page) for page in backwards], [self.ids(pages[1]), self.ids(pages[0])])
+        self.assertEqual(self.ids(self.get(backwards[-1]['next']).data), self.ids(pages[1]))
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        counts = []
+        url = 'http://testserver/api/api-integration-logs/?cursor='
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(url)
+            counts.append(len(queries))
+            self.assertFalse(any('OFFSET' in query['sql'] or 'COUNT(' in query['sql'] for query in queries))
+            url = response.data['next']
+        self.assertEqual(set(counts), {1})
+
+    def test_filters_apply_to_the_keyset(self):
+        pages = self.walk('http://testserver/api/api-integration-logs/?cursor=&search=/api/markers/4', 'next')
+        expected = APIIntegrationLog.objects.filter(endpoint__contains='/api/markers/4').order_by('-request_time', '-id')
+        self.assertEqual([row for page in pages for row in self.ids(page)], list(expected.values_list('id', flat=True)))
+
+    def test_page_numbers_without_a_cursor(self):
+        response = self.get('/api/api-integration-logs/', {'page': 3})
+        self.assertEqual(response.data['count'], 50)
+        self.assertEqual([uuid.UUID(row['id']) for row in response.data['results']], self.expected[40:])
+
+    def test_invalid_cursor(self):
+        for cursor in ('nonsense', 'e30=', 'eyJwIjogWyJ4IiwgInkiXSwgInIiOiBmYWxzZX0='):
+            self.assertEqual(self.get('/api/api-integration-logs/', {'cursor': cursor}).status_code, 404)
+
+    def test_content_list(self):
+        for index in range(3):
+            Content.objects.create(
+                title=f'Exhibit {index}', body='...', excerpt='...', file_path='', content_type='image',
+                author=self.admin, analytics=ContentAnalytics.objects.create(),
+            )
+        request = APIRequestFactory().get('/api/content/', {'cursor': ''})
+        force_authenticate(request, user=self.admin)
+        response = views.ContentListView.as_view()(request)
+        self.assertEqual([row['title'] for row in response.data['results']], ['Exhibit 2', 'Exhibit 1', 'Exhibit 0'])
@@ -23,6 +23,7 @@ urlpatterns = [
     
     # Challenge progress endpoints
     path('challenge-progress/', views.UserChallengeProgressListView.as_view(), name='challenge-progress-list'),
+    path('challenge-progress/sync/', views.sync_challenge_progress, name='challenge-progress-sync'),
     path('challenge-progress/<uuid:pk>/', views.UserChallengeProgressDetailView.as_view(), name='challenge-progress-detail'),
     
     # Content categories
@@ -36,10 +37,16 @@ urlpatterns = [
     path('api-integrations/', views.APIIntegrationListView.as_view(), name='api-integration-list'),
     path('api-integrations/<uuid:pk>/', views.APIIntegrationDetailView.as_view(), name='api-integration-detail'),
     path('api-integration-logs/', views.APIIntegrationLogListView.as_view(), name='api-integration-log-list'),
+    path('api-usage/', views.api_usage, name='api-usage'),
+
+    # Streaming exports, e.g. exports/api-logs.ndjson?since=2026-01-01&gzip=1
+    path('exports/<slug:dataset>.<slug:file_format>', views.export_dataset, name='export'),
     
     # System statistics
     path('system-stats/', views.system_stats, name='system-stats'),
     path('user-content/', views.user_content, name='user-content'),
     path('nearby-markers/', views.nearby_markers, name='nearby-markers'),
+    path('location-ping/', views.location_ping, name='location-ping'),
+    path('leaderboard/', views.leaderboard_view, name='leaderboard'),
     path('complete-challenge/<uuid:challenge_id>/', views.complete_challenge, name='complete-challenge'),
 ]
\ No newline at end of file
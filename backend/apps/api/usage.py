@@ -0,0 +1,268 @@
+"""
+Per-integration API usage: latency percentiles and error rates
+
+The log writer (log_buffer.py) folds every batch of request logs it writes
+into in-memory usage and adds that to APIUsageMinute rows, one per integration, endpoint, method and
+minute. A row holds status class counters and a latency histogram with fixed
+log-scale buckets (bounds growing by a factor of 2 ** (1/4) from 1 ms to
+about 32 s, plus an overflow bucket). Histograms of any number of minutes merge by
+adding their counts, so p50/p95/p99 over any window are read from the minute
+rows without scanning the request logs. A percentile is accurate to within
+its bucket, i.e. about 19%.
+
+Endpoints are normalized before they are counted: path segments that are
+UUIDs or numbers become ``{id}``, so a detail endpoint is one series rather
+than one per object.
+"""
+import bisect
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import APIIntegrationLog, APIUsageMinute
+
+# Upper bounds of the histogram buckets in milliseconds; the last bucket
+# counts everything slower
+BUCKET_BOUNDS = tuple(2 ** (i / 4) for i in range(61))
+BUCKET_COUNT = len(BUCKET_BOUNDS) + 1
+
+PERCENTILES = (50, 95, 99)
+
+ID_SEGMENT_RE = re.compile(r'^(\d+|[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12})$', re.I)
+
+
+def bucket_index(milliseconds):
+    return bisect.bisect_left(BUCKET_BOUNDS, milliseconds)
+
+
+def normalize_endpoint(path):
+    """Replace id-like path segments with ``{id}``"""
+    return '/'.join('{id}' if ID_SEGMENT_RE.match(segment) else segment for segment in path.split('/'))[:255]
+
+
+def minute_bucket(moment):
+    return moment.replace(second=0, microsecond=0)
+
+
+def percentile(histogram, q):
+    """
+    Estimate the q-th percentile (0-100) in milliseconds from bucket counts
+
+    The position within the bucket is interpolated geometrically, matching
+    the bucket spacing. Returns None for an empty histogram.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q / 100 * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            fraction = (rank - seen) / count
+            if index == 0:
+                return BUCKET_BOUNDS[0] * fraction
+            lower = BUCKET_BOUNDS[index - 1]
+            if index >= len(BUCKET_BOUNDS):
+                # Nothing is known about the overflow bucket beyond its lower bound
+                return lower
+            upper = BUCKET_BOUNDS[index]
+            return lower * math.pow(upper / lower, fraction)
+        seen += count
+    return BUCKET_BOUNDS[-1]
+
+
+def merge_histograms(target, histogram):
+    """Add the counts of histogram to target in place"""
+    if len(target) < len(histogram):
+        target.extend([0] * (len(histogram) - len(target)))
+    for index, count in enumerate(histogram):
+        target[index] += count
+    return target
+
+
+@dataclass
+class UsageStats:
+    """
+    Counters and histogram of one integration/endpoint/method over a window
+    """
+    count: int = 0
+    status_2xx: int = 0
+    status_3xx: int = 0
+    status_4xx: int = 0
+    status_5xx: int = 0
+    total_time: float = 0.0
+    histogram: list = field(default_factory=lambda: [0] * BUCKET_COUNT)
+
+    def add_request(self, status, seconds):
+        self.count += 1
+        status_field = STATUS_FIELDS.get(status // 100)
+        if status_field:
+            setattr(self, status_field, getattr(self, status_field) + 1)
+        self.total_time += seconds
+        self.histogram[bucket_index(seconds * 1000)] += 1
+
+    def add(self, other):
+        self.count += other.count
+        for status_field in STATUS_FIELDS.values():
+            setattr(self, status_field, getattr(self, status_field) + getattr(other, status_field))
+        self.total_time += other.total_time
+        merge_histograms(self.histogram, other.histogram)
+
+    def as_dict(self):
+        errors = self.status_4xx + self.status_5xx
+        data = {
+            'count': self.count,
+            'status_2xx': self.status_2xx,
+            'status_3xx': self.status_3xx,
+            'status_4xx': self.status_4xx,
+            'status_5xx': self.status_5xx,
+            'error_rate': errors / self.count if self.count else 0.0,
+            'avg_ms': self.total_time * 1000 / self.count if self.count else None,
+        }
+        for q in PERCENTILES:
+            value = percentile(self.histogram, q)
+            data[f'p{q}_ms'] = round(value, 2) if value is not None else None
+        return data
+
+
+STATUS_FIELDS = {2: 'status_2xx', 3: 'status_3xx', 4: 'status_4xx', 5: 'status_5xx'}
+COUNTER_FIELDS = ['count', *STATUS_FIELDS.values(), 'total_time', 'histogram']
+
+
+def fold_logs(minutes, rows):
+    """
+    Add request logs to a ``{(integration_id, endpoint, method, minute): UsageStats}`` dict
+
+    ``rows`` are dicts of APIIntegrationLog field values (integration_id,
+    endpoint, method, request_time, response_status and response_time).
+    """
+    for row in rows:
+        key = (row['integration_id'], normalize_endpoint(row['endpoint']), row['method'],
+               minute_bucket(row['request_time']))
+        minutes[key].add_request(row['response_status'], row.get('response_time') or 0.0)
+    return minutes
+
+
+def save_usage(minutes):
+    """Add folded usage to the stored per-minute rows; returns the number of rows touched"""
+    if not minutes:
+        return 0
+    try:
+        _save_minutes(minutes)
+    except IntegrityError:
+        # Another process created one of the rows first; it is there now
+        _save_minutes(minutes)
+    return len(minutes)
+
+
+def record_logs(rows):
+    """Fold request logs into the stored per-minute usage rows"""
+    return save_usage(fold_logs(defaultdict(UsageStats), rows))
+
+
+def _save_minutes(minutes):
+    with transaction.atomic():
+        # Locked so that concurrent writers add to the counters instead of overwriting them
+        existing = {
+            (usage.integration_id, usage.endpoint, usage.method, usage.minute): usage
+            for usage in APIUsageMinute.objects.select_for_update().filter(
+                integration_id__in={key[0] for key in minutes},
+                minute__in={key[3] for key in minutes},
+            )
+        }
+        to_create, to_update = [], []
+        for key, stats in minutes.items():
+            usage = existing.get(key)
+            if usage is None:
+                integration_id, endpoint, method, minute = key
+                usage = APIUsageMinute(integration_id=integration_id, endpoint=endpoint, method=method, minute=minute)
+                usage.histogram = [0] * BUCKET_COUNT
+                to_create.append(usage)
+            else:
+                to_update.append(usage)
+            for name in COUNTER_FIELDS[:-1]:
+                setattr(usage, name, getattr(usage, name) + getattr(stats, name))
+            usage.histogram = merge_histograms(list(usage.histogram), stats.histogram)
+        APIUsageMinute.objects.bulk_create(to_create, batch_size=500)
+        APIUsageMinute.objects.bulk_update(to_update, COUNTER_FIELDS, batch_size=500)
+
+
+def rebuild_usage(since, until=None, chunk_size=5000):
+    """
+    Recompute the usage rows of [since, until) from the request logs
+
+    Both bounds are rounded down to the minute (``until`` defaults to the
+    end of the current minute); returns the number of logs read.
+    """
+    since = minute_bucket(since)
+    until = minute_bucket(until) if until else minute_bucket(timezone.now()) + timedelta(minutes=1)
+    logs = APIIntegrationLog.objects.filter(request_time__gte=since, request_time__lt=until)
+    columns = ('integration_id', 'endpoint', 'method', 'request_time', 'response_status', 'response_time')
+    with transaction.atomic():
+        APIUsageMinute.objects.filter(minute__gte=since, minute__lt=until).delete()
+        processed = 0
+        batch = []
+        for values in logs.values_list(*columns).iterator(chunk_size=chunk_size):
+            batch.append(dict(zip(columns, values)))
+            if len(batch) >= chunk_size:
+                processed += len(batch)
+                record_logs(batch)
+                batch = []
+        processed += len(batch)
+        record_logs(batch)
+    return processed
+
+
+def usage_queryset(since, until=None, integration=None, endpoint=None, method=None):
+    queryset = APIUsageMinute.objects.filter(minute__gte=minute_bucket(since))
+    if until is not None:
+        queryset = queryset.filter(minute__lt=until)
+    if integration is not None:
+        queryset = queryset.filter(integration_id=integration)
+    if endpoint:
+        queryset = queryset.filter(endpoint=normalize_endpoint(endpoint))
+    if method:
+        queryset = queryset.filter(method=method.upper())
+    return queryset
+
+
+def _stats(usage):
+    return UsageStats(**{name: getattr(usage, name) for name in COUNTER_FIELDS})
+
+
+def usage_summary(since, until=None, integration=None, endpoint=None, method=None):
+    """
+    Return the usage of each integration/endpoint/method in the window,
+    slowest p95 first
+    """
+    totals = defaultdict(UsageStats)
+    names = {}
+    queryset = usage_queryset(since, until, integration, endpoint, method).select_related('integration')
+    for usage in queryset.iterator(chunk_size=2000):
+        totals[(usage.integration_id, usage.endpoint, usage.method)].add(_stats(usage))
+        names[usage.integration_id] = usage.integration.name
+    summary = [
+        {
+            'integration_id': str(integration_id),
+            'integration': names[integration_id],
+            'endpoint': endpoint,
+            'method': method,
+            **stats.as_dict(),
+        }
+        for (integration_id, endpoint, method), stats in totals.items()
+    ]
+    summary.sort(key=lambda row: (-(row['p95_ms'] or 0), -row['count']))
+    return summary
+
+
+def usage_series(since, until=None, integration=None, endpoint=None, method=None):
+    """Return the per-minute usage in the window, oldest first"""
+    minutes = defaultdict(UsageStats)
+    for usage in usage_queryset(since, until, integration, endpoint, method).iterator(chunk_size=2000):
+        minutes[usage.minute].add(_stats(usage))
+    return [{'minute': minute, **minutes[minute].as_dict()} for minute in sorted(minutes)]
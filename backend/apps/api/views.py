@@ -1,16 +1,36 @@
 """
 Unified API views for the headless CMS
 """
+import uuid
+from datetime import timedelta
+
 from rest_framework import generics, permissions, filters, status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from apps.usermanagement.models import Role
-from apps.contentmanagement.models import Content, Marker, Challenge, ChallengeProgress, ContentCategory, MediaLibrary
-from apps.analyticsmanagement.models import PageView, ContentInteraction, UserActivity
+from apps.contentmanagement.models import (
+    Content, Marker, Challenge, ChallengeProgress, ChallengeType, ContentCategory, MediaLibrary
+)
+from apps.contentmanagement.geo import markers_within, nearest_markers
+from apps.contentmanagement.counters import ViewCountingMixin
+from apps.contentmanagement.geofence import GeofenceTracker
+from apps.contentmanagement.leaderboard import leaderboard, window_board
+from apps.contentmanagement.marker_index import load_markers, marker_index
+from apps.contentmanagement import progress as progress_service
+from . import exports, usage
+from .idempotency import idempotent
 from .models import APIIntegration, APIIntegrationLog
+from .pagination import KeysetPagination, RequestTimeKeysetPagination
+from .query_plans import QueryPlanMixin
+from .stats import system_stats_cache
 from .serializers import (
     UserSerializer, 
     RoleSerializer, 
@@ -20,20 +40,34 @@ from .serializers import (
     DetailedUserSerializer,
     RoleDetailedSerializer,
     MarkerSerializer,
+    NearbyMarkerSerializer,
     ChallengeSerializer,
     ChallengeProgressSerializer,
     ContentCategorySerializer,
     APIIntegrationSerializer,
     APIIntegrationLogSerializer,
     MobileMediaContentSerializer,
-    CreateMobileMediaContentSerializer
+    CreateMobileMediaContentSerializer,
+    LocationPingSerializer,
+    ProgressEventSerializer,
+    ProgressSyncSerializer
 )
 
 User = get_user_model()
 
 
+def users_with_content_count():
+    return User.objects.select_related('role').annotate(
+        content_count=Count('contents', filter=Q(contents__deleted_at__isnull=True))
+    )
+
+
+def roles_with_user_count():
+    return Role.objects.annotate(user_count=Count('users', filter=Q(users__deleted_at__isnull=True)))
+
+
 class UserListView(generics.ListCreateAPIView):
-    queryset = User.objects.all()
+    queryset = users_with_content_count()
     serializer_class = DetailedUserSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -44,13 +78,13 @@ class UserListView(generics.ListCreateAPIView):
 
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = User.objects.all()
+    queryset = users_with_content_count()
     serializer_class = DetailedUserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
 class RoleListView(generics.ListCreateAPIView):
-    queryset = Role.objects.all()
+    queryset = roles_with_user_count()
     serializer_class = RoleDetailedSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
@@ -60,14 +94,16 @@ class RoleListView(generics.ListCreateAPIView):
 
 
 class RoleDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Role.objects.all()
+    queryset = roles_with_user_count()
     serializer_class = RoleDetailedSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
-class ContentListView(generics.ListCreateAPIView):
+class ContentListView(QueryPlanMixin, generics.ListCreateAPIView):
     queryset = Content.objects.all()
     serializer_class = DetailedContentSerializer
+    select_related = ('author__role',)
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['status', 'author', 'created_at']
@@ -80,9 +116,10 @@ class ContentListView(generics.ListCreateAPIView):
         serializer.save(author=self.request.user)
 
 
-class ContentDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ContentDetailView(ViewCountingMixin, QueryPlanMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Content.objects.all()
     serializer_class = DetailedContentSerializer
+    select_related = ('author__role',)
     permission_classes = [permissions.IsAuthenticated]
 
 
@@ -93,6 +130,7 @@ class MarkerListView(generics.ListAPIView):
     """
     queryset = Marker.objects.all()
     serializer_class = MarkerSerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]  # Allow read-only for mobile app
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['content_type']
@@ -133,32 +171,34 @@ class ChallengeDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class UserChallengeProgressListView(generics.ListCreateAPIView):
+class UserChallengeProgressListView(QueryPlanMixin, generics.ListCreateAPIView):
     """
     List or create challenge progress for the current user
     """
+    queryset = ChallengeProgress.objects.all()
     serializer_class = ChallengeProgressSerializer
+    select_related = ('challenge',)
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        return ChallengeProgress.objects.filter(user=user)
+        return super().get_queryset().filter(user=self.request.user)
 
     def perform_create(self, serializer):
         # Ensure the progress is saved for the current user
         serializer.save(user=self.request.user)
 
 
-class UserChallengeProgressDetailView(generics.RetrieveUpdateAPIView):
+class UserChallengeProgressDetailView(QueryPlanMixin, generics.RetrieveUpdateAPIView):
     """
     Get or update specific challenge progress for the current user
     """
+    queryset = ChallengeProgress.objects.all()
     serializer_class = ChallengeProgressSerializer
+    select_related = ('challenge',)
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        return ChallengeProgress.objects.filter(user=user)
+        return super().get_queryset().filter(user=self.request.user)
 
 
 class ContentCategoryListView(generics.ListAPIView):
@@ -204,6 +244,7 @@ class APIIntegrationLogListView(generics.ListAPIView):
     """
     queryset = APIIntegrationLog.objects.all()
     serializer_class = APIIntegrationLogSerializer
+    pagination_class = RequestTimeKeysetPagination
     permission_classes = [permissions.IsAdminUser]  # Only admins can view logs
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['integration', 'response_status', 'method']
@@ -213,11 +254,13 @@ class APIIntegrationLogListView(generics.ListAPIView):
 
 
 # Mobile Media Content specific views
-class MobileMediaContentViewSet(generics.ListCreateAPIView):
+class MobileMediaContentViewSet(QueryPlanMixin, generics.ListCreateAPIView):
     """
     API view for mobile media content - GET and POST for media files
     """
     queryset = MediaLibrary.objects.all()
+    select_related = ('uploader',)
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get_serializer_class(self):
@@ -227,7 +270,7 @@ class MobileMediaContentViewSet(generics.ListCreateAPIView):
     
     def get_queryset(self):
         # Allow filtering by media type for mobile app
-        queryset = MediaLibrary.objects.all()
+        queryset = super().get_queryset()
         media_type = self.request.query_params.get('media_type', None)
         
         if media_type:
@@ -247,11 +290,12 @@ class MobileMediaContentViewSet(generics.ListCreateAPIView):
         serializer.save(uploader=self.request.user)
 
 
-class MobileMediaContentDetailView(generics.RetrieveUpdateDestroyAPIView):
+class MobileMediaContentDetailView(QueryPlanMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a specific mobile media content
     """
     queryset = MediaLibrary.objects.all()
+    select_related = ('uploader',)
     serializer_class = MobileMediaContentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -262,27 +306,11 @@ class MobileMediaContentDetailView(generics.RetrieveUpdateDestroyAPIView):
 def system_stats(request):
     """
     Get overall system statistics
+
+    Served from a cached snapshot that is recomputed whenever content, users
+    or roles change (see stats.py).
     """
-    stats = {
-        'total_users': User.objects.count(),
-        'total_content': Content.objects.count(),
-        'total_roles': Role.objects.count(),
-        'total_page_views': PageView.objects.count(),
-        'content_by_status': {
-            'draft': Content.objects.filter(status='draft').count(),
-            'review': Content.objects.filter(status='review').count(),
-            'published': Content.objects.filter(status='published').count(),
-            'archived': Content.objects.filter(status='archived').count(),
-        },
-        'users_by_role': [
-            {
-                'role': role.name,
-                'count': role.users.count()
-            }
-            for role in Role.objects.all()
-        ]
-    }
-    return Response(stats)
+    return Response(system_stats_cache.get())
 
 
 # API endpoint to get user's content
@@ -298,49 +326,282 @@ def user_content(request):
 
 
 # Mobile AR Tour specific endpoints
+class NearbyMarkerPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
+
+
+class NearestMarkerPagination(NearbyMarkerPagination):
+    """
+    Limit/offset pagination of the k nearest markers, without a count
+
+    Only the markers up to the end of the page plus one are ranked, so the
+    total is unknown; the extra marker tells whether there is a next page.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        markers = list(queryset[:self.offset + self.limit + 1])
+        self.has_next = len(markers) > self.offset + self.limit
+        return markers[self.offset:self.offset + self.limit]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticatedOrReadOnly])  # Allow read-only for mobile app
 def nearby_markers(request):
     """
-    Get markers near the current user's location
-    Expects latitude and longitude as query parameters
+    Get markers near the current user's location, nearest first
+    Expects latitude and longitude as query parameters. With a radius (in
+    metres) every marker within it is returned; without one, the nearest
+    markers are. Results are paginated with limit and offset; nearest-marker
+    pages have no count, only next and previous links.
     """
-    latitude = request.query_params.get('latitude', None)
-    longitude = request.query_params.get('longitude', None)
-    
-    if latitude is None or longitude is None:
-        # If no location provided, return all markers
-        markers = Marker.objects.all()
+    try:
+        latitude = float(request.query_params['latitude'])
+        longitude = float(request.query_params['longitude'])
+        radius = request.query_params.get('radius')
+        radius = float(radius) if radius else None
+    except (KeyError, ValueError):
+        return Response(
+            {'error': 'latitude and longitude are required and must be numbers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or (radius is not None and radius <= 0):
+        return Response({'error': 'Invalid location or radius'}, status=status.HTTP_400_BAD_REQUEST)
+
+    paginator = NearbyMarkerPagination() if radius is not None else NearestMarkerPagination()
+    if settings.MARKER_INDEX_ENABLED:
+        # Rank (id, distance) pairs in memory and only load the requested page
+        if radius is not None:
+            ranked = marker_index.within(latitude, longitude, min(radius, settings.MARKER_SEARCH_MAX_RADIUS))
+        else:
+            k = paginator.get_offset(request) + paginator.get_limit(request) + 1
+            ranked = marker_index.nearest(latitude, longitude, k, max_radius=settings.MARKER_SEARCH_MAX_RADIUS)
+        page = load_markers(paginator.paginate_queryset(ranked, request))
     else:
-        # In a real implementation, we would filter by proximity
-        # This is a simplified version for the headless CMS
-        markers = Marker.objects.all()
-    
-    serializer = MarkerSerializer(markers, many=True)
-    return Response(serializer.data)
+        if radius is not None:
+            markers = markers_within(latitude, longitude, min(radius, settings.MARKER_SEARCH_MAX_RADIUS))
+        else:
+            # One extra marker tells the paginator whether there is a next page
+            k = paginator.get_offset(request) + paginator.get_limit(request) + 1
+            markers = nearest_markers(latitude, longitude, k)
+        page = paginator.paginate_queryset(markers, request)
+
+    serializer = NearbyMarkerSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+def location_ping(request):
+    """
+    Report the markers and challenges that came into range since the last ping
+    Expects the positions recorded since the previous ping. Markers within
+    GEOFENCE_RADIUS of any of them are in range; only those that were not in
+    range at the previous ping are returned, together with the challenges
+    attached to them that the user has not completed yet. Markers that left
+    range are returned as ids.
+    """
+    serializer = LocationPingSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    positions = [(position['latitude'], position['longitude']) for position in serializer.validated_data['positions']]
+
+    entered, exited = GeofenceTracker(request.user.pk).ping(positions, reset=serializer.validated_data['reset'])
+    markers = load_markers(entered)
+    marker_ids = [marker.id for marker in markers]
+    completed = ChallengeProgress.objects.filter(
+        user=request.user, completed_at__isnull=False
+    ).values('challenge_id')
+    challenges = Challenge.objects.filter(
+        Q(marker_id__in=marker_ids) | Q(markers__in=marker_ids), deleted_at__isnull=True
+    ).exclude(pk__in=completed).distinct()
+
+    return Response({
+        'markers': NearbyMarkerSerializer(markers, many=True).data,
+        'challenges': ChallengeSerializer(challenges, many=True).data,
+        'exited_markers': sorted(str(marker_id) for marker_id in exited),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def leaderboard_view(request):
+    """
+    Get a challenge leaderboard and the current user's rank on it
+    ``board`` is ``global`` (default), ``daily``, ``weekly`` or a challenge
+    type; daily and weekly cover the current day and ISO week.
+    """
+    board = request.query_params.get('board', 'global')
+    if board in ('daily', 'weekly'):
+        board = window_board(board)
+    elif board in ChallengeType.values:
+        board = f'type:{board}'
+    elif board != 'global':
+        return Response({'error': 'Unknown leaderboard'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), 100)
+        offset = int(request.query_params.get('offset', 0))
+    except ValueError:
+        return Response({'error': 'limit and offset must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1 or offset < 0:
+        return Response({'error': 'Invalid limit or offset'}, status=status.HTTP_400_BAD_REQUEST)
+
+    entries = leaderboard.top(board, limit=limit, offset=offset)
+    usernames = dict(User.objects.filter(pk__in=[user_id for user_id, _ in entries]).values_list('pk', 'username'))
+    usernames = {str(pk): username for pk, username in usernames.items()}
+    user_rank = leaderboard.rank(board, request.user.pk)
+    return Response({
+        'board': board,
+        'count': leaderboard.count(board),
+        'results': [
+            {'rank': offset + position + 1, 'user': user_id, 'username': usernames.get(user_id), 'score': score}
+            for position, (user_id, score) in enumerate(entries)
+        ],
+        'me': {'rank': user_rank[0], 'score': user_rank[1]} if user_rank else None,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@idempotent
 def complete_challenge(request, challenge_id):
     """
     Mark a challenge as completed by the current user
+    Completing an already completed challenge returns the existing progress.
+    Send an Idempotency-Key header to have retries replay the first response.
     """
-    try:
-        challenge = Challenge.objects.get(pk=challenge_id)
-    except Challenge.DoesNotExist:
+    result = progress_service.complete_challenge(request.user, challenge_id)
+    if result is None:
         return Response({'error': 'Challenge not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    progress, created = ChallengeProgress.objects.get_or_create(
-        user=request.user,
-        challenge=challenge,
-        defaults={'score': challenge.points, 'completed_at': timezone.now()}
-    )
-    
-    if not created and not progress.completed_at:
-        progress.score = challenge.points
-        progress.completed_at = timezone.now()
-        progress.save()
-    
+
+    progress, _ = result
     serializer = ChallengeProgressSerializer(progress)
-    return Response(serializer.data)
\ No newline at end of file
+    return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@idempotent
+def sync_challenge_progress(request):
+    """
+    Apply a batch of challenge progress events queued by an offline client
+    Every event gets a result in the same order: its status (created,
+    updated, unchanged, duplicate or invalid) and the progress id, or the
+    validation errors of an invalid event.
+    """
+    serializer = ProgressSyncSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    events = []
+    invalid = []
+    for index, data in enumerate(serializer.validated_data['events']):
+        event_serializer = ProgressEventSerializer(data=data)
+        if event_serializer.is_valid():
+            event = event_serializer.validated_data
+            events.append(progress_service.ProgressEvent(
+                index=index,
+                challenge_id=event['challenge'],
+                occurred_at=event['occurred_at'],
+                score=event.get('score'),
+                completed=event['completed'],
+                event_id=event.get('id'),
+            ))
+        else:
+            invalid.append(progress_service.ProgressEvent(
+                index=index, challenge_id=data.get('challenge'), occurred_at=None,
+                event_id=data.get('id'), status='invalid', errors=event_serializer.errors,
+            ))
+
+    progress_service.sync_progress(request.user, events)
+    results = []
+    for event in sorted(events + invalid, key=lambda event: event.index):
+        result = {'index': event.index, 'id': event.event_id, 'status': event.status}
+        if event.progress_id is not None:
+            result['progress'] = event.progress_id
+        if event.errors:
+            result['errors'] = event.errors
+        results.append(result)
+    return Response({'results': results})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def export_dataset(request, dataset, file_format):
+    """
+    Stream an export of analytics events or API logs as CSV or NDJSON
+
+    Query parameters: ``since``/``until`` (ISO date or datetime, ``until``
+    exclusive), ``integration`` (API logs only) and ``gzip=1``.
+    """
+    params = request.query_params
+    compress = params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    try:
+        chunks = exports.stream_export(
+            dataset,
+            file_format,
+            since=exports.parse_bound(params.get('since')),
+            until=exports.parse_bound(params.get('until'), end=True),
+            integration=params.get('integration') or None,
+            compress=compress,
+        )
+    except exports.ExportError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    filename = f"{dataset}-{timezone.now():%Y%m%dT%H%M%S}.{file_format}{'.gz' if compress else ''}"
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else exports.FORMATS[file_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def api_usage(request):
+    """
+    Latency percentiles and error rates per integration, endpoint and method
+
+    Query parameters: ``since``/``until`` (ISO date or datetime, default the
+    last 24 hours), ``integration``, ``endpoint`` and ``method``. With an
+    ``endpoint`` the response also has its per-minute ``series``.
+    """
+    params = request.query_params
+    try:
+        until = exports.parse_bound(params.get('until'), end=True)
+        since = exports.parse_bound(params.get('since')) or (until or timezone.now()) - timedelta(hours=24)
+    except exports.ExportError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    integration = params.get('integration') or None
+    if integration is not None:
+        try:
+            integration = uuid.UUID(integration)
+        except ValueError:
+            return Response({'error': f'Invalid integration id: {integration}'}, status=status.HTTP_400_BAD_REQUEST)
+    usage_filters = {
+        'integration': integration,
+        'endpoint': params.get('endpoint') or None,
+        'method': params.get('method') or None,
+    }
+    data = {
+        'since': since,
+        'until': until,
+        'results': usage.usage_summary(since, until, **usage_filters),
+    }
+    if usage_filters['endpoint']:
+        data['series'] = usage.usage_series(since, until, **usage_filters)
+    return Response(data)
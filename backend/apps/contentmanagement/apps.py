@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ContentmanagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.contentmanagement'
+
+    def ready(self):
+        import apps.contentmanagement.signals  # noqa: F401
@@ -0,0 +1,159 @@
+"""
+Write-behind view counter for ContentAnalytics
+
+Counting a view with ``save()`` on the analytics row would serialise every
+request for popular content on that row's lock. Instead views are counted in
+process memory, split over VIEW_COUNTER_SHARDS independently locked shards so
+concurrent requests rarely wait on each other, and a daemon thread applies
+the accumulated deltas every VIEW_COUNTER_FLUSH_INTERVAL milliseconds with one
+``UPDATE ... SET view_count = view_count + CASE ... END`` statement per batch
+of rows. Increments are relative, so any number of worker processes can
+flush concurrently. Deltas that fail to flush are put back, and everything
+still pending is flushed when the process exits. Setting VIEW_COUNTER_ASYNC
+to False flushes every view inline, which is what the tests use.
+
+API views over Content count their retrieves with ``ViewCountingMixin``.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import ContentAnalytics
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Sharded in-memory view counts drained by a background thread
+    """
+
+    def __init__(self, shards=None, flush_interval=None, batch_size=None):
+        shards = shards or getattr(settings, 'VIEW_COUNTER_SHARDS', 16)
+        # Milliseconds between flushes
+        self.flush_interval = flush_interval or getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 5000)
+        self.batch_size = batch_size or getattr(settings, 'VIEW_COUNTER_BATCH_SIZE', 500)
+        # Each shard maps an analytics id to [pending views, last viewed at]
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def increment(self, analytics_id, count=1, viewed_at=None):
+        """Count views of the content with the given ContentAnalytics id"""
+        viewed_at = viewed_at or timezone.now()
+        counts, lock = self._shards[hash(analytics_id) % len(self._shards)]
+        with lock:
+            entry = counts.get(analytics_id)
+            if entry is None:
+                counts[analytics_id] = [count, viewed_at]
+            else:
+                entry[0] += count
+                entry[1] = max(entry[1], viewed_at)
+        if getattr(settings, 'VIEW_COUNTER_ASYNC', True):
+            self._ensure_started()
+        else:
+            self.flush()
+
+    def pending(self):
+        """Return {analytics id: pending views}"""
+        pending = {}
+        for counts, lock in self._shards:
+            with lock:
+                pending.update((analytics_id, entry[0]) for analytics_id, entry in counts.items())
+        return pending
+
+    def flush(self):
+        """Apply all pending deltas to the database and return the number of views written"""
+        with self._flush_lock:
+            deltas = self._drain()
+            written = 0
+            items = list(deltas.items())
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    logger.exception('Failed to flush view counts for %d content items', len(batch))
+                    self._restore(batch)
+                    continue
+                written += sum(count for count, _ in dict(batch).values())
+        return written
+
+    def stop(self, timeout=5):
+        """Stop the background thread and flush everything still pending"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # Flushes on the caller's connection, which is the caller's to close
+        self.flush()
+
+    def _drain(self):
+        deltas = {}
+        for counts, lock in self._shards:
+            with lock:
+                deltas.update(counts)
+                counts.clear()
+        return deltas
+
+    def _restore(self, batch):
+        for analytics_id, (count, viewed_at) in batch:
+            counts, lock = self._shards[hash(analytics_id) % len(self._shards)]
+            with lock:
+                entry = counts.setdefault(analytics_id, [0, viewed_at])
+                entry[0] += count
+                entry[1] = max(entry[1], viewed_at)
+
+    def _write_batch(self, batch):
+        view_counts = []
+        last_viewed = []
+        for analytics_id, (count, viewed_at) in batch:
+            view_counts.append(When(pk=analytics_id, then=Value(count)))
+            last_viewed.append(When(pk=analytics_id, then=Value(viewed_at)))
+        latest = Case(*last_viewed)
+        ContentAnalytics.objects.filter(pk__in=[analytics_id for analytics_id, _ in batch]).update(
+            view_count=F('view_count') + Case(*view_counts, default=Value(0)),
+            # GREATEST ignores NULL on PostgreSQL but not elsewhere
+            last_viewed_at=Coalesce(Greatest(F('last_viewed_at'), latest), latest),
+        )
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        interval = self.flush_interval / 1000
+        while not self._stop.wait(interval):
+            self.flush()
+            close_old_connections()
+
+
+view_counter = ViewCounter()
+
+
+class ViewCountingMixin:
+    """
+    Count every retrieve of a Content object in view_counter, which writes
+    it to ContentAnalytics in batches
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        view_counter.increment(instance.analytics_id)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
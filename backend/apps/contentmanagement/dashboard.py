@@ -0,0 +1,307 @@
+"""
+Precomputed snapshot of the CMS dashboard
+
+The dashboard (views.custom_dashboard) is rendered from one document kept in
+the shared cache: content counts by status and category, the user total,
+content created per author and day over the last 30 days, the latest
+content and user activities and daily page views. Rendering it needs no
+queries.
+
+The document is updated incrementally as things change (see signals.py):
+saving or deleting content moves its contribution from its old status,
+category and author to the new ones, new users and activities are added.
+Updates are applied after the transaction commits, under a short lock so
+that workers do not overwrite each other's changes. Writes that bypass
+signals (bulk operations, raw SQL) and page views, which are read from the
+analytics rollups, are picked up by the full recomputation, which the
+``refresh_dashboard_snapshot`` command runs on a schedule. A snapshot older
+than CONTENT_DASHBOARD_MAX_AGE seconds is also recomputed when read.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.analyticsmanagement.models import UserActivity
+from apps.analyticsmanagement.rollups import get_daily_counts
+from .models import Content, ContentCategory, ContentStatus
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = 30
+RECENT_ACTIVITIES = 10
+RECENT_CONTENT = 5
+TOP_AUTHORS = 5
+PENDING_REVIEW_STATUSES = (ContentStatus.PENDING_REVIEW, ContentStatus.REVIEWED)
+
+
+# Contribution of a content row loaded without the fields it depends on
+UNKNOWN = 'unknown'
+CONTRIBUTION_FIELDS = {'status', 'category_id', 'author_id', 'created_at', 'deleted_at'}
+
+
+def content_contribution(content):
+    """
+    Return (status, category_id, author_id, created day) a content row counts
+    for, None if it does not count, or UNKNOWN if those fields were deferred
+    """
+    if CONTRIBUTION_FIELDS & content.get_deferred_fields():
+        return UNKNOWN
+    if content.deleted_at is not None or content.created_at is None:
+        return None
+    return content.status, content.category_id, content.author_id, timezone.localdate(content.created_at).isoformat()
+
+
+def display_name(user):
+    full_name = f'{user.first_name} {user.last_name}'.strip()
+    return full_name or user.username
+
+
+def activity_entry(activity, user):
+    return {'id': activity.pk, 'user_name': display_name(user), 'action': activity.action,
+            'timestamp': activity.timestamp}
+
+
+def content_entry(content):
+    return {'id': str(content.pk), 'title': content.title, 'status': content.status,
+            'created_at': content.created_at}
+
+
+def adjust(counts, key, delta):
+    count = counts.get(key, 0) + delta
+    if count > 0:
+        counts[key] = count
+    else:
+        counts.pop(key, None)
+
+
+class DashboardSnapshot:
+    """
+    Dashboard aggregates kept in one cached document
+    """
+    LOCK_TIMEOUT = 5
+    LOCK_WAIT = 1
+
+    def __init__(self, key='content_dashboard_snapshot'):
+        self.key = key
+
+    @property
+    def lock_key(self):
+        return f'{self.key}:lock'
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'CONTENT_DASHBOARD_MAX_AGE', 3600)
+
+    def get(self):
+        """Return the snapshot document, recomputing it if it is missing or too old"""
+        document = cache.get(self.key)
+        if document is None or time.time() - document['computed_at'] >= self.max_age:
+            document = self.rebuild()
+        return document
+
+    def rebuild(self):
+        """Recompute the whole document from the database"""
+        with self._locked() as locked:
+            document = self.compute()
+            if locked:
+                cache.set(self.key, document, None)
+            return document
+
+    def invalidate(self):
+        cache.delete(self.key)
+
+    def context(self, now=None):
+        """Template context of the dashboard"""
+        document = self.get()
+        since = timezone.localdate(now or timezone.now()) - timedelta(days=WINDOW_DAYS)
+        since = since.isoformat()
+
+        statuses = document['statuses']
+        total = sum(statuses.values())
+        authors = {}
+        for day, counts in document['created_by_day'].items():
+            if day >= since:
+                for author_id, count in counts.items():
+                    authors[author_id] = authors.get(author_id, 0) + count
+        top_authors = sorted(authors.items(), key=lambda item: -item[1])[:TOP_AUTHORS]
+        return {
+            'total_content_count': total,
+            'total_users_count': document['users'],
+            'pending_reviews_count': sum(statuses.get(status, 0) for status in PENDING_REVIEW_STATUSES),
+            'page_views_count': sum(count for day, count in document['page_views_by_day'].items() if day >= since),
+            'content_status_list': [
+                {'status': status, 'count': statuses[status], 'percentage': round(statuses[status] / total * 100, 2)}
+                for status in ContentStatus.values if statuses.get(status)
+            ],
+            'recent_activities': document['activities'],
+            'recently_created_content': [
+                entry for entry in document['recent_content']
+                if timezone.localdate(entry['created_at']).isoformat() >= since
+            ],
+            'content_by_category': [
+                {'category__name': document['category_names'].get(category_id), 'count': count}
+                for category_id, count in sorted(document['categories'].items(), key=lambda item: -item[1])
+            ],
+            'recent_content_by_author': [
+                {**document['authors'][author_id], 'count': count} for author_id, count in top_authors
+            ],
+        }
+
+    def compute(self):
+        now = timezone.now()
+        since = now - timedelta(days=WINDOW_DAYS)
+        statuses, categories, category_names = {}, {}, {}
+        rows = Content.objects.filter(deleted_at__isnull=True).values(
+            'status', 'category_id', 'category__name'
+        ).annotate(count=Count('id')).order_by()
+        for row in rows:
+            adjust(statuses, row['status'], row['count'])
+            adjust(categories, row['category_id'], row['count'])
+            if row['category_id'] is not None:
+                category_names[row['category_id']] = row['category__name']
+
+        created_by_day, authors = {}, {}
+        rows = Content.objects.filter(deleted_at__isnull=True, created_at__gte=since).annotate(
+            day=TruncDate('created_at')
+        ).values(
+            'day', 'author_id', 'author__username', 'author__first_name', 'author__last_name'
+        ).annotate(count=Count('id')).order_by()
+        for row in rows:
+            author_id = str(row['author_id'])
+            adjust(created_by_day.setdefault(row['day'].isoformat(), {}), author_id, row['count'])
+            authors[author_id] = {
+                'author__username': row['author__username'],
+                'author__first_name': row['author__first_name'],
+                'author__last_name': row['author__last_name'],
+            }
+
+        recent_content = [
+            {**row, 'id': str(row['id'])} for row in Content.objects.filter(deleted_at__isnull=True).order_by(
+                '-created_at'
+            ).values('id', 'title', 'status', 'created_at')[:RECENT_CONTENT]
+        ]
+        activities = [
+            activity_entry(activity, activity.user)
+            for activity in UserActivity.objects.select_related('user').order_by('-timestamp')[:RECENT_ACTIVITIES]
+        ]
+        return {
+            'computed_at': time.time(),
+            'statuses': statuses,
+            'categories': categories,
+            'category_names': category_names,
+            'users': get_user_model().objects.count(),
+            'created_by_day': created_by_day,
+            'authors': authors,
+            'recent_content': recent_content,
+            'activities': activities,
+            'page_views_by_day': {
+                day.isoformat(): count for day, count in get_daily_counts('page_views', days=WINDOW_DAYS, now=now)
+            },
+        }
+
+    # Incremental updates, called once the change is committed
+
+    def content_changed(self, content_id, content, old, new):
+        """
+        Move a content row's contribution from ``old`` to ``new`` (either may
+        be None); the id is passed separately as a deleted row has none
+        """
+        if UNKNOWN in (old, new):
+            # What to retract is not known
+            self.invalidate()
+            return
+        category_name = author = None
+        if new is not None:
+            _, category_id, author_id, _ = new
+            if category_id is not None:
+                category = content.category if Content.category.is_cached(content) else None
+                category_name = category.name if category is not None else (
+                    ContentCategory.objects.filter(pk=category_id).values_list('name', flat=True).first()
+                )
+            user = content.author if Content.author.is_cached(content) else (
+                get_user_model().objects.only('username', 'first_name', 'last_name').get(pk=author_id)
+            )
+            author = {
+                'author__username': user.username,
+                'author__first_name': user.first_name,
+                'author__last_name': user.last_name,
+            }
+
+        def update(document):
+            for contribution, sign in ((old, -1), (new, 1)):
+                if contribution is None:
+                    continue
+                status, category_id, author_id, day = contribution
+                adjust(document['statuses'], status, sign)
+                adjust(document['categories'], category_id, sign)
+                adjust(document['created_by_day'].setdefault(day, {}), str(author_id), sign)
+            if new is not None:
+                if new[1] is not None:
+                    document['category_names'][new[1]] = category_name
+                document['authors'][str(new[2])] = author
+            recent = [entry for entry in document['recent_content'] if entry['id'] != str(content_id)]
+            if new is not None:
+                recent.append(content_entry(content))
+            recent.sort(key=lambda entry: entry['created_at'], reverse=True)
+            document['recent_content'] = recent[:RECENT_CONTENT]
+        self._apply(update)
+
+    def users_changed(self, delta):
+        def update(document):
+            document['users'] += delta
+        self._apply(update)
+
+    def activity_added(self, activity):
+        user = activity.user if UserActivity.user.is_cached(activity) else (
+            get_user_model().objects.only('username', 'first_name', 'last_name').get(pk=activity.user_id)
+        )
+        entry = activity_entry(activity, user)
+
+        def update(document):
+            activities = [entry, *document['activities']]
+            activities.sort(key=lambda item: item['timestamp'], reverse=True)
+            document['activities'] = activities[:RECENT_ACTIVITIES]
+        self._apply(update)
+
+    def activity_removed(self, activity_id):
+        def update(document):
+            document['activities'] = [item for item in document['activities'] if item['id'] != activity_id]
+        self._apply(update)
+
+    def _apply(self, update):
+        with self._locked() as locked:
+            if not locked:
+                # Better to recompute than to lose an update
+                self.invalidate()
+                return
+            document = cache.get(self.key)
+            if document is None:
+                # Computed in full on the next read
+                return
+            update(document)
+            cache.set(self.key, document, None)
+
+    @contextmanager
+    def _locked(self):
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while not cache.add(self.lock_key, True, self.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                logger.warning('Timed out waiting for the %s lock', self.key)
+                yield False
+                return
+            time.sleep(0.01)
+        try:
+            yield True
+        finally:
+            cache.delete(self.lock_key)
+
+
+dashboard_snapshot = DashboardSnapshot()
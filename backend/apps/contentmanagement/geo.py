@@ -0,0 +1,154 @@
+"""
+Proximity search over AR markers without PostGIS
+
+Every marker stores a geohash of its coordinates (Marker.geohash, indexed).
+A radius query picks the geohash precision whose cells are at least as large
+as the radius, so the circle is covered by the centre cell and its eight
+neighbours. Those nine prefixes plus a latitude/longitude bounding box narrow
+the candidates in the database; the candidates are then ranked by exact
+haversine distance.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import Q
+
+EARTH_RADIUS_M = 6371008.8
+GEOHASH_PRECISION = 9
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = bits * 2 + 1
+                lon_range[0] = mid
+            else:
+                bits = bits * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = bits * 2 + 1
+                lat_range[0] = mid
+            else:
+                bits = bits * 2
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Return (height, width) in degrees of a geohash cell of the given precision"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in metres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius metres"""
+    lat_delta = math.degrees(radius / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-9 or abs(latitude) + lat_delta >= 90:
+        lon_delta = 180.0
+    else:
+        lon_delta = min(180.0, math.degrees(radius / (EARTH_RADIUS_M * cos_lat)))
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def covering_prefixes(latitude, longitude, radius):
+    """
+    Return geohash prefixes whose cells cover the circle, or an empty set if
+    the circle is larger than the coarsest cells
+    """
+    metres_per_degree = math.pi * EARTH_RADIUS_M / 180
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-9)
+    precision = 0
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        height, width = geohash_cell_size(candidate)
+        if height * metres_per_degree < radius or width * metres_per_degree * cos_lat < radius:
+            break
+        precision = candidate
+    if precision == 0:
+        return set()
+
+    height, width = geohash_cell_size(precision)
+    prefixes = set()
+    for lat_step in (-1, 0, 1):
+        for lon_step in (-1, 0, 1):
+            lat = min(max(latitude + lat_step * height, -90.0), 90.0)
+            lon = (longitude + lon_step * width + 180.0) % 360.0 - 180.0
+            prefixes.add(encode_geohash(lat, lon, precision))
+    return prefixes
+
+
+def markers_within(latitude, longitude, radius, queryset=None):
+    """
+    Return markers within radius metres ranked by distance, nearest first
+
+    Each marker gets a ``distance`` attribute in metres.
+    """
+    from .models import Marker
+
+    queryset = Marker.objects.filter(deleted_at__isnull=True) if queryset is None else queryset
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+    queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+    if max_lon - min_lon < 360:
+        if min_lon < -180 or max_lon > 180:
+            # The box crosses the antimeridian
+            queryset = queryset.filter(
+                Q(longitude__gte=(min_lon + 540) % 360 - 180) | Q(longitude__lte=(max_lon + 540) % 360 - 180)
+            )
+        else:
+            queryset = queryset.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+
+    prefixes = covering_prefixes(latitude, longitude, radius)
+    if prefixes:
+        prefix_filter = Q()
+        for prefix in prefixes:
+            prefix_filter |= Q(geohash__startswith=prefix)
+        queryset = queryset.filter(prefix_filter)
+
+    ranked = []
+    for marker in queryset:
+        marker.distance = haversine(latitude, longitude, marker.latitude, marker.longitude)
+        if marker.distance <= radius:
+            ranked.append(marker)
+    ranked.sort(key=lambda marker: marker.distance)
+    return ranked
+
+
+def nearest_markers(latitude, longitude, k, max_radius=None, queryset=None):
+    """
+    Return the k markers nearest to a coordinate, searching outwards in
+    growing radii up to max_radius metres
+    """
+    max_radius = max_radius or getattr(settings, 'MARKER_SEARCH_MAX_RADIUS', 50000)
+    radius = min(getattr(settings, 'MARKER_SEARCH_DEFAULT_RADIUS', 1000), max_radius)
+    while True:
+        ranked = markers_within(latitude, longitude, radius, queryset)
+        if len(ranked) >= k or radius >= max_radius:
+            return ranked[:k]
+        radius = min(radius * 4, max_radius)
@@ -0,0 +1,71 @@
+"""
+Geofence tracking of which AR markers a user is in range of
+
+A location ping carries one or more recent positions. Every live marker
+within GEOFENCE_RADIUS metres of any of them is "in range". The ids that
+were in range at the previous ping are kept per user in the cache, so each
+ping only reports markers that entered or left range since then.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .geo import markers_within
+from .marker_index import marker_index
+
+STATE_CACHE_KEY_PREFIX = 'geofence_state_'
+
+
+def markers_in_range(positions, radius):
+    """
+    Return {marker id: distance} for markers within radius metres of any
+    (latitude, longitude) position, keeping each marker's smallest distance
+    """
+    in_range = {}
+    for latitude, longitude in positions:
+        if settings.MARKER_INDEX_ENABLED:
+            found = marker_index.within(latitude, longitude, radius)
+        else:
+            found = [(marker.id, marker.distance) for marker in markers_within(latitude, longitude, radius)]
+        for marker_id, distance in found:
+            if distance < in_range.get(marker_id, float('inf')):
+                in_range[marker_id] = distance
+    return in_range
+
+
+class GeofenceTracker:
+    """
+    Per-user diff of in-range markers between consecutive pings
+    """
+
+    def __init__(self, user_id):
+        self.cache_key = f'{STATE_CACHE_KEY_PREFIX}{user_id}'
+
+    @property
+    def radius(self):
+        return getattr(settings, 'GEOFENCE_RADIUS', 100)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'GEOFENCE_STATE_TIMEOUT', 3600)
+
+    def ping(self, positions, reset=False):
+        """
+        Record a ping and return (entered, exited)
+
+        ``entered`` is a list of (marker id, distance) pairs, nearest first, of
+        markers that were not in range at the last ping; ``exited`` is the set
+        of marker ids that were and no longer are. With ``reset`` the previous
+        state is ignored, so every marker in range counts as entered.
+        """
+        in_range = markers_in_range(positions, self.radius)
+        previous = set() if reset else cache.get(self.cache_key, set())
+        cache.set(self.cache_key, set(in_range), timeout=self.timeout)
+
+        entered = sorted(
+            ((marker_id, distance) for marker_id, distance in in_range.items() if marker_id not in previous),
+            key=lambda pair: pair[1],
+        )
+        return entered, previous - set(in_range)
+
+    def clear(self):
+        cache.delete(self.cache_key)
@@ -0,0 +1,320 @@
+"""
+Materialized challenge leaderboards
+
+A user's score on a board is the sum of ChallengeProgress.score over their
+completed, non-deleted progress rows. Boards:
+
+* ``global`` - all completed challenges
+* ``type:<challenge type>`` - challenges of one ChallengeType
+* ``daily:<YYYY-MM-DD>`` / ``weekly:<YYYY-Www>`` - challenges completed in
+  that day / ISO week (local time)
+
+Boards are kept as sorted sets and updated incrementally whenever a progress
+row changes (see signals.py), so ranking a user is O(log n) instead of an
+aggregate over the whole table. On a Redis cache they are Redis sorted sets
+shared by all workers; otherwise each process keeps its own sorted lists,
+loading each board from the table the first time it is used (so boards
+survive restarts), which is only suitable for single-process deployments and
+tests. The ``rebuild_leaderboard`` command recomputes the boards from the
+table.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.redis_client import get_redis_client
+
+KEY_PREFIX = 'leaderboard'
+WINDOW_TIMEOUTS = {'daily': 2 * 86400, 'weekly': 15 * 86400}
+
+
+def window_board(window, when=None):
+    """Return the board name of the daily or weekly window containing ``when``"""
+    day = timezone.localdate(when) if when is not None else timezone.localdate()
+    if window == 'daily':
+        return f'daily:{day.isoformat()}'
+    year, week, _ = day.isocalendar()
+    return f'weekly:{year}-W{week:02d}'
+
+
+def boards_for(challenge_type, completed_at):
+    """Return the names of every board a completion counts towards"""
+    return [
+        'global',
+        f'type:{challenge_type}',
+        window_board('daily', completed_at),
+        window_board('weekly', completed_at),
+    ]
+
+
+def board_timeout(board):
+    return WINDOW_TIMEOUTS.get(board.split(':', 1)[0])
+
+
+def window_range(board):
+    """Return the (start, end) datetimes of a daily or weekly board's window"""
+    window, _, value = board.partition(':')
+    if window == 'daily':
+        first_day, days = date.fromisoformat(value), 1
+    else:
+        year, week = value.split('-W')
+        first_day, days = date.fromisocalendar(int(year), int(week), 1), 7
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    return start, timezone.make_aware(datetime.combine(first_day + timedelta(days=days), time.min))
+
+
+class LocalStore:
+    """
+    Process-local sorted sets: a score map plus a list ordered by
+    (-score, member) for bisect rank lookups
+
+    With a loader, a board is filled with loader(board) the first time it is
+    read in the process. Updates to a board that has not been read are
+    skipped, since the loader will read the rows they come from.
+    """
+
+    def __init__(self, loader=None):
+        self._scores = defaultdict(dict)
+        self._order = defaultdict(list)
+        self._loaded = set()
+        self._loader = loader
+        self._lock = threading.Lock()
+
+    def _is_loaded(self, board):
+        return self._loader is None or board in self._loaded
+
+    def _load(self, board):
+        """Load a board that has not been read yet; call with the lock held"""
+        if not self._is_loaded(board):
+            self._set(board, self._loader(board))
+
+    def _set(self, board, scores):
+        self._scores[board] = {member: score for member, score in scores.items() if score > 0}
+        self._order[board] = sorted((-score, member) for member, score in self._scores[board].items())
+        self._loaded.add(board)
+
+    def incr(self, board, member, delta):
+        """
+        Add delta to a member's score
+
+        Finding the entry is O(log n), but moving it within the list is
+        O(n): fine for the boards of a single-process deployment, which is
+        why multi-process deployments use Redis sorted sets.
+        """
+        with self._lock:
+            if not self._is_loaded(board):
+                return None
+            scores, order = self._scores[board], self._order[board]
+            old = scores.get(member)
+            if old is not None:
+                del order[bisect_left(order, (-old, member))]
+            new = (old or 0) + delta
+            if new > 0:
+                scores[member] = new
+                insort(order, (-new, member))
+            else:
+                scores.pop(member, None)
+            return new
+
+    def score(self, board, member):
+        with self._lock:
+            self._load(board)
+            return self._scores[board].get(member)
+
+    def rank(self, board, member):
+        with self._lock:
+            self._load(board)
+            score = self._scores[board].get(member)
+            if score is None:
+                return None
+            return bisect_left(self._order[board], (-score, member))
+
+    def top(self, board, start, stop):
+        with self._lock:
+            self._load(board)
+            return [(member, -score) for score, member in self._order[board][start:stop]]
+
+    def count(self, board):
+        with self._lock:
+            self._load(board)
+            return len(self._scores[board])
+
+    def replace(self, board, scores, timeout=None):
+        with self._lock:
+            self._set(board, scores)
+
+    def clear(self):
+        """Forget every board; with a loader they are loaded again when next used"""
+        with self._lock:
+            self._scores.clear()
+            self._order.clear()
+            self._loaded.clear()
+
+
+class RedisStore:
+    """
+    Boards stored as Redis sorted sets
+    """
+
+    def __init__(self, client, cache_backend):
+        self.client = client
+        self.cache = cache_backend
+
+    def key(self, board):
+        return self.cache.make_and_validate_key(f'{KEY_PREFIX}:{board}')
+
+    def incr(self, board, member, delta):
+        key = self.key(board)
+        pipe = self.client.pipeline()
+        pipe.zincrby(key, delta, member)
+        pipe.zremrangebyscore(key, '-inf', 0)
+        timeout = board_timeout(board)
+        if timeout:
+            pipe.expire(key, timeout)
+        return pipe.execute()[0]
+
+    def score(self, board, member):
+        return self.client.zscore(self.key(board), member)
+
+    def rank(self, board, member):
+        return self.client.zrevrank(self.key(board), member)
+
+    def top(self, board, start, stop):
+        entries = self.client.zrevrange(self.key(board), start, stop - 1, withscores=True)
+        return [(member.decode() if isinstance(member, bytes) else member, score) for member, score in entries]
+
+    def count(self, board):
+        return self.client.zcard(self.key(board))
+
+    def replace(self, board, scores, timeout=None):
+        key = self.key(board)
+        scores = {member: score for member, score in scores.items() if score > 0}
+        if not scores:
+            self.client.delete(key)
+            return
+        # Build the new board aside and swap it in atomically
+        staging = f'{key}:rebuild'
+        pipe = self.client.pipeline()
+        pipe.delete(staging)
+        pipe.zadd(staging, scores)
+        pipe.rename(staging, key)
+        if timeout:
+            pipe.expire(key, timeout)
+        pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.key('*')):
+            self.client.delete(key)
+
+
+class Leaderboard:
+    """
+    Incrementally maintained leaderboards over ChallengeProgress
+    """
+
+    def __init__(self):
+        self._local_store = LocalStore(loader=self.board_scores)
+
+    @property
+    def store(self):
+        client = get_redis_client(cache)
+        if client is not None:
+            return RedisStore(client, cache)
+        return self._local_store
+
+    def record(self, user_id, points, challenge_type, completed_at):
+        """Add points (negative to retract them) for one completion to all of its boards"""
+        if not points:
+            return
+        store = self.store
+        for board in boards_for(challenge_type, completed_at):
+            store.incr(board, str(user_id), points)
+
+    def rank(self, board, user_id):
+        """Return (1-based rank, score) of a user on a board, or None if they have no score"""
+        store = self.store
+        position = store.rank(board, str(user_id))
+        if position is None:
+            return None
+        return position + 1, store.score(board, str(user_id))
+
+    def top(self, board, limit=10, offset=0):
+        """Return [(user id, score)] ordered by score, highest first"""
+        return self.store.top(board, offset, offset + limit)
+
+    def count(self, board):
+        return self.store.count(board)
+
+    def board_scores(self, board):
+        """Compute one board's {user id: score} from ChallengeProgress"""
+        from .models import ChallengeProgress
+
+        completed = ChallengeProgress.objects.filter(completed_at__isnull=False, deleted_at__isnull=True)
+        kind, _, value = board.partition(':')
+        if kind == 'type':
+            completed = completed.filter(challenge__type=value)
+        elif kind in WINDOW_TIMEOUTS:
+            start, end = window_range(board)
+            completed = completed.filter(completed_at__gte=start, completed_at__lt=end)
+        rows = completed.values('user_id').annotate(total=Sum('score')).values_list('user_id', 'total')
+        return {str(user_id): total for user_id, total in rows}
+
+    def rebuild(self, days=None):
+        """
+        Recompute boards from ChallengeProgress and replace the stored ones
+
+        Rebuilds the global and per-type boards plus the daily and weekly
+        windows of the last ``days`` days (LEADERBOARD_REBUILD_DAYS by
+        default). Returns {board: number of users whose score changed}.
+        """
+        from .models import ChallengeProgress, ChallengeType
+
+        days = days if days is not None else getattr(settings, 'LEADERBOARD_REBUILD_DAYS', 8)
+        now = timezone.now()
+        # Start at the beginning of the oldest week so every window is complete
+        first_day = timezone.localdate(now) - timedelta(days=days)
+        first_day -= timedelta(days=first_day.weekday())
+        since = timezone.make_aware(datetime.combine(first_day, time.min))
+        completed = ChallengeProgress.objects.filter(
+            completed_at__isnull=False, deleted_at__isnull=True
+        )
+
+        # Every board in scope is replaced, including ones that end up empty
+        expected = defaultdict(dict)
+        expected['global'] = {}
+        for challenge_type in ChallengeType.values:
+            expected[f'type:{challenge_type}'] = {}
+        for day in range(days + 1):
+            for window in ('daily', 'weekly'):
+                expected[window_board(window, now - timedelta(days=day))] = {}
+        for row in completed.values('user_id').annotate(total=Sum('score')):
+            expected['global'][str(row['user_id'])] = row['total']
+        for row in completed.values('user_id', 'challenge__type').annotate(total=Sum('score')):
+            expected[f"type:{row['challenge__type']}"][str(row['user_id'])] = row['total']
+        for user_id, score, completed_at in completed.filter(completed_at__gte=since).values_list(
+            'user_id', 'score', 'completed_at'
+        ).iterator(chunk_size=2000):
+            for window in ('daily', 'weekly'):
+                board = window_board(window, completed_at)
+                expected[board][str(user_id)] = expected[board].get(str(user_id), 0) + score
+
+        store = self.store
+        changed = {}
+        for board, scores in expected.items():
+            current = dict(store.top(board, 0, max(store.count(board), 1)))
+            members = set(current) | {member for member, score in scores.items() if score > 0}
+            changed[board] = sum(1 for member in members if current.get(member, 0) != scores.get(member, 0))
+            store.replace(board, scores, timeout=board_timeout(board))
+        return changed
+
+    def clear(self):
+        self.store.clear()
+
+
+leaderboard = Leaderboard()
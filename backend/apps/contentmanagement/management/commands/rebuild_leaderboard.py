@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from apps.contentmanagement.leaderboard import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the challenge leaderboards from ChallengeProgress and report drifted entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='How many days of daily/weekly windows to rebuild (default: LEADERBOARD_REBUILD_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        changed = leaderboard.rebuild(days=options['days'])
+        for board, count in sorted(changed.items()):
+            if count:
+                self.stdout.write(self.style.WARNING(f'{board}: corrected {count} entries'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(changed)} boards, {sum(changed.values())} entries corrected'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.contentmanagement.dashboard import dashboard_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recompute the CMS dashboard snapshot from the database (run on a schedule, e.g. every 15 minutes)'
+
+    def handle(self, *args, **options):
+        document = dashboard_snapshot.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Dashboard snapshot refreshed: {sum(document['statuses'].values())} content items, "
+            f"{document['users']} users"
+        ))
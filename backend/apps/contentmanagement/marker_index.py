@@ -0,0 +1,140 @@
+"""
+In-memory, NumPy-backed coordinate table of AR markers
+
+Each worker keeps the id, latitude and longitude of every live marker in
+NumPy arrays so that distances to all of them are computed in one vectorised
+pass. Nearest-marker queries select the top k with argpartition instead of
+sorting everything. The table is rebuilt lazily after a Marker is saved or
+deleted: the signal handlers bump a version number in the shared cache and
+every worker reloads when it sees a version it has not loaded yet.
+
+The same index backs nearby_markers and geofence checks (``within``).
+"""
+import threading
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+
+from .geo import EARTH_RADIUS_M
+
+VERSION_CACHE_KEY = 'marker_index_version'
+
+
+def haversine_many(latitude, longitude, lat_rad, lon_rad, cos_lat=None):
+    """Vectorised haversine distance in metres from one point to arrays of points in radians"""
+    lat0 = np.radians(latitude)
+    lon0 = np.radians(longitude)
+    cos_lat = np.cos(lat_rad) if cos_lat is None else cos_lat
+    a = np.sin((lat_rad - lat0) / 2) ** 2 + np.cos(lat0) * cos_lat * np.sin((lon_rad - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class MarkerIndex:
+    """
+    Coordinate table answering nearest and within-radius queries
+    """
+
+    def __init__(self, static=False):
+        self._lock = threading.Lock()
+        self._version = None
+        # Static indexes are built from arrays and never reload
+        self._static = static
+        self._table = self._build_table([], [], [])
+
+    @classmethod
+    def from_arrays(cls, ids, latitudes, longitudes):
+        """Build a standalone index, e.g. for benchmarks"""
+        index = cls(static=True)
+        index._table = cls._build_table(ids, latitudes, longitudes)
+        return index
+
+    def __len__(self):
+        return len(self._snapshot()[0])
+
+    def nearest(self, latitude, longitude, k, max_radius=None):
+        """Return up to k (marker id, distance) pairs, nearest first"""
+        ids, distances = self._distances(latitude, longitude)
+        candidates = np.arange(len(distances))
+        if max_radius is not None:
+            candidates = np.flatnonzero(distances <= max_radius)
+        if k < len(candidates):
+            top = np.argpartition(distances[candidates], k - 1)[:k]
+            candidates = candidates[top]
+        order = candidates[np.argsort(distances[candidates], kind='stable')]
+        return [(ids[i], float(distances[i])) for i in order]
+
+    def within(self, latitude, longitude, radius):
+        """Return (marker id, distance) pairs within radius metres, nearest first"""
+        ids, distances = self._distances(latitude, longitude)
+        inside = np.flatnonzero(distances <= radius)
+        order = inside[np.argsort(distances[inside], kind='stable')]
+        return [(ids[i], float(distances[i])) for i in order]
+
+    def invalidate(self):
+        """Make every worker reload the table on its next query"""
+        cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        self._version = None
+
+    def _distances(self, latitude, longitude):
+        ids, lat_rad, lon_rad, cos_lat = self._snapshot()
+        return ids, haversine_many(latitude, longitude, lat_rad, lon_rad, cos_lat)
+
+    def _snapshot(self):
+        """Return the current table, reloading it first if a marker changed"""
+        if self._static:
+            return self._table
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None or version != self._version:
+            with self._lock:
+                if version is None:
+                    version = uuid.uuid4().hex
+                    if not cache.add(VERSION_CACHE_KEY, version, timeout=None):
+                        version = cache.get(VERSION_CACHE_KEY)
+                if version != self._version:
+                    self._table = self._load()
+                    self._version = version
+        return self._table
+
+    @classmethod
+    def _load(cls):
+        from .models import Marker
+
+        rows = list(
+            Marker.objects.filter(
+                deleted_at__isnull=True, latitude__isnull=False, longitude__isnull=False
+            ).values_list('id', 'latitude', 'longitude')
+        )
+        ids, latitudes, longitudes = zip(*rows) if rows else ([], [], [])
+        return cls._build_table(ids, latitudes, longitudes)
+
+    @staticmethod
+    def _build_table(ids, latitudes, longitudes):
+        ids_array = np.empty(len(ids), dtype=object)
+        ids_array[:] = list(ids)
+        lat_rad = np.radians(np.asarray(latitudes, dtype=np.float64))
+        lon_rad = np.radians(np.asarray(longitudes, dtype=np.float64))
+        return ids_array, lat_rad, lon_rad, np.cos(lat_rad)
+
+
+def load_markers(pairs, queryset=None):
+    """
+    Fetch the markers for (marker id, distance) pairs, keeping their order
+
+    Each marker gets a ``distance`` attribute in metres. Markers deleted since
+    the index was loaded are skipped.
+    """
+    from .models import Marker
+
+    queryset = Marker.objects.all() if queryset is None else queryset
+    markers = queryset.in_bulk([marker_id for marker_id, _ in pairs])
+    ranked = []
+    for marker_id, distance in pairs:
+        marker = markers.get(marker_id)
+        if marker is not None and marker.deleted_at is None:
+            marker.distance = distance
+            ranked.append(marker)
+    return ranked
+
+
+marker_index = MarkerIndex()
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+BATCH_SIZE = 1000
+
+
+def encode_geohash(latitude, longitude, precision=9):
+    # Frozen copy of apps.contentmanagement.geo.encode_geohash as of this migration
+    ranges = {True: [-180.0, 180.0], False: [-90.0, 90.0]}
+    values = {True: float(longitude), False: float(latitude)}
+    chars, bits, even = [], 0, True
+    while len(chars) < precision:
+        for _ in range(5):
+            low, high = ranges[even]
+            mid = (low + high) / 2
+            above = values[even] >= mid
+            bits = bits * 2 + above
+            ranges[even][0 if above else 1] = mid
+            even = not even
+        chars.append(BASE32[bits])
+        bits = 0
+    return ''.join(chars)
+
+
+def populate_geohash(apps, schema_editor):
+    Marker = apps.get_model('contentmanagement', 'Marker')
+    markers = Marker.objects.filter(latitude__isnull=False, longitude__isnull=False).only('latitude', 'longitude')
+    batch = []
+    for marker in markers.iterator(chunk_size=BATCH_SIZE):
+        marker.geohash = encode_geohash(marker.latitude, marker.longitude)
+        batch.append(marker)
+        if len(batch) == BATCH_SIZE:
+            Marker.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Marker.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentmanagement', '0005_musicpage_videopage_delete_contentpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marker',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentmanagement', '0006_marker_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='content',
+            index=models.Index(fields=['created_at', 'id'], name='content_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='medialibrary',
+            index=models.Index(fields=['created_at', 'id'], name='media_library_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='marker',
+            index=models.Index(fields=['created_at', 'id'], name='marker_created_id'),
+        ),
+    ]
@@ -9,6 +9,7 @@ from wagtail.fields import RichTextField
 from wagtail.admin.panels import FieldPanel
 from wagtail.images import get_image_model
 from wagtail.documents import get_document_model
+from .geo import encode_geohash
 
 
 class BaseEntity(models.Model):
@@ -113,6 +114,8 @@ class Content(BaseEntity):
 
     class Meta:
         db_table = 'content'
+        # Keyset of the API list (apps/api/pagination.py)
+        indexes = [models.Index(fields=['created_at', 'id'], name='content_created_id')]
 
 
 class ApprovalStatus(models.TextChoices):
@@ -149,6 +152,8 @@ class MediaLibrary(BaseEntity):
 
     class Meta:
         db_table = 'media_library'
+        # Keyset of the API list (apps/api/pagination.py)
+        indexes = [models.Index(fields=['created_at', 'id'], name='media_library_created_id')]
         verbose_name_plural = "Media library"
 
     def __str__(self):
@@ -199,11 +204,26 @@ class Marker(BaseEntity):
     # Simplified location representation without GIS
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Geohash of latitude/longitude used to prefilter proximity searches (see geo.py)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     content_url = models.TextField()
     challenge = models.ForeignKey(Challenge, on_delete=models.SET_NULL, null=True, blank=True, related_name='markers')
 
+    def save(self, *args, **kwargs):
+        """Keep the geohash in sync with the coordinates"""
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'marker'
+        # Keyset of the API list (apps/api/pagination.py)
+        indexes = [models.Index(fields=['created_at', 'id'], name='marker_created_id')]
 
 
 # Add the foreign key from Challenge to Marker after both models are defined
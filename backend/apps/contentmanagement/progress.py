@@ -0,0 +1,232 @@
+"""
+Race-free challenge completion
+
+Completing a challenge is one ``INSERT ... SELECT ... ON CONFLICT DO UPDATE
+... RETURNING`` statement: the challenge's points are read, the progress row
+is created or completed, and the resulting row is returned, with the
+challenge's type for the leaderboards, in a single round trip. Concurrent
+completions of the same (user, challenge) pair are resolved by the unique
+constraint inside the database instead of racing between a SELECT and an
+INSERT, and completing an already completed challenge leaves the row
+untouched.
+
+Offline clients sync queued progress events in bulk with ``sync_progress``,
+which applies a whole batch in one transaction with a fixed number of
+queries.
+"""
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .leaderboard import leaderboard
+from .models import Challenge, ChallengeProgress
+from .signals import leaderboard_contribution
+
+UPSERT_SQL = """
+    INSERT INTO {progress} (id, user_id, challenge_id, score, completed_at, created_at, updated_at, deleted_at)
+    SELECT %s, %s, {challenge}.id, {challenge}.points, %s, %s, %s, NULL
+    FROM {challenge}
+    WHERE {challenge}.id = %s
+    ON CONFLICT (user_id, challenge_id) DO UPDATE SET
+        score = CASE WHEN {progress}.completed_at IS NULL THEN excluded.score ELSE {progress}.score END,
+        updated_at = CASE WHEN {progress}.completed_at IS NULL THEN excluded.updated_at ELSE {progress}.updated_at END,
+        completed_at = COALESCE({progress}.completed_at, excluded.completed_at)
+    RETURNING {columns},
+        (SELECT {challenge}.type FROM {challenge} WHERE {challenge}.id = {progress}.challenge_id) AS challenge_type
+"""
+
+# Backends that support INSERT ... ON CONFLICT ... RETURNING
+UPSERT_VENDORS = ('postgresql', 'sqlite')
+
+
+def complete_challenge(user, challenge_id, now=None):
+    """
+    Mark a challenge as completed by a user
+
+    Returns ``(progress, completed)`` where ``completed`` is True if this
+    call completed the challenge, or None if the challenge does not exist.
+    """
+    now = now or timezone.now()
+    if connection.vendor not in UPSERT_VENDORS:
+        progress = _get_or_create(user, challenge_id, now)
+        return None if progress is None else (progress, progress.completed_at == now)
+
+    progress = _upsert(user, challenge_id, now)
+    if progress is None:
+        return None
+    completed = progress.completed_at == now
+    if completed and progress.deleted_at is None:
+        # The upsert bypasses the model signals that maintain the leaderboards
+        transaction.on_commit(lambda: leaderboard.record(user.pk, progress.score, progress.challenge_type, now))
+    return progress, completed
+
+
+def _upsert(user, challenge_id, now):
+    meta = ChallengeProgress._meta
+    fields = [meta.get_field(name) for name in (
+        'id', 'user', 'challenge', 'score', 'completed_at', 'created_at', 'updated_at', 'deleted_at'
+    )]
+    quote = connection.ops.quote_name
+    sql = UPSERT_SQL.format(
+        progress=quote(meta.db_table),
+        challenge=quote(Challenge._meta.db_table),
+        columns=', '.join(quote(field.column) for field in fields),
+    )
+    timestamp = meta.get_field('completed_at').get_db_prep_value(now, connection)
+    params = [
+        meta.pk.get_db_prep_value(uuid.uuid4(), connection),
+        meta.get_field('user').get_db_prep_value(user.pk, connection),
+        timestamp, timestamp, timestamp,
+        Challenge._meta.pk.get_db_prep_value(challenge_id, connection),
+    ]
+    # raw() applies the field converters to the returned row and sets the
+    # extra challenge_type column as an attribute
+    rows = list(ChallengeProgress.objects.raw(sql, params))
+    return rows[0] if rows else None
+
+
+def _get_or_create(user, challenge_id, now):
+    # Fallback for backends without ON CONFLICT ... RETURNING
+    try:
+        challenge = Challenge.objects.get(pk=challenge_id)
+    except Challenge.DoesNotExist:
+        return None
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                progress, created = ChallengeProgress.objects.select_for_update().get_or_create(
+                    user=user, challenge=challenge, defaults={'score': challenge.points, 'completed_at': now}
+                )
+                if not created and not progress.completed_at:
+                    progress.score = challenge.points
+                    progress.completed_at = now
+                    progress.updated_at = now
+                    progress.save()
+                return progress
+        except IntegrityError:
+            # A parallel request created the row first
+            continue
+    return ChallengeProgress.objects.get(user=user, challenge=challenge)
+
+
+@dataclass
+class ProgressEvent:
+    """
+    A progress event recorded by a client, possibly while offline
+    """
+    index: int
+    challenge_id: uuid.UUID
+    occurred_at: object
+    score: int = None
+    completed: bool = True
+    event_id: str = None
+    status: str = None
+    progress_id: object = None
+    errors: dict = field(default_factory=dict)
+
+
+def sync_progress(user, events, now=None):
+    """
+    Apply a batch of ProgressEvents for a user in one transaction
+
+    Events repeating an earlier ``event_id`` in the batch are dropped as
+    duplicates. The remaining events are merged per challenge in the order
+    they occurred: the latest score wins (capped at the challenge's points,
+    and defaulting to them for completions) and the first completion sets
+    ``completed_at``. Challenges that are already completed are left as
+    they are, like complete_challenge does. Each event's ``status`` is set
+    to ``created``, ``updated``, ``unchanged``, ``duplicate`` or ``invalid``.
+    """
+    now = now or timezone.now()
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _apply_events(user, events, now)
+            return events
+        except IntegrityError:
+            # A parallel sync created some of the rows first; the retry
+            # sees them as existing rows
+            if attempt:
+                raise
+
+
+def _apply_events(user, events, now):
+    seen_ids = set()
+    by_challenge = defaultdict(list)
+    for event in events:
+        if event.event_id is not None and event.event_id in seen_ids:
+            event.status = 'duplicate'
+            continue
+        seen_ids.add(event.event_id)
+        by_challenge[event.challenge_id].append(event)
+
+    challenges = Challenge.objects.in_bulk(list(by_challenge))
+    existing = {
+        progress.challenge_id: progress
+        for progress in ChallengeProgress.objects.select_for_update().filter(
+            user=user, challenge_id__in=list(challenges)
+        )
+    }
+
+    to_create, to_update = [], []
+    for challenge_id, challenge_events in by_challenge.items():
+        challenge = challenges.get(challenge_id)
+        if challenge is None:
+            for event in challenge_events:
+                event.status = 'invalid'
+                event.errors = {'challenge': ['Challenge not found']}
+            continue
+
+        progress = existing.get(challenge_id)
+        created = progress is None
+        if created:
+            progress = ChallengeProgress(
+                user=user, challenge=challenge, score=0, created_at=now, updated_at=now
+            )
+        else:
+            progress.challenge = challenge
+        before = (progress.score, progress.completed_at)
+
+        if progress.completed_at is None:
+            for event in sorted(challenge_events, key=lambda event: event.occurred_at):
+                score = event.score if event.score is not None else (challenge.points if event.completed else None)
+                if score is not None:
+                    progress.score = min(score, challenge.points)
+                if event.completed:
+                    progress.completed_at = min(event.occurred_at, now)
+                    break
+
+        if created:
+            to_create.append(progress)
+            status = 'created'
+        elif (progress.score, progress.completed_at) != before:
+            progress.updated_at = now
+            to_update.append(progress)
+            status = 'updated'
+        else:
+            status = 'unchanged'
+        for event in challenge_events:
+            event.status = status
+            event.progress_id = progress.pk
+
+    ChallengeProgress.objects.bulk_create(to_create)
+    ChallengeProgress.objects.bulk_update(to_update, ['score', 'completed_at', 'updated_at'])
+
+    # bulk_create/bulk_update bypass the model signals that maintain the leaderboards
+    written = [(progress, True) for progress in to_create] + [(progress, False) for progress in to_update]
+    for progress, created in written:
+        old = None if created else progress._leaderboard_contribution
+        new = leaderboard_contribution(progress)
+        if old == new:
+            continue
+        for contribution, sign in ((old, -1), (new, 1)):
+            if contribution is None:
+                continue
+            user_id, points, _, completed_at = contribution
+            transaction.on_commit(partial(
+                leaderboard.record, user_id, sign * points, progress.challenge.type, completed_at
+            ))
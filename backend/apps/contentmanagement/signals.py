@@ -0,0 +1,107 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from apps.analyticsmanagement.models import UserActivity
+from .dashboard import content_contribution, dashboard_snapshot
+from .leaderboard import leaderboard
+from .marker_index import marker_index
+from .models import Challenge, ChallengeProgress, Content, Marker
+
+
+@receiver(post_save, sender=Marker)
+def invalidate_marker_index_on_save(sender, instance, **kwargs):
+    # Wait for the commit so other workers cannot reload the old rows
+    transaction.on_commit(marker_index.invalidate)
+
+
+@receiver(post_delete, sender=Marker)
+def invalidate_marker_index_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(marker_index.invalidate)
+
+
+def leaderboard_contribution(progress):
+    """Return (user_id, points, challenge_id, completed_at) a progress row counts for, or None"""
+    if progress.completed_at is None or progress.deleted_at is not None or not progress.score:
+        return None
+    return progress.user_id, progress.score, progress.challenge_id, progress.completed_at
+
+
+def record_contribution(contribution, sign, progress):
+    user_id, points, challenge_id, completed_at = contribution
+    if progress.challenge_id == challenge_id and ChallengeProgress.challenge.is_cached(progress):
+        challenge_type = progress.challenge.type
+    else:
+        challenge_type = Challenge.objects.values_list('type', flat=True).get(pk=challenge_id)
+    transaction.on_commit(lambda: leaderboard.record(user_id, sign * points, challenge_type, completed_at))
+
+
+@receiver(post_init, sender=ChallengeProgress)
+def remember_leaderboard_contribution(sender, instance, **kwargs):
+    # Keep what the row counted for when it was loaded so a save can retract it
+    instance._leaderboard_contribution = leaderboard_contribution(instance)
+
+
+@receiver(post_save, sender=ChallengeProgress)
+def update_leaderboard_on_save(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_leaderboard_contribution', None)
+    new = leaderboard_contribution(instance)
+    if old == new:
+        return
+    if old is not None:
+        record_contribution(old, -1, instance)
+    if new is not None:
+        record_contribution(new, 1, instance)
+    instance._leaderboard_contribution = new
+
+
+@receiver(post_delete, sender=ChallengeProgress)
+def update_leaderboard_on_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_leaderboard_contribution', None)
+    if old is not None:
+        record_contribution(old, -1, instance)
+
+
+@receiver(post_init, sender=Content)
+def remember_dashboard_contribution(sender, instance, **kwargs):
+    instance._dashboard_contribution = content_contribution(instance)
+
+
+@receiver(post_save, sender=Content)
+def update_dashboard_on_content_save(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_dashboard_contribution', None)
+    new = content_contribution(instance)
+    instance._dashboard_contribution = new
+    transaction.on_commit(lambda: dashboard_snapshot.content_changed(instance.pk, instance, old, new))
+
+
+@receiver(post_delete, sender=Content)
+def update_dashboard_on_content_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_dashboard_contribution', None)
+    content_id = instance.pk
+    if old is not None:
+        transaction.on_commit(lambda: dashboard_snapshot.content_changed(content_id, instance, old, None))
+
+
+@receiver(post_save, sender=get_user_model())
+def update_dashboard_on_user_save(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: dashboard_snapshot.users_changed(1))
+
+
+@receiver(post_delete, sender=get_user_model())
+def update_dashboard_on_user_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: dashboard_snapshot.users_changed(-1))
+
+
+@receiver(post_save, sender=UserActivity)
+def update_dashboard_on_activity_save(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: dashboard_snapshot.activity_added(instance))
+
+
+@receiver(post_delete, sender=UserActivity)
+def update_dashboard_on_activity_delete(sender, instance, **kwargs):
+    activity_id = instance.pk
+    transaction.on_commit(lambda: dashboard_snapshot.activity_removed(activity_id))
+
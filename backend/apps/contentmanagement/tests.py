@@ -1,3 +1,492 @@
-from django.test import TestCase
+import random
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from apps.analyticsmanagement.models import UserActivity
+from apps.api.models import APIIntegration
+from apps.api.testing import QueryBudgetMixin, list_endpoints
+from apps.usermanagement.models import Role
+from .geo import encode_geohash, covering_prefixes, haversine, markers_within, nearest_markers
+from .counters import ViewCounter
+from .dashboard import dashboard_snapshot
+from .leaderboard import LocalStore, leaderboard, window_board
+from .marker_index import MarkerIndex, load_markers, marker_index
+from .models import (
+    Challenge, ChallengeProgress, ChatSession, Content, ContentAnalytics, ContentApproval, ContentCategory,
+    ContentMedia, Feedback, MediaLibrary, Marker,
+)
+from .views import custom_dashboard
 
-# Create your tests here.
+User = get_user_model()
+
+
+class GeoSearchTest(TestCase):
+    def setUp(self):
+        # Markers scattered around the Manila Science Centre
+        self.origin = (14.5869, 120.9762)
+        rng = random.Random(42)
+        self.markers = [
+            Marker.objects.create(
+                code=f'marker-{i}',
+                latitude=round(self.origin[0] + rng.uniform(-0.05, 0.05), 6),
+                longitude=round(self.origin[1] + rng.uniform(-0.05, 0.05), 6),
+                content_url=f'/content/{i}/',
+            )
+            for i in range(200)
+        ]
+
+    def brute_force(self, radius):
+        distances = [(haversine(*self.origin, m.latitude, m.longitude), m.code) for m in self.markers]
+        return [code for distance, code in sorted(distances) if distance <= radius]
+
+    def test_encode_geohash(self):
+        """Test geohash encoding against a known value"""
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_geohash_kept_in_sync(self):
+        """Test that saving a marker recomputes its geohash"""
+        marker = self.markers[0]
+        marker.latitude, marker.longitude = 57.64911, 10.40744
+        marker.save(update_fields=['latitude', 'longitude'])
+        marker.refresh_from_db()
+        self.assertEqual(marker.geohash, 'u4pruydqq')
+
+    def test_covering_prefixes(self):
+        """Test that the covering cells contain every point of the circle"""
+        prefixes = covering_prefixes(*self.origin, 500)
+        self.assertEqual(len(prefixes), 9)
+        self.assertTrue(encode_geohash(self.origin[0] + 0.004, self.origin[1] - 0.004).startswith(tuple(prefixes)))
+
+    def test_markers_within_radius(self):
+        """Test that radius queries match a brute-force scan"""
+        for radius in (300, 1500, 4000):
+            found = markers_within(*self.origin, radius)
+            self.assertEqual([m.code for m in found], self.brute_force(radius))
+            self.assertTrue(all(m.distance <= radius for m in found))
+
+    def test_nearest_markers(self):
+        """Test that k-nearest queries return the k closest markers"""
+        found = nearest_markers(*self.origin, 15)
+        self.assertEqual([m.code for m in found], self.brute_force(10 ** 6)[:15])
+
+    def test_soft_deleted_markers_are_excluded(self):
+        """Test that soft-deleted markers do not show up in searches"""
+        nearest = nearest_markers(*self.origin, 1)[0]
+        nearest.soft_delete()
+        self.assertNotEqual(nearest_markers(*self.origin, 1)[0].code, nearest.code)
+
+
+class MarkerIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.origin = (14.5869, 120.9762)
+        rng = random.Random(7)
+        self.markers = [
+            Marker.objects.create(
+                code=f'marker-{i}',
+                latitude=round(self.origin[0] + rng.uniform(-0.05, 0.05), 6),
+                longitude=round(self.origin[1] + rng.uniform(-0.05, 0.05), 6),
+                content_url=f'/content/{i}/',
+            )
+            for i in range(200)
+        ]
+
+    def brute_force(self, radius):
+        distances = [(haversine(*self.origin, m.latitude, m.longitude), m.id) for m in self.markers]
+        return [marker_id for distance, marker_id in sorted(distances) if distance <= radius]
+
+    def test_nearest_matches_brute_force(self):
+        """Test that argpartition top-k matches a full sort"""
+        found = marker_index.nearest(*self.origin, 25)
+        self.assertEqual([marker_id for marker_id, _ in found], self.brute_force(10 ** 6)[:25])
+        self.assertEqual([marker_id for marker_id, _ in marker_index.nearest(*self.origin, 500)], self.brute_force(10 ** 6))
+
+    def test_within_matches_brute_force(self):
+        """Test that radius queries match a brute-force scan and agree on distances"""
+        for radius in (300, 1500, 4000):
+            found = marker_index.within(*self.origin, radius)
+            self.assertEqual([marker_id for marker_id, _ in found], self.brute_force(radius))
+        marker = self.markers[0]
+        distance = dict(marker_index.within(*self.origin, 10 ** 6))[marker.id]
+        self.assertAlmostEqual(distance, haversine(*self.origin, marker.latitude, marker.longitude), places=3)
+
+    def test_reloaded_after_save_and_delete(self):
+        """Test that the index picks up saved and deleted markers after commit"""
+        self.assertEqual(len(marker_index), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Marker.objects.create(
+                code='marker-new', latitude=self.origin[0], longitude=self.origin[1], content_url='/content/new/'
+            )
+        self.assertEqual(marker_index.nearest(*self.origin, 1)[0][0], added.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            added.soft_delete()
+        self.assertEqual(len(marker_index), 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.markers[0].delete()
+        self.assertNotIn(self.markers[0].id, dict(marker_index.within(*self.origin, 10 ** 6)))
+
+    def test_load_markers_keeps_ranking(self):
+        """Test that markers are loaded in ranked order with their distance"""
+        ranked = marker_index.nearest(*self.origin, 5)
+        markers = load_markers(ranked)
+        self.assertEqual([(m.id, m.distance) for m in markers], ranked)
+
+    def test_from_arrays(self):
+        """Test a standalone index built from plain arrays"""
+        index = MarkerIndex.from_arrays(['a', 'b', 'c'], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0])
+        self.assertEqual(len(index), 3)
+        self.assertEqual([marker_id for marker_id, _ in index.nearest(0.0, 0.1, 2)], ['a', 'b'])
+        self.assertEqual(index.within(0.0, 0.0, 1), [('a', 0.0)])
+
+
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        leaderboard.clear()
+        role, _ = Role.objects.get_or_create(name='Player', description='Mobile app player')
+        self.users = [
+            User.objects.create_user(email=f'player{i}@example.com', username=f'player{i}', password='x', role=role)
+            for i in range(3)
+        ]
+        self.quiz = Challenge.objects.create(
+            title='Quiz', description='...', type='quiz', points=30, author=self.users[0]
+        )
+        self.hunt = Challenge.objects.create(
+            title='Hunt', description='...', type='scavenger_hunt', points=50, author=self.users[0]
+        )
+
+    def complete(self, user, challenge, completed_at=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ChallengeProgress.objects.create(
+                user=user, challenge=challenge, score=challenge.points,
+                completed_at=completed_at or timezone.now(),
+            )
+
+    def test_local_store_ranks(self):
+        """Test that the local sorted store keeps ranks in score order"""
+        store = LocalStore()
+        for member, delta in (('a', 5), ('b', 10), ('c', 7), ('a', 6), ('c', -7)):
+            store.incr('board', member, delta)
+        self.assertEqual(store.top('board', 0, 10), [('a', 11), ('b', 10)])
+        self.assertEqual(store.rank('board', 'b'), 1)
+        self.assertIsNone(store.rank('board', 'c'))
+
+    def test_incremental_updates(self):
+        """Test that completions, score changes and deletions update every board"""
+        self.complete(self.users[0], self.quiz)
+        self.complete(self.users[1], self.hunt)
+        progress = self.complete(self.users[1], self.quiz)
+
+        self.assertEqual(leaderboard.rank('global', self.users[1].pk), (1, 80))
+        self.assertEqual(leaderboard.rank('global', self.users[0].pk), (2, 30))
+        self.assertIsNone(leaderboard.rank('global', self.users[2].pk))
+        self.assertEqual(leaderboard.rank('type:quiz', self.users[1].pk)[1], 30)
+        self.assertEqual(leaderboard.rank(window_board('daily'), self.users[1].pk)[1], 80)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            progress = ChallengeProgress.objects.get(pk=progress.pk)
+            progress.score = 5
+            progress.save()
+        self.assertEqual(leaderboard.rank('global', self.users[1].pk), (1, 55))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            progress.delete()
+        self.assertEqual(leaderboard.rank('global', self.users[1].pk), (1, 50))
+        self.assertIsNone(leaderboard.rank('type:quiz', self.users[1].pk))
+
+    def test_windows(self):
+        """Test that old completions only count on their own window"""
+        self.complete(self.users[0], self.quiz, completed_at=timezone.now() - timedelta(days=14))
+        self.assertEqual(leaderboard.rank('global', self.users[0].pk)[1], 30)
+        self.assertIsNone(leaderboard.rank(window_board('weekly'), self.users[0].pk))
+
+    def test_boards_are_loaded_after_restart(self):
+        """Test that a process with no boards loads them from the table when they are first used"""
+        self.complete(self.users[0], self.quiz)
+        self.complete(self.users[1], self.hunt, completed_at=timezone.now() - timedelta(days=14))
+        # A restarted process starts without boards
+        leaderboard.clear()
+
+        # Completed before the board was read: counted once
+        self.complete(self.users[0], self.hunt)
+        self.assertEqual(leaderboard.top('global'), [(str(self.users[0].pk), 80), (str(self.users[1].pk), 50)])
+        self.assertEqual(leaderboard.rank('type:quiz', self.users[0].pk), (1, 30))
+        self.assertEqual(leaderboard.count(window_board('weekly')), 1)
+        self.assertEqual(
+            leaderboard.rank(window_board('weekly', timezone.now() - timedelta(days=14)), self.users[1].pk), (1, 50)
+        )
+        # Once loaded, boards are updated incrementally
+        self.complete(self.users[2], self.quiz)
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.rank('global', self.users[2].pk), (3, 30))
+
+    def test_rebuild_reconciles_drift(self):
+        """Test that a rebuild matches the table after the boards drifted"""
+        # Boards this process has read, so it updates them
+        leaderboard.count('global')
+        leaderboard.count(window_board('weekly'))
+        self.complete(self.users[0], self.quiz)
+        self.complete(self.users[1], self.hunt)
+        # Writes that bypass the signals, e.g. a raw UPDATE
+        ChallengeProgress.objects.filter(user=self.users[0]).update(score=100)
+        leaderboard.record(self.users[2].pk, 999, 'quiz', timezone.now())
+
+        changed = leaderboard.rebuild()
+        self.assertEqual(changed['global'], 2)
+        self.assertEqual(leaderboard.top('global'), [(str(self.users[0].pk), 100), (str(self.users[1].pk), 50)])
+        self.assertEqual(leaderboard.rank(window_board('weekly'), self.users[0].pk), (1, 100))
+        self.assertEqual(leaderboard.rebuild()['global'], 0)
+
+
+@override_settings(VIEW_COUNTER_ASYNC=True)
+class ViewCounterTest(TestCase):
+    def setUp(self):
+        self.analytics = [ContentAnalytics.objects.create() for _ in range(3)]
+        # Long interval so only explicit flushes write
+        self.counter = ViewCounter(shards=4, flush_interval=3600 * 1000)
+        self.addCleanup(self.counter.stop, timeout=1)
+
+    def test_concurrent_views_flush_in_one_update(self):
+        """Test that views from many threads are applied with a single UPDATE"""
+        def viewer():
+            for i in range(300):
+                self.counter.increment(self.analytics[i % 3].pk)
+
+        threads = [threading.Thread(target=viewer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(self.counter.pending().values()), 2400)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.counter.flush(), 2400)
+        for analytics in self.analytics:
+            analytics.refresh_from_db()
+            self.assertEqual(analytics.view_count, 800)
+            self.assertIsNotNone(analytics.last_viewed_at)
+        self.assertEqual(self.counter.pending(), {})
+
+    @override_settings(VIEW_COUNTER_ASYNC=False, API_LOG_ASYNC=False)
+    def test_content_retrieves_are_counted(self):
+        """Test that the API detail view and the content viewset both count a view"""
+        cache.clear()
+        role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        editor = User.objects.create_user(
+            email='editor@example.com', username='editor', password=None, role=role, is_staff=True
+        )
+        content = Content.objects.create(
+            title='Exhibit', body='...', excerpt='...', file_path='', content_type='image', author=editor,
+            analytics=self.analytics[0],
+        )
+        auth = f"Api-Key {APIIntegration.objects.create(name='Web').api_key}"
+        self.client.force_login(editor)
+        self.assertEqual(self.client.get(f'/api/content/{content.pk}/', HTTP_AUTHORIZATION=auth).status_code, 200)
+        self.assertEqual(self.client.get(f'/content/content/{content.pk}/').status_code, 200)
+        self.analytics[0].refresh_from_db()
+        self.assertEqual(self.analytics[0].view_count, 2)
+
+    def test_deltas_are_added_to_existing_counts(self):
+        """Test that flushes add to the stored count and keep the latest view time"""
+        viewed_at = timezone.now()
+        ContentAnalytics.objects.filter(pk=self.analytics[0].pk).update(view_count=10, last_viewed_at=viewed_at)
+        self.counter.increment(self.analytics[0].pk, viewed_at=viewed_at - timedelta(hours=1))
+        self.counter.flush()
+        self.analytics[0].refresh_from_db()
+        self.assertEqual((self.analytics[0].view_count, self.analytics[0].last_viewed_at), (11, viewed_at))
+
+    def test_failed_flush_keeps_counts(self):
+        """Test that deltas are put back when the UPDATE fails"""
+        self.counter.increment(self.analytics[0].pk, count=5)
+        with mock.patch.object(self.counter, '_write_batch', side_effect=RuntimeError), \
+                self.assertLogs('apps.contentmanagement.counters', 'ERROR'):
+            self.assertEqual(self.counter.flush(), 0)
+        self.counter.increment(self.analytics[0].pk)
+        self.assertEqual(self.counter.pending(), {self.analytics[0].pk: 6})
+
+    def test_stop_flushes_pending_views(self):
+        """Test that pending views are written when the process exits"""
+        self.counter.increment(self.analytics[1].pk, count=3)
+        self.counter.stop(timeout=1)
+        self.analytics[1].refresh_from_db()
+        self.assertEqual(self.analytics[1].view_count, 3)
+
+
+class DashboardSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        self.editor = User.objects.create_user(
+            email='editor@example.com', username='editor', password='x', role=role, first_name='Ada', last_name='L'
+        )
+        self.writer = User.objects.create_user(email='writer@example.com', username='writer', password='x', role=role)
+        self.category = ContentCategory.objects.create(name='Exhibits')
+        for status, author in (('draft', self.editor), ('pending_review', self.editor), ('approved', self.writer)):
+            self.create_content(status, author)
+        UserActivity.objects.create(user=self.editor, action='login')
+
+    def create_content(self, status, author, category=None):
+        return Content.objects.create(
+            title=f'{status} by {author.username}', body='...', excerpt='...', file_path='', content_type='image',
+            status=status, author=author, category=category, analytics=ContentAnalytics.objects.create(),
+        )
+
+    def test_view_is_rendered_without_queries(self):
+        dashboard_snapshot.rebuild()
+        request = RequestFactory().get('/dashboard/')
+        request.user = self.editor
+        with self.assertNumQueries(0):
+            context = dashboard_snapshot.context()
+        self.assertEqual(context['total_content_count'], 3)
+        self.assertEqual(context['total_users_count'], 2)
+        self.assertEqual(context['pending_reviews_count'], 1)
+        self.assertEqual(context['recent_activities'][0]['user_name'], 'Ada L')
+        self.assertEqual(context['recent_content_by_author'][0]['author__username'], 'editor')
+        # The admin chrome around it (menus, permissions) is rendered as usual
+        with mock.patch('apps.contentmanagement.views.render') as render, self.assertNumQueries(0):
+            custom_dashboard(request)
+        self.assertEqual(render.call_args.args[2]['total_content_count'], 3)
+        self.assertContains(custom_dashboard(request), 'Ada L')
+
+    def test_incremental_updates_match_recompute(self):
+        """Test that signal-driven updates keep the snapshot equal to a full recomputation"""
+        dashboard_snapshot.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = self.create_content('draft', self.writer)
+            moved.status = 'approved'
+            moved.category = self.category
+            moved.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_content('reviewed', self.writer, category=self.category)
+            Content.objects.get(status='draft').soft_delete()
+            Content.objects.get(status='pending_review').delete()
+            role = self.editor.role
+            User.objects.create_user(email='new@example.com', username='new', password='x', role=role)
+            UserActivity.objects.create(user=self.writer, action='publish')
+
+        incremental = dashboard_snapshot.context()
+        self.assertEqual(incremental['total_content_count'], 3)
+        self.assertEqual(incremental['total_users_count'], 3)
+        self.assertEqual(incremental['content_by_category'][0], {'category__name': 'Exhibits', 'count': 2})
+        self.assertEqual(incremental['recent_activities'][0]['action'], 'publish')
+        dashboard_snapshot.rebuild()
+        self.assertEqual(incremental, dashboard_snapshot.context())
+
+    def test_deferred_loads_drop_the_snapshot(self):
+        dashboard_snapshot.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            content = Content.objects.only('id', 'title').get(status='draft')
+            content.title = 'Renamed'
+            content.save()
+        self.assertIsNone(cache.get(dashboard_snapshot.key))
+        self.assertEqual(dashboard_snapshot.context()['total_content_count'], 3)
+
+    @override_settings(CONTENT_DASHBOARD_MAX_AGE=0)
+    def test_old_snapshot_is_recomputed(self):
+        dashboard_snapshot.rebuild()
+        # Writes that bypass the signals
+        Content.objects.filter(status='draft').update(status='approved')
+        self.assertEqual(dashboard_snapshot.context()['content_status_list'][-1], {
+            'status': 'approved', 'count': 2, 'percentage': 66.67,
+        })
+
+
+
+class ViewSetQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Every list route of the content viewsets keeps a constant number of
+    queries per page
+    """
+    urlconf = 'apps.contentmanagement.urls'
+    url_prefix = '/content'
+
+    def setUp(self):
+        cache.clear()
+        role, _ = Role.objects.get_or_create(name='Editor', description='Editor')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='x', role=role, is_staff=True
+        )
+        self.roles = [Role.objects.create(name=f'Role {index}') for index in range(3)]
+
+    def new_user(self):
+        index = User.objects.count()
+        return User.objects.create_user(
+            email=f'user{index}@example.com', username=f'user{index}', password=None, role=self.roles[index % 3]
+        )
+
+    def new_content(self):
+        category = ContentCategory.objects.create(name=f'Category {Content.objects.count()}')
+        return Content.objects.create(
+            title='Exhibit', body='...', excerpt='...', file_path='', content_type='image', author=self.new_user(),
+            category=category, analytics=ContentAnalytics.objects.create(),
+        )
+
+    def new_media(self):
+        return MediaLibrary.objects.create(
+            file_name='a.png', file_path=f'/media/{MediaLibrary.objects.count()}.png', file_size=1,
+            mime_type='image/png', uploader=self.new_user(),
+        )
+
+    def new_challenge(self):
+        return Challenge.objects.create(title='Hunt', description='...', type='quiz', author=self.new_user())
+
+    def grow(self, model, new):
+        def grow(count):
+            while model.objects.count() < count:
+                new()
+        return grow
+
+    def test_every_list_route_has_a_budget(self):
+        budgeted = {name[len('test_'):].replace('_', '-') for name in dir(self) if name.startswith('test_')}
+        self.assertEqual(list_endpoints(self.urlconf) - budgeted, set())
+
+    def test_content_list(self):
+        self.assertQueryBudget('content-list', 2, self.admin, self.grow(Content, self.new_content))
+
+    def test_content_category_list(self):
+        self.assertQueryBudget('content-category-list', 2, self.admin, self.grow(ContentCategory, self.new_content))
+
+    def test_content_analytics_list(self):
+        self.assertQueryBudget('content-analytics-list', 2, self.admin, self.grow(ContentAnalytics, self.new_content))
+
+    def test_content_approval_list(self):
+        def new():
+            ContentApproval.objects.create(content=self.new_content(), approver=self.new_user())
+        self.assertQueryBudget('content-approval-list', 2, self.admin, self.grow(ContentApproval, new))
+
+    def test_media_library_list(self):
+        self.assertQueryBudget('media-library-list', 2, self.admin, self.grow(MediaLibrary, self.new_media))
+
+    def test_content_media_list(self):
+        def new():
+            ContentMedia.objects.create(content=self.new_content(), media=self.new_media())
+        self.assertQueryBudget('content-media-list', 2, self.admin, self.grow(ContentMedia, new))
+
+    def test_challenge_list(self):
+        self.assertQueryBudget('challenge-list', 2, self.admin, self.grow(Challenge, self.new_challenge))
+
+    def test_marker_list(self):
+        def new():
+            Marker.objects.create(code=f'M{Marker.objects.count()}', content_url='/', challenge=self.new_challenge())
+        self.assertQueryBudget('marker-list', 2, self.admin, self.grow(Marker, new))
+
+    def test_challenge_progress_list(self):
+        def new():
+            ChallengeProgress.objects.create(user=self.new_user(), challenge=self.new_challenge())
+        self.assertQueryBudget('challenge-progress-list', 2, self.admin, self.grow(ChallengeProgress, new))
+
+    def test_feedback_list(self):
+        def new():
+            Feedback.objects.create(user=self.new_user(), rating=5)
+        self.assertQueryBudget('feedback-list', 2, self.admin, self.grow(Feedback, new))
+
+    def test_chat_session_list(self):
+        def new():
+            ChatSession.objects.create(user=self.new_user())
+        self.assertQueryBudget('chat-session-list', 2, self.admin, self.grow(ChatSession, new))
@@ -1,9 +1,6 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Count, Q
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -18,13 +15,14 @@ from .serializers import (
     ChallengeSerializer, MarkerSerializer, ChallengeProgressSerializer,
     FeedbackSerializer, ChatSessionSerializer
 )
+from .counters import ViewCountingMixin
+from .dashboard import dashboard_snapshot
 # from .permissions import IsOwnerOrReadOnly  # Removed since it doesn't exist
-from apps.analyticsmanagement.models import UserActivity, PageView
 
 User = get_user_model()
 
 
-class ContentViewSet(viewsets.ModelViewSet):
+class ContentViewSet(ViewCountingMixin, viewsets.ModelViewSet):
     queryset = Content.objects.all()
     serializer_class = ContentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -137,72 +135,7 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
 def custom_dashboard(request):
     """
     Custom dashboard view with analytics and content stats
+
+    Rendered from the precomputed snapshot (see dashboard.py).
     """
-    # Get content stats
-    total_content_count = Content.objects.filter(deleted_at__isnull=True).count()
-    
-    # Content status breakdown
-    content_status = Content.objects.filter(
-        deleted_at__isnull=True
-    ).values('status').annotate(count=Count('status'))
-    
-    # Calculate percentages for content status
-    content_status_list = []
-    for item in content_status:
-        status_name = item['status']
-        count = item['count']
-        percentage = 0
-        if total_content_count > 0:
-            percentage = round((count / total_content_count) * 100, 2)
-        content_status_list.append({
-            'status': status_name,
-            'count': count,
-            'percentage': percentage
-        })
-    
-    # User stats
-    total_users_count = User.objects.count()
-    
-    # Pending reviews
-    pending_reviews_count = Content.objects.filter(
-        status__in=['pending_review', 'reviewed']
-    ).count()
-    
-    # Page views this month
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    page_views_count = PageView.objects.filter(
-        timestamp__gte=thirty_days_ago
-    ).count()
-    
-    # Recent activities
-    recent_activities = UserActivity.objects.select_related('user').order_by('-timestamp')[:10]
-    
-    # Additional stats for enhanced dashboard
-    recently_created_content = Content.objects.filter(
-        created_at__gte=thirty_days_ago
-    ).order_by('-created_at')[:5]
-    
-    content_by_category = Content.objects.filter(
-        deleted_at__isnull=True
-    ).values('category__name').annotate(count=Count('id')).order_by('-count')
-    
-    # Content by author (for the last 30 days)
-    recent_content_by_author = Content.objects.filter(
-        created_at__gte=thirty_days_ago
-    ).values('author__username', 'author__first_name', 'author__last_name').annotate(
-        count=Count('id')
-    ).order_by('-count')[:5]
-    
-    context = {
-        'total_content_count': total_content_count,
-        'total_users_count': total_users_count,
-        'pending_reviews_count': pending_reviews_count,
-        'page_views_count': page_views_count,
-        'content_status_list': content_status_list,
-        'recent_activities': recent_activities,
-        'recently_created_content': recently_created_content,
-        'content_by_category': content_by_category,
-        'recent_content_by_author': recent_content_by_author,
-    }
-    
-    return render(request, 'wagtail/admin/dashboard.html', context)
\ No newline at end of file
+    return render(request, 'wagtail/admin/dashboard.html', dashboard_snapshot.context())
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""
+Access to the Redis client behind the Django cache, shared by the apps that
+use Redis data structures directly (rate limiting, leaderboards)
+"""
+
+
+def get_redis_client(cache):
+    """Return the raw redis client behind Django's RedisCache, if that is the backend"""
+    client = getattr(cache, '_cache', None)
+    if client is None or not hasattr(client, 'get_client'):
+        return None
+    return client.get_client(write=True)
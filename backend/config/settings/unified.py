@@ -77,6 +77,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # Samples queries and timings of /api/ and /content/ requests (apps/api/profiling.py)
+    'apps.api.profiling.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,6 +128,24 @@ DATABASES = {
     }
 }
 
+# Cache configuration - use a shared Redis cache when REDIS_URL is set so
+# that all workers see the same API key, rate limit and dashboard entries;
+# otherwise each process keeps its own local-memory cache
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -184,6 +204,132 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20
 }
 
+# API integration registry (apps/api/registry.py): how long resolved API keys
+# are kept in the shared cache and in each worker's local map, in seconds
+API_INTEGRATION_CACHE_TIMEOUT = int(os.environ.get('API_INTEGRATION_CACHE_TIMEOUT', 300))
+API_INTEGRATION_LOCAL_CACHE_TIMEOUT = int(os.environ.get('API_INTEGRATION_LOCAL_CACHE_TIMEOUT', 5))
+
+# Number of reverse proxies in front of Django that append to X-Forwarded-For
+# (nginx in the Docker deployment). The client address is taken from just
+# before those hops; 0 ignores X-Forwarded-For and uses REMOTE_ADDR
+API_TRUSTED_PROXY_COUNT = int(os.environ.get('API_TRUSTED_PROXY_COUNT', 1))
+
+# Buffered API request logging (apps/api/log_buffer.py): rows are queued in
+# memory and written with bulk_create every API_LOG_BATCH_SIZE rows or
+# API_LOG_FLUSH_INTERVAL milliseconds; when the queue is full rows are dropped
+# ('drop_newest' or 'drop_oldest') instead of blocking the response
+API_LOG_ASYNC = os.environ.get('API_LOG_ASYNC', 'True').lower() == 'true'
+API_LOG_BUFFER_SIZE = int(os.environ.get('API_LOG_BUFFER_SIZE', 10000))
+API_LOG_BATCH_SIZE = int(os.environ.get('API_LOG_BATCH_SIZE', 500))
+API_LOG_FLUSH_INTERVAL = int(os.environ.get('API_LOG_FLUSH_INTERVAL', 1000))
+API_LOG_DROP_POLICY = os.environ.get('API_LOG_DROP_POLICY', 'drop_newest')
+
+# API rate limiting (apps/api/ratelimit.py): 'sliding_window', 'token_bucket'
+# or the dotted path of a RateLimiter subclass. Integrations are limited by
+# their hourly rate_limit; API_ENDPOINT_RATE_LIMITS adds per-endpoint limits
+# keyed by endpoint pattern, e.g. {'/complete-challenge/*': '30/minute'}
+API_RATE_LIMIT_ALGORITHM = os.environ.get('API_RATE_LIMIT_ALGORITHM', 'sliding_window')
+API_ENDPOINT_RATE_LIMITS = {}
+
+# Marker proximity search (apps/contentmanagement/geo.py), in metres: the
+# first radius tried for nearest-marker queries and the largest radius any
+# query may use
+MARKER_SEARCH_DEFAULT_RADIUS = int(os.environ.get('MARKER_SEARCH_DEFAULT_RADIUS', 1000))
+MARKER_SEARCH_MAX_RADIUS = int(os.environ.get('MARKER_SEARCH_MAX_RADIUS', 50000))
+
+# Rank markers from the in-memory NumPy index (apps/contentmanagement/marker_index.py)
+# instead of the geohash-filtered database search. Each worker holds every live
+# marker's coordinates, about 30 bytes per marker
+MARKER_INDEX_ENABLED = os.environ.get('MARKER_INDEX_ENABLED', 'True').lower() == 'true'
+
+# Location pings (apps/contentmanagement/geofence.py): distance in metres at
+# which a marker counts as in range, and how long a user's last ping is kept
+GEOFENCE_RADIUS = int(os.environ.get('GEOFENCE_RADIUS', 100))
+GEOFENCE_STATE_TIMEOUT = int(os.environ.get('GEOFENCE_STATE_TIMEOUT', 3600))
+
+# Challenge leaderboards (apps/contentmanagement/leaderboard.py): how many days
+# of daily/weekly windows the rebuild_leaderboard command reconciles
+LEADERBOARD_REBUILD_DAYS = int(os.environ.get('LEADERBOARD_REBUILD_DAYS', 8))
+
+# How long responses to requests with an Idempotency-Key header are kept for
+# replay to retries (apps/api/idempotency.py), in seconds
+IDEMPOTENCY_KEY_TIMEOUT = int(os.environ.get('IDEMPOTENCY_KEY_TIMEOUT', 86400))
+
+# Content view counter (apps/contentmanagement/counters.py): views are counted
+# in memory over VIEW_COUNTER_SHARDS locks and added to ContentAnalytics every
+# VIEW_COUNTER_FLUSH_INTERVAL milliseconds, VIEW_COUNTER_BATCH_SIZE rows per UPDATE
+VIEW_COUNTER_ASYNC = os.environ.get('VIEW_COUNTER_ASYNC', 'True').lower() == 'true'
+VIEW_COUNTER_SHARDS = int(os.environ.get('VIEW_COUNTER_SHARDS', 16))
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNTER_FLUSH_INTERVAL', 5000))
+VIEW_COUNTER_BATCH_SIZE = int(os.environ.get('VIEW_COUNTER_BATCH_SIZE', 500))
+
+# Analytics rollups (apps/analyticsmanagement/rollups.py): run the
+# rollup_analytics command every few minutes; rows younger than
+# ANALYTICS_ROLLUP_LAG seconds are left for the next run
+ANALYTICS_ROLLUP_LAG = int(os.environ.get('ANALYTICS_ROLLUP_LAG', 60))
+
+# Analytics dashboard payload cache (apps/analyticsmanagement/dashboard_cache.py):
+# served fresh for ANALYTICS_DASHBOARD_CACHE_TTL seconds, then served stale for
+# up to ANALYTICS_DASHBOARD_STALE_TTL more seconds while one worker recomputes it
+ANALYTICS_DASHBOARD_CACHE_ASYNC = os.environ.get('ANALYTICS_DASHBOARD_CACHE_ASYNC', 'True').lower() == 'true'
+ANALYTICS_DASHBOARD_CACHE_TTL = int(os.environ.get('ANALYTICS_DASHBOARD_CACHE_TTL', 300))
+ANALYTICS_DASHBOARD_STALE_TTL = int(os.environ.get('ANALYTICS_DASHBOARD_STALE_TTL', 3600))
+ANALYTICS_DASHBOARD_LOCK_TIMEOUT = int(os.environ.get('ANALYTICS_DASHBOARD_LOCK_TIMEOUT', 60))
+
+# Page view capture (apps/analyticsmanagement/page_view_buffer.py): views are
+# kept in a ring buffer of PAGE_VIEW_BUFFER_SIZE entries and written with
+# bulk_create every PAGE_VIEW_FLUSH_INTERVAL milliseconds (keep this well below
+# ANALYTICS_ROLLUP_LAG); above PAGE_VIEW_SAMPLE_THRESHOLD of capacity only a
+# shrinking fraction of views, down to PAGE_VIEW_MIN_SAMPLE_RATE, is kept
+PAGE_VIEW_ASYNC = os.environ.get('PAGE_VIEW_ASYNC', 'True').lower() == 'true'
+PAGE_VIEW_BUFFER_SIZE = int(os.environ.get('PAGE_VIEW_BUFFER_SIZE', 20000))
+PAGE_VIEW_BATCH_SIZE = int(os.environ.get('PAGE_VIEW_BATCH_SIZE', 1000))
+PAGE_VIEW_FLUSH_INTERVAL = int(os.environ.get('PAGE_VIEW_FLUSH_INTERVAL', 2000))
+PAGE_VIEW_SAMPLE_THRESHOLD = float(os.environ.get('PAGE_VIEW_SAMPLE_THRESHOLD', 0.5))
+PAGE_VIEW_MIN_SAMPLE_RATE = float(os.environ.get('PAGE_VIEW_MIN_SAMPLE_RATE', 0.1))
+
+# Analytics event sink (apps/analyticsmanagement/event_log.py): "database", or
+# "file" to append page views, content interactions and user activities to
+# segment files in ANALYTICS_EVENT_LOG_DIR, closed every
+# ANALYTICS_SEGMENT_MAX_BYTES bytes or ANALYTICS_SEGMENT_MAX_AGE seconds and
+# loaded with the load_analytics_events command
+ANALYTICS_EVENT_SINK = os.environ.get('ANALYTICS_EVENT_SINK', 'database')
+ANALYTICS_EVENT_LOG_DIR = os.environ.get('ANALYTICS_EVENT_LOG_DIR', os.path.join(BASE_DIR, 'var', 'analytics'))
+ANALYTICS_SEGMENT_MAX_BYTES = int(os.environ.get('ANALYTICS_SEGMENT_MAX_BYTES', 64 * 1024 * 1024))
+ANALYTICS_SEGMENT_MAX_AGE = int(os.environ.get('ANALYTICS_SEGMENT_MAX_AGE', 300))
+
+# Rows fetched per round trip by the streaming exports (apps/api/exports.py);
+# on PostgreSQL this is the server-side cursor's fetch size
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Retention (apps/api/retention.py): run the prune_logs command daily; it drops
+# API logs and page views older than these many months (whole monthly
+# partitions on PostgreSQL once partition_logs has been run, during a quiet
+# period, after migrating) and creates PARTITION_MONTHS_AHEAD future partitions
+API_LOG_RETENTION_MONTHS = int(os.environ.get('API_LOG_RETENTION_MONTHS', 6))
+PAGE_VIEW_RETENTION_MONTHS = int(os.environ.get('PAGE_VIEW_RETENTION_MONTHS', 13))
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+
+# /api/system-stats/ snapshot (apps/api/stats.py): goes stale when content, users
+# or roles change; otherwise fresh for SYSTEM_STATS_CACHE_TTL seconds and served
+# stale while being recomputed for up to SYSTEM_STATS_STALE_TTL more seconds
+SYSTEM_STATS_CACHE_ASYNC = os.environ.get('SYSTEM_STATS_CACHE_ASYNC', 'True').lower() == 'true'
+SYSTEM_STATS_CACHE_TTL = int(os.environ.get('SYSTEM_STATS_CACHE_TTL', 300))
+SYSTEM_STATS_STALE_TTL = int(os.environ.get('SYSTEM_STATS_STALE_TTL', 3600))
+
+# CMS dashboard snapshot (apps/contentmanagement/dashboard.py): updated from
+# signals and recomputed in full by the refresh_dashboard_snapshot command; a
+# snapshot older than this many seconds is also recomputed when it is read
+CONTENT_DASHBOARD_MAX_AGE = int(os.environ.get('CONTENT_DASHBOARD_MAX_AGE', 3600))
+
+# Query profiler (apps/api/profiling.py): this share of the requests to these
+# paths get their queries, DB time and rendering time recorded for the admin
+# report; QUERY_PROFILER_SERVER_TIMING also returns them to staff users in a
+# Server-Timing header
+QUERY_PROFILER_SAMPLE_RATE = float(os.environ.get('QUERY_PROFILER_SAMPLE_RATE', 0.01))
+QUERY_PROFILER_PATHS = ('/api/', '/content/')
+QUERY_PROFILER_SERVER_TIMING = os.environ.get('QUERY_PROFILER_SERVER_TIMING', 'False').lower() == 'true'
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",